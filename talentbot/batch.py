@@ -0,0 +1,544 @@
+"""Offline resume extraction through provider batch APIs.
+
+Backfills and reprocessing run at batch pricing and throughput, without
+competing with interactive calls for rate limits. A job is a directory
+under BATCH_DIR that is carried through four steps:
+
+    python -m talentbot.batch prepare backfill resume1.pdf resume2.docx
+    python -m talentbot.batch prepare reprocess --reprocess
+    python -m talentbot.batch submit backfill
+    python -m talentbot.batch poll backfill --wait
+    python -m talentbot.batch ingest backfill
+"""
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.outputs import LLMResult
+from langchain_core.vectorstores import VectorStore
+from langchain_text_splitters import TextSplitter
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+
+from talentbot.chain import _inputs, _split_combined, extract_prompt, restructure_prompt
+from talentbot.constants import (
+    BATCH_DIR,
+    BATCH_MODEL,
+    BATCH_POLL_INTERVAL,
+    BUCKET_NAME,
+    EXTRACTION_MODE,
+    INGEST_BATCH_SIZE,
+)
+from talentbot.dedup import SourceStore, file_hash, text_hash
+from talentbot.ingest import (
+    IngestError,
+    check_extraction,
+    index_resumes,
+    load_source,
+    upsert_resumes,
+)
+from talentbot.models import ResumeSource
+from talentbot.parsing import ParsingService, get_parsing_service
+from talentbot.prompts import (
+    EXTRACT_FEW_SHOT_AI_TEMPLATE,
+    EXTRACT_FEW_SHOT_SUMMARY,
+    RESTRUCTURE_FEW_SHOT_AI_TEMPLATE,
+    SUMMARY_PROMPT,
+)
+from talentbot.usage import token_usage
+from talentbot.utils import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+
+# batches that won't change anymore, results of expired and cancelled
+# batches cover the requests that finished in time
+FINISHED = ("completed", "expired", "cancelled", "failed")
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+@dataclass
+class BatchItem:
+    """A resume file of a job, already uploaded to S3."""
+
+    id: str
+    name: str
+    cv_file: str
+    file_hash: str
+    text_hash: str
+
+
+class BatchJob:
+    """Requests, state and results of one batch job, kept in `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.requests_file = os.path.join(path, "requests.jsonl")
+        self.results_file = os.path.join(path, "results.jsonl")
+        self._manifest_file = os.path.join(path, "manifest.json")
+        self.state: Dict = {}
+        if os.path.exists(self._manifest_file):
+            with open(self._manifest_file) as f:
+                self.state = json.load(f)
+
+    @classmethod
+    def named(cls, name: str) -> "BatchJob":
+        return cls(os.path.join(BATCH_DIR, name))
+
+    @property
+    def items(self) -> List[BatchItem]:
+        return [BatchItem(**item) for item in self.state.get("items", [])]
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self._manifest_file)
+
+
+def _message_dict(message: BaseMessage) -> Dict:
+    return {"role": _ROLES[message.type], "content": message.content}
+
+
+def build_requests(item_id: str, doc: Document, mode: str, model: str) -> List[Dict]:
+    """Chat completion requests extracting one document, one per prompt."""
+    data = _inputs(doc)
+    if mode == "combined":
+        prompts = {"combined": extract_prompt(data)}
+    else:
+        prompts = {"structured": restructure_prompt(data), "summary": SUMMARY_PROMPT}
+    return [
+        {
+            "custom_id": f"{item_id}:{kind}",
+            "method": "POST",
+            "url": CHAT_COMPLETIONS,
+            "body": {
+                "model": model,
+                "messages": [_message_dict(m) for m in prompt.format_messages(**data)],
+                "temperature": 0,
+                "max_tokens": 4096,
+            },
+        }
+        for kind, prompt in prompts.items()
+    ]
+
+
+def _upload(name: str, type: str, data: bytes, bucket: str) -> str:
+    key = f"resumes/{uuid.uuid4().hex}/{name}"
+    get_s3_client().put_object(Bucket=bucket, Key=key, Body=data, ContentType=type)
+    return key
+
+
+def file_sources(
+    paths: Iterable[str],
+    parser: Optional[ParsingService] = None,
+    bucket: str = BUCKET_NAME,
+    known: Callable[[str], bool] = lambda file_hash: False,
+) -> Iterator[Tuple[BatchItem, Document]]:
+    """Parse and upload new files, skipping those `known` by file hash."""
+    parser = parser or get_parsing_service()
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        hash = file_hash(data)
+        if known(hash):
+            logger.info(f"Skipping {path}, it was ingested before")
+            continue
+        name = os.path.basename(path)
+        type = mimetypes.guess_type(path)[0] or "text/plain"
+        try:
+            doc = parser.parse(data, type, name)
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {e}")
+            continue
+        item = BatchItem(
+            id=hash[:16],
+            name=name,
+            cv_file=_upload(name, type, data, bucket),
+            file_hash=hash,
+            text_hash=text_hash(doc.page_content),
+        )
+        yield item, doc
+
+
+def stored_sources(
+    engine: Engine,
+    parser: Optional[ParsingService] = None,
+    bucket: str = BUCKET_NAME,
+) -> Iterator[Tuple[BatchItem, Document]]:
+    """The latest file of every stored resume, for re-extraction."""
+    with Session(engine) as session:
+        SourceStore(session)  # creates the table on a fresh database
+        rows = session.scalars(select(ResumeSource).order_by(ResumeSource.created_at))
+        latest = {row.resume_id: row for row in rows}
+        session.expunge_all()
+    for row in latest.values():
+        try:
+            doc = load_source(row, parser, bucket)
+        except Exception as e:
+            logger.warning(f"Skipping {row.cv_file}: {e}")
+            continue
+        item = BatchItem(
+            id=row.file_hash[:16],
+            name=row.cv_file.rsplit("/", 1)[-1],
+            cv_file=row.cv_file,
+            file_hash=row.file_hash,
+            text_hash=row.text_hash,
+        )
+        yield item, doc
+
+
+def prepare(
+    job: BatchJob,
+    sources: Iterable[Tuple[BatchItem, Document]],
+    mode: str = EXTRACTION_MODE,
+    model: str = BATCH_MODEL,
+) -> int:
+    """Write the requests of `sources` to the job, return the file count."""
+    if mode not in ("separate", "combined"):
+        # the summary of "summary" mode needs the structured result first,
+        # a second round trip a batch can't make
+        logger.info(f"Extraction mode {mode!r} can't run in a batch, using separate")
+        mode = "separate"
+    os.makedirs(job.path, exist_ok=True)
+    items = {}
+    with open(job.requests_file, "w") as f:
+        for item, doc in sources:
+            if item.id in items:
+                continue  # the same file twice
+            for request in build_requests(item.id, doc, mode, model):
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            items[item.id] = asdict(item)
+    job.state = {
+        "mode": mode,
+        "model": model,
+        "status": "prepared",
+        "items": list(items.values()),
+    }
+    job.save()
+    return len(items)
+
+
+class OpenAIBatchProvider:
+    """The OpenAI Batch API, at half the price of synchronous calls."""
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI()
+        self.client = client
+
+    def submit(self, requests_file: str) -> str:
+        with open(requests_file, "rb") as f:
+            file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=file.id,
+            endpoint=CHAT_COMPLETIONS,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def _example_reply(body: Dict) -> str:
+    system = body["messages"][0]["content"]
+    if '"summary"' in system:
+        return EXTRACT_FEW_SHOT_AI_TEMPLATE
+    if "<schema>" in system:
+        return RESTRUCTURE_FEW_SHOT_AI_TEMPLATE
+    return EXTRACT_FEW_SHOT_SUMMARY
+
+
+class FakeBatchProvider:
+    """Answers batches locally and at once, for tests and dry runs.
+
+    `respond` maps a request body to the reply text, by default the
+    few-shot example of the prompt, so every file extracts to the same
+    sample resume: only ingest a fake job into a scratch database.
+    """
+
+    name = "fake"
+
+    def __init__(self, path: str, respond: Callable[[Dict], str] = _example_reply):
+        self.path = path
+        self.respond = respond
+
+    def _output(self, batch_id: str) -> str:
+        return os.path.join(self.path, f"{batch_id}.jsonl")
+
+    def submit(self, requests_file: str) -> str:
+        batch_id = f"batch_fake_{uuid.uuid4().hex}"
+        with open(requests_file) as f, open(self._output(batch_id), "w") as out:
+            for line in f:
+                request = json.loads(line)
+                content = self.respond(request["body"])
+                response = {
+                    "status_code": 200,
+                    "body": {
+                        "choices": [
+                            {"message": {"role": "assistant", "content": content}}
+                        ],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0},
+                    },
+                }
+                out.write(
+                    json.dumps(
+                        {
+                            "custom_id": request["custom_id"],
+                            "response": response,
+                            "error": None,
+                        }
+                    )
+                    + "\n"
+                )
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return "completed"
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        with open(self._output(batch_id)) as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def get_provider(name: str, job: BatchJob):
+    if name == "openai":
+        return OpenAIBatchProvider()
+    if name == "fake":
+        return FakeBatchProvider(job.path)
+    raise ValueError(f"Unknown batch provider {name!r}")
+
+
+def submit(job: BatchJob, provider) -> str:
+    if job.state.get("batch_id"):
+        raise ValueError(f"Job {job.path} was already submitted")
+    job.state.update(
+        provider=provider.name,
+        batch_id=provider.submit(job.requests_file),
+        status="submitted",
+    )
+    job.save()
+    return job.state["batch_id"]
+
+
+def poll(
+    job: BatchJob, provider, wait: bool = False, interval: float = BATCH_POLL_INTERVAL
+) -> str:
+    """Update the job status, download the results once the batch finished."""
+    while True:
+        status = provider.status(job.state["batch_id"])
+        if status in FINISHED or not wait:
+            break
+        logger.info(f"Batch {job.state['batch_id']} is {status}")
+        time.sleep(interval)
+    if status in FINISHED:
+        with open(job.results_file, "w") as f:
+            for line in provider.results(job.state["batch_id"]):
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    job.state["status"] = status
+    job.save()
+    return status
+
+
+def _replies(job: BatchJob) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str], Dict]:
+    """Reply texts and errors by item id, and the summed token usage."""
+    replies: Dict[str, Dict[str, str]] = {}
+    errors: Dict[str, str] = {}
+    usage = {"input_tokens": 0, "output_tokens": 0}
+    with open(job.results_file) as f:
+        for line in f:
+            result = json.loads(line)
+            item_id, kind = result["custom_id"].rsplit(":", 1)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or response.get("body", {}).get("error")
+                errors[item_id] = str(error)
+                continue
+            body = response["body"]
+            replies.setdefault(item_id, {})[kind] = body["choices"][0]["message"][
+                "content"
+            ]
+            call = token_usage(
+                LLMResult(generations=[], llm_output={"token_usage": body["usage"]})
+            )
+            usage["input_tokens"] += call["input_tokens"]
+            usage["output_tokens"] += call["output_tokens"]
+    return replies, errors, usage
+
+
+def _result(replies: Dict[str, str]) -> Dict:
+    parser = JsonOutputParser()
+    if "combined" in replies:
+        return _split_combined(parser.parse(replies["combined"]))
+    return {
+        "structured": parser.parse(replies["structured"]),
+        "summary": replies.get("summary"),
+    }
+
+
+def ingest(
+    job: BatchJob,
+    engine: Engine,
+    db: VectorStore,
+    text_splitter: TextSplitter,
+    batch_size: int = INGEST_BATCH_SIZE,
+) -> Dict:
+    """Store and index the results of a finished job.
+
+    Goes through the same upsert, index and source record steps as the
+    upload pipeline, `batch_size` resumes at a time. The ids of ingested
+    items are saved after every chunk, so running it again after a crash
+    resumes with the next chunk.
+    """
+    replies, errors, usage = _replies(job)
+    done = set(job.state.get("ingested_items", []))
+    ready = []
+    for item in job.items:
+        if item.id in errors or item.id in done:
+            continue
+        try:
+            resume, summary = check_extraction(_result(replies.get(item.id, {})))
+        except (IngestError, KeyError, ValueError) as e:
+            errors[item.id] = str(e) or "No result"
+            continue
+        ready.append((item, resume, summary))
+    for item in job.items:
+        if item.id in errors:
+            logger.warning(f"Cannot ingest {item.name}: {errors[item.id]}")
+
+    for i in range(0, len(ready), batch_size):
+        chunk = ready[i : i + batch_size]
+        with Session(engine) as session:
+            ids = upsert_resumes(
+                session,
+                [(resume, item.cv_file, summary) for item, resume, summary in chunk],
+            )
+        index_resumes(
+            db,
+            text_splitter,
+            {resume_id: summary for (_, _, summary), resume_id in zip(chunk, ids)},
+        )
+        # recorded after indexing, an unsearchable resume is never a duplicate
+        with Session(engine) as session:
+            SourceStore(session).add_many(
+                [
+                    dict(
+                        file_hash=item.file_hash,
+                        text_hash=item.text_hash,
+                        resume_id=resume_id,
+                        cv_file=item.cv_file,
+                        structured=resume.dict(),
+                        summary=summary,
+                    )
+                    for (item, resume, summary), resume_id in zip(chunk, ids)
+                ]
+            )
+        done.update(item.id for item, _, _ in chunk)
+        job.state.update(status="ingesting", ingested_items=sorted(done))
+        job.save()
+    job.state["status"] = "ingested"
+    job.save()
+    return {"ingested": len(ready), "failed": len(errors), **usage}
+
+
+def main():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from sqlalchemy import create_engine
+
+    from talentbot.constants import DB_DSN, INDEX_RESUMES
+    from talentbot.retriever import create_vector_store
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    prepare_parser = commands.add_parser("prepare", help="write the requests")
+    prepare_parser.add_argument("job")
+    prepare_parser.add_argument("files", nargs="*")
+    prepare_parser.add_argument(
+        "--reprocess", action="store_true", help="re-extract every stored resume"
+    )
+    prepare_parser.add_argument(
+        "--skip-duplicates", action="store_true", help="skip files ingested before"
+    )
+    prepare_parser.add_argument(
+        "--mode", choices=("separate", "combined"), default=EXTRACTION_MODE
+    )
+    prepare_parser.add_argument("--model", default=BATCH_MODEL)
+    submit_parser = commands.add_parser("submit", help="send the batch")
+    submit_parser.add_argument("job")
+    submit_parser.add_argument(
+        "--provider", choices=("openai", "fake"), default="openai"
+    )
+    poll_parser = commands.add_parser("poll", help="check and download results")
+    poll_parser.add_argument("job")
+    poll_parser.add_argument("--wait", action="store_true")
+    ingest_parser = commands.add_parser("ingest", help="store and index results")
+    ingest_parser.add_argument("job")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    job = BatchJob.named(args.job)
+    if args.command == "prepare":
+        engine = create_engine(DB_DSN)
+        if args.reprocess:
+            sources = stored_sources(engine)
+        else:
+            known = set()
+            if args.skip_duplicates:
+                hashes = []
+                for path in args.files:
+                    with open(path, "rb") as f:
+                        hashes.append(file_hash(f.read()))
+                with Session(engine) as session:
+                    known = set(SourceStore(session).by_file_hash(hashes))
+            sources = file_sources(args.files, known=known.__contains__)
+        count = prepare(job, sources, args.mode, args.model)
+        print(f"Prepared {count} files in {job.path}")
+    elif args.command == "submit":
+        batch_id = submit(job, get_provider(args.provider, job))
+        print(f"Submitted batch {batch_id}")
+    elif args.command == "poll":
+        status = poll(job, get_provider(job.state["provider"], job), wait=args.wait)
+        print(f"Batch {job.state['batch_id']} is {status}")
+    elif args.command == "ingest":
+        if job.state.get("status") not in FINISHED:
+            parser.error(f"Job {args.job} is {job.state.get('status')}, poll it first")
+        db = create_vector_store(INDEX_RESUMES)
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1200, chunk_overlap=250
+        )
+        r = ingest(job, create_engine(DB_DSN), db, text_splitter)
+        print(
+            f"Ingested {r['ingested']} resumes, {r['failed']} failed, "
+            f"{r['input_tokens']} input and {r['output_tokens']} output tokens"
+        )
+
+
+if __name__ == "__main__":
+    main()
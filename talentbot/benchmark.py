@@ -0,0 +1,125 @@
+"""Compare extraction modes on sample resumes.
+
+Usage:
+    python -m talentbot.benchmark resume1.pdf resume2.docx \\
+        --modes separate combined summary --model openai_gpt_4o
+"""
+import argparse
+import asyncio
+import mimetypes
+import os
+import time
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from talentbot.chain import create_extraction_chain, llm
+from talentbot.constants import MODEL_OPTIONS
+from talentbot.parsing import get_parsing_service
+from talentbot.prompts import (
+    EXTRACT_PROMPT,
+    RESTRUCTURE_PROMPT,
+    SUMMARY_FROM_JSON_PROMPT,
+    SUMMARY_PROMPT,
+)
+from talentbot.scheduler import BULK
+from talentbot.tokens import count_message_tokens
+from talentbot.usage import UsageTracker
+
+MODES = ("separate", "combined", "summary")
+
+
+def load(paths: List[str]) -> List[Document]:
+    parser = get_parsing_service()
+    docs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        type = mimetypes.guess_type(path)[0] or "text/plain"
+        docs.append(parser.parse(data, type, os.path.basename(path)))
+    return docs
+
+
+def prefix_tokens() -> Dict[str, int]:
+    """Tokens of the static prompt prefixes, everything before the resume."""
+    prompts = {
+        "restructure": RESTRUCTURE_PROMPT,
+        "summary": SUMMARY_PROMPT,
+        "extract": EXTRACT_PROMPT,
+        "summary_from_json": SUMMARY_FROM_JSON_PROMPT,
+    }
+    return {
+        name: count_message_tokens(
+            prompt.format_messages(input="", current_time="")[:-1]
+        )
+        for name, prompt in prompts.items()
+    }
+
+
+async def run_mode(
+    mode: str, docs: List[Document], model: str, concurrency: int
+) -> Dict:
+    chain = create_extraction_chain(llm, mode=mode).with_config(
+        configurable={"llm": model}
+    )
+    tracker = UsageTracker()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def extract(doc: Document):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await chain.ainvoke(
+                    doc,
+                    config={"callbacks": [tracker], "metadata": {"llm_priority": BULK}},
+                )
+            except Exception as e:
+                result = {"structured": {"error": str(e)}}
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(extract(doc) for doc in docs))
+    elapsed = time.perf_counter() - start
+    failed = sum(
+        1
+        for r in results
+        if "error" in (r.get("structured") or {"error": True}) or not r.get("summary")
+    )
+    return {
+        "mode": mode,
+        "files": len(docs),
+        "failed": failed,
+        "elapsed": elapsed,
+        "latency": sum(latencies) / max(len(latencies), 1),
+        **tracker.totals(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--model", choices=list(MODEL_OPTIONS), default="openai_gpt_4o")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    docs = load(args.files)
+    prefixes = ", ".join(f"{name} {n}" for name, n in prefix_tokens().items())
+    print(f"Prompt prefix tokens: {prefixes}")
+    print(
+        f"{'mode':<10} {'files':>5} {'failed':>6} {'calls':>5} {'input':>9} "
+        f"{'cached':>9} {'output':>8} {'latency':>8} {'total':>8}"
+    )
+    for mode in args.modes:
+        r = asyncio.run(run_mode(mode, docs, args.model, args.concurrency))
+        print(
+            f"{r['mode']:<10} {r['files']:>5} {r['failed']:>6} {r['calls']:>5} "
+            f"{r['input_tokens']:>9} {r['cached_tokens']:>9} {r['output_tokens']:>8} "
+            f"{r['latency']:>7.1f}s {r['elapsed']:>7.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
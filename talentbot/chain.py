@@ -1,31 +1,30 @@
+import json
 import os
 import time
+from typing import Dict
 
 import boto3
-from langchain_anthropic import ChatAnthropic
-from langchain_community.document_loaders import (
-    UnstructuredFileLoader,
-)
 from langchain_core.documents import Document
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import (
     ConfigurableField,
     Runnable,
     RunnableLambda,
-)
-from langchain_openai import (
-    ChatOpenAI,
+    RunnableParallel,
+    RunnablePassthrough,
 )
 
-from talentbot.document_loader import (
-    DocDocumentLoader,
-    DocxDocumentLoader,
-    PDFDocumentLoader,
-)
+from talentbot.constants import EXTRACTION_MODE
+from talentbot.llms import CachingChatAnthropic, ScheduledChatOpenAI
 from talentbot.models import JsonResume
+from talentbot.parsing import get_parsing_service
 from talentbot.prompts import (
+    EXTRACT_CSV_PROMPT,
+    EXTRACT_PROMPT,
     RESTRUCTURE_CSV_PROMPT,
     RESTRUCTURE_PROMPT,
+    SUMMARY_FROM_JSON_PROMPT,
     SUMMARY_PROMPT,
 )
 
@@ -33,37 +32,8 @@ s3 = boto3.client("s3")
 
 
 def load_docunment(file) -> Document:
-    is_xlsx = (
-        file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    if is_xlsx:
-        import pandas as pd
-        from openpyxl import load_workbook
-
-        wb = load_workbook(file)
-        sheet = wb.active
-        df = pd.DataFrame(sheet.values)
-        text = df.to_csv(sep="\t", index=False)
-        doc = Document(page_content=text, metadata={"is_csv": True})
-    else:
-        if file.type == "application/msword":
-            loader_name = DocDocumentLoader
-        elif (
-            file.type
-            == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        ):
-            loader_name = DocxDocumentLoader
-        elif file.type == "application/pdf":
-            loader_name = PDFDocumentLoader
-        else:
-            loader_name = UnstructuredFileLoader
-        loader = loader_name(
-            None,
-            file=file,
-            strategy="fast",  # without OCR
-        )
-        doc = loader.load()[0]
-    return doc
+    file.seek(0)
+    return get_parsing_service().parse(file.read(), file.type, file.name)
 
 
 def get_current_utc_time():
@@ -72,32 +42,114 @@ def get_current_utc_time():
     return current_time
 
 
-def create_resume_chain(llm: Runnable):
-    def route(data):
-        if data.get("is_csv", False):
-            return RESTRUCTURE_CSV_PROMPT
-        return RESTRUCTURE_PROMPT
+def _inputs(doc: Document) -> Dict:
+    return {
+        "input": doc.page_content,
+        "is_csv": doc.metadata.get("is_csv", False),
+        "current_time": get_current_utc_time(),
+    }
+
+
+def _split_combined(output: Dict) -> Dict:
+    if not isinstance(output, dict) or "resume" not in output:
+        error = output.get("error") if isinstance(output, dict) else None
+        return {"structured": {"error": error or "Cannot process the resume"}}
+    return {"structured": output["resume"], "summary": output.get("summary")}
+
+
+def _resume_json(data: Dict) -> str:
+    # minified and without empty fields, much shorter than the raw text
+    structured = data["structured"]
+    if "error" in structured:
+        return ""
+    return json.dumps(
+        {k: v for k, v in structured.items() if v not in (None, [], {}, "")},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def restructure_prompt(data: Dict) -> ChatPromptTemplate:
+    if data.get("is_csv", False):
+        return RESTRUCTURE_CSV_PROMPT
+    return RESTRUCTURE_PROMPT
+
 
+def extract_prompt(data: Dict) -> ChatPromptTemplate:
+    if data.get("is_csv", False):
+        return EXTRACT_CSV_PROMPT
+    return EXTRACT_PROMPT
+
+
+def create_extraction_chain(llm: Runnable, mode: str = EXTRACTION_MODE):
+    """Structured resume and summary from an already parsed document.
+
+    Modes:
+        separate: restructure and summarize the text in two parallel calls
+        combined: one call returns both, the text is sent once
+        summary: restructure the text, then summarize the structured JSON
+    """
+
+    # run names label the calls in the usage logs
     jsonresume_chain = (
-        RunnableLambda(route) | llm | JsonOutputParser(pydantic_object=JsonResume)
+        RunnableLambda(restructure_prompt)
+        | llm.with_config(run_name="restructure")
+        | JsonOutputParser(pydantic_object=JsonResume)
     )
-    summary_chain = SUMMARY_PROMPT | llm | StrOutputParser()
-    chain = (
-        RunnableLambda(load_docunment)
-        | {
-            "input": lambda doc: doc.page_content,
-            "is_csv": lambda doc: doc.metadata.get("is_csv", False),
-            "current_time": lambda _: get_current_utc_time(),
-        }
-        | {
-            "structured": jsonresume_chain,
-            "summary": summary_chain,
-        }
+    if mode == "combined":
+        return (
+            RunnableLambda(_inputs)
+            | RunnableLambda(extract_prompt)
+            | llm.with_config(run_name="extract")
+            | JsonOutputParser()
+            | RunnableLambda(_split_combined)
+        )
+    if mode == "summary":
+        summary_chain = (
+            RunnableParallel(
+                input=RunnableLambda(_resume_json),
+                current_time=lambda data: data["current_time"],
+            )
+            | SUMMARY_FROM_JSON_PROMPT
+            | llm.with_config(run_name="summary")
+            | StrOutputParser()
+        )
+
+        def summarize(data):
+            # no summary of a resume that couldn't be restructured
+            structured = data["structured"]
+            if not isinstance(structured, dict) or "error" in structured:
+                return "I don't know"
+            return summary_chain
+
+        return (
+            RunnableLambda(_inputs)
+            | RunnablePassthrough.assign(structured=jsonresume_chain)
+            | RunnablePassthrough.assign(summary=RunnableLambda(summarize))
+            | RunnableLambda(
+                lambda data: {
+                    "structured": data["structured"],
+                    "summary": data["summary"],
+                }
+            )
+        )
+    if mode != "separate":
+        raise ValueError(f"Unknown extraction mode {mode!r}")
+    summary_chain = (
+        SUMMARY_PROMPT | llm.with_config(run_name="summary") | StrOutputParser()
+    )
+    chain = RunnableLambda(_inputs) | RunnableParallel(
+        structured=jsonresume_chain,
+        summary=summary_chain,
     )
     return chain
 
 
-llm = ChatOpenAI(
+def create_resume_chain(llm: Runnable):
+    return RunnableLambda(load_docunment) | create_extraction_chain(llm)
+
+
+llm = ScheduledChatOpenAI(
     model="gpt-4o",
     temperature=0,
     max_tokens=4096,
@@ -106,7 +158,7 @@ llm = ChatOpenAI(
     # When configuring the end runnable, we can then use this id to configure this field
     ConfigurableField(id="llm"),
     default_key="openai_gpt_4o",
-    anthropic_claude_3_opus=ChatAnthropic(
+    anthropic_claude_3_opus=CachingChatAnthropic(
         model="claude-3-opus-20240229",
         temperature=0,
         max_tokens=4096,
@@ -120,4 +172,5 @@ llm = ChatOpenAI(
     # ),
 )
 
+extraction_chain = create_extraction_chain(llm)
 resume_chain = create_resume_chain(llm)
@@ -0,0 +1,76 @@
+"""Content hashes of uploaded files, used to skip re-ingesting duplicates."""
+import hashlib
+import re
+import unicodedata
+from typing import Dict, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.models import ResumeSource, ensure_tables
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase words only, so layout and punctuation changes don't matter."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class SourceStore:
+    """Maps file and text hashes to the resumes extracted from them.
+
+    Rows are deleted with their resume, so a match always points to an
+    existing resume.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        ensure_tables(session.get_bind(), ResumeSource)
+
+    def by_file_hash(self, hashes: Iterable[str]) -> Dict[str, ResumeSource]:
+        hashes = list(set(hashes))
+        if not hashes:
+            return {}
+        rows = self.session.scalars(
+            select(ResumeSource).where(ResumeSource.file_hash.in_(hashes))
+        )
+        return {row.file_hash: row for row in rows}
+
+    def by_text_hash(self, hashes: Iterable[str]) -> Dict[str, ResumeSource]:
+        hashes = list(set(hashes))
+        if not hashes:
+            return {}
+        rows = self.session.scalars(
+            select(ResumeSource)
+            .where(ResumeSource.text_hash.in_(hashes))
+            .order_by(ResumeSource.created_at)
+        )
+        # the most recent upload wins
+        return {row.text_hash: row for row in rows}
+
+    def add_many(self, rows: List[Dict]) -> None:
+        """Insert or update rows of `ResumeSource` column values."""
+        # one statement can't touch the same row twice
+        rows = list({row["file_hash"]: row for row in rows}.values())
+        if not rows:
+            return
+        stmt = pg_insert(ResumeSource).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ResumeSource.file_hash],
+            set_={
+                key: stmt.excluded[key]
+                for key in rows[0]
+                if key not in ("file_hash", "created_at")
+            },
+        )
+        self.session.execute(stmt)
+        self.session.commit()
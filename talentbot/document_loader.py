@@ -11,13 +11,6 @@ class PDFDocumentLoader(UnstructuredFileLoader):
         return partition_pdf(filename=self.file_path, **self.unstructured_kwargs)
 
 
-class DocDocumentLoader(UnstructuredFileLoader):
-    def _get_elements(self) -> List:
-        from unstructured.partition.doc import partition_doc
-
-        return partition_doc(filename=self.file_path, **self.unstructured_kwargs)
-
-
 class DocxDocumentLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
         from unstructured.partition.docx import partition_docx
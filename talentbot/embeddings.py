@@ -0,0 +1,185 @@
+"""On-disk embedding cache keyed by chunk content hash."""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Sequence
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from talentbot.constants import (
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MODEL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Fixed-capacity store of float32 vectors backed by a memory-mapped file.
+
+    The key -> slot mapping and the last access time of every slot are kept
+    in a SQLite file next to the vectors. Once all slots are used, new
+    vectors overwrite the least recently used ones.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBEDDING_CACHE_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._conn = sqlite3.connect(
+            os.path.join(path, "index.sqlite3"), check_same_thread=False
+        )
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_entries_last_used ON entries (last_used);
+            """
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row:
+            self._open(int(row[0]))
+
+    def _open(self, dim: int):
+        file = os.path.join(self.path, "vectors.f32")
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'capacity'"
+        ).fetchone()
+        # never shrink: existing slots may still be referenced
+        capacity = max(self.max_entries, int(row[0]) if row else 0)
+        size = capacity * dim * np.dtype(np.float32).itemsize
+        with open(file, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(
+            file, dtype=np.float32, mode="r+", shape=(capacity, dim)
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("dim", str(dim)), ("capacity", str(capacity))],
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        if self._vectors is None or not keys:
+            return {}
+        found = {}
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, slot in rows:
+                    found[key] = np.array(self._vectors[slot])
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, Sequence[float]]):
+        if not items:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._open(len(next(iter(items.values()))))
+            capacity = self._vectors.shape[0]
+            now = time.time()
+            used = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            for key, vector in items.items():
+                row = self._conn.execute(
+                    "SELECT slot FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    slot = row[0]
+                elif used < capacity:
+                    slot = used
+                    used += 1
+                else:
+                    # evict the least recently used entry and reuse its slot
+                    slot = self._conn.execute(
+                        "SELECT slot FROM entries ORDER BY last_used LIMIT 1"
+                    ).fetchone()[0]
+                    self._conn.execute("DELETE FROM entries WHERE slot = ?", (slot,))
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                    (key, slot, now),
+                )
+            self._vectors.flush()
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only embeds texts missing from the cache."""
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+        if missing:
+            embedded = self.underlying.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+        logger.debug(
+            f"Embedded {len(missing)} of {len(texts)} texts, "
+            f"{len(texts) - len(missing)} cache hits"
+        )
+        return [list(map(float, vectors[key])) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # queries are rarely repeated verbatim, don't let them evict chunks
+        return self.underlying.embed_query(text)
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed search queries in one pass, without caching them."""
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.underlying
+    return embeddings.embed_documents(texts)
+
+
+@lru_cache(maxsize=None)
+def create_embedding_function(model_name: str = EMBEDDING_MODEL) -> Embeddings:
+    """Return the process-wide embedding function for the given model."""
+    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+    if not EMBEDDING_CACHE_DIR:
+        return embeddings
+    cache = EmbeddingCache(os.path.join(EMBEDDING_CACHE_DIR, model_name))
+    return CachedEmbeddings(embeddings, cache)
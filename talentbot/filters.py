@@ -0,0 +1,267 @@
+"""Structured filters applied before searching resumes.
+
+The hard requirements of a job description (industry, city, minimum years
+of experience) are extracted by an LLM and resolved in SQL against the
+industry predictions and the precomputed facets of each resume. The
+matching resume ids are pushed down to the vector and full-text searches,
+so fewer irrelevant candidates reach the reranker.
+"""
+import logging
+import re
+import unicodedata
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain.pydantic_v1 import BaseModel, Field, validator
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import Runnable
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.cache import TTLCache
+from talentbot.constants import (
+    INDUSTRIES,
+    SEARCH_FILTER_CACHE_SIZE,
+    SEARCH_FILTER_MIN_CONFIDENCE,
+)
+from talentbot.models import Resume, ResumeFacet, ResumeIndustry
+from talentbot.prompts import SEARCH_FILTER_PROMPT
+from talentbot.utils import jd_hash
+
+logger = logging.getLogger(__name__)
+
+# filters matching more resumes than this aren't pushed down to the searches
+MAX_FILTER_IDS = 10000
+
+_DATE_FORMATS = ("%b %Y", "%B %Y", "%m/%Y", "%Y-%m", "%Y-%m-%d", "%Y")
+_PRESENT = {"present", "now", "current", "today", "nay", "hien tai"}
+_CITY_WORDS = {"city", "tp", "thanh", "pho"}
+_CITY_ALIASES = {"hcm": "hochiminh", "hcmc": "hochiminh", "saigon": "hochiminh"}
+
+
+def _ascii(text: str) -> str:
+    text = text.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def normalize_city(city: Optional[str]) -> Optional[str]:
+    """Lowercase ASCII city name without spaces and "city" words, so
+    "TP. Hồ Chí Minh", "Ho Chi Minh City" and "HCMC" all become "hochiminh"."""
+    if not city:
+        return None
+    words = re.findall(r"[a-z0-9]+", _ascii(city))
+    name = "".join(word for word in words if word not in _CITY_WORDS)
+    return _CITY_ALIASES.get(name, name) or None
+
+
+def parse_month(value: Optional[str], today: Optional[date] = None) -> Optional[date]:
+    """First day of the month of a resume date, `today` for "Present"."""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    if _ascii(value) in _PRESENT:
+        return (today or date.today()).replace(day=1)
+    for format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format).date().replace(day=1)
+        except ValueError:
+            continue
+    return None
+
+
+def years_of_experience(
+    work: Iterable[Dict], today: Optional[date] = None
+) -> Optional[float]:
+    """Total years of the jobs in `work`, overlapping periods counted once.
+
+    Jobs without a readable start or end date are skipped, returns None
+    when no job has both.
+    """
+    today = today or date.today()
+    periods: List[Tuple[date, date]] = []
+    for item in work or []:
+        if not isinstance(item, dict):
+            continue
+        start = parse_month(item.get("start_date"), today)
+        end = parse_month(item.get("end_date"), today)
+        if start and end and start <= end:
+            periods.append((start, min(end, today)))
+    if not periods:
+        return None
+    months = 0
+    current_start, current_end = None, None
+    for start, end in sorted(periods):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                months += _months(current_start, current_end)
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    months += _months(current_start, current_end)
+    return round(months / 12, 1)
+
+
+def _months(start: date, end: date) -> int:
+    # both ends inclusive, "Jan 2020 - Jan 2020" is one month
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def facets(data: Dict) -> Dict:
+    """Facet column values of a resume."""
+    location = data.get("location") or {}
+    return {
+        "years_experience": years_of_experience(data.get("work") or []),
+        "city": normalize_city(location.get("city")),
+    }
+
+
+class SearchFilters(BaseModel):
+    """Hard requirements of a job description."""
+
+    industries: List[str] = Field(default_factory=list)
+    city: Optional[str] = None
+    min_years: Optional[float] = None
+
+    @validator("industries", pre=True)
+    def known_industries(cls, value):
+        # the LLM sometimes invents industries, they would match nothing
+        return [industry for industry in value or [] if industry in INDUSTRIES]
+
+    @validator("min_years", pre=True)
+    def positive_years(cls, value):
+        try:
+            return float(value) if value and float(value) > 0 else None
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def empty(self) -> bool:
+        return not (self.industries or self.city or self.min_years)
+
+    def describe(self) -> str:
+        parts = []
+        if self.industries:
+            parts.append(", ".join(self.industries))
+        if self.city:
+            parts.append(self.city)
+        if self.min_years:
+            parts.append(f"{self.min_years:g}+ years")
+        return "; ".join(parts)
+
+
+class FacetStore:
+    """Facets of resumes, and the resumes matching search filters.
+    `update` runs in the resume upsert transaction, call
+    `ensure_resume_tables` before the first use.
+    """
+
+    def __init__(
+        self, session: Session, min_confidence: float = SEARCH_FILTER_MIN_CONFIDENCE
+    ):
+        self.session = session
+        self.min_confidence = min_confidence
+
+    def update(self, resumes: Dict[int, Dict]) -> None:
+        """Recompute the facets of ``{resume_id: data}``, without committing."""
+        if not resumes:
+            return
+        stmt = pg_insert(ResumeFacet).values(
+            [
+                {"resume_id": resume_id, **facets(data)}
+                for resume_id, data in resumes.items()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ResumeFacet.resume_id],
+            set_={
+                "years_experience": stmt.excluded.years_experience,
+                "city": stmt.excluded.city,
+                "updated_at": func.now(),
+            },
+        )
+        self.session.execute(stmt)
+
+    def resume_ids(self, filters: SearchFilters) -> List[int]:
+        """Ids of the resumes matching `filters`.
+
+        A resume whose city or experience is unknown is not excluded by it.
+        """
+        stmt = select(Resume.id)
+        if filters.industries:
+            stmt = stmt.where(
+                Resume.id.in_(
+                    select(ResumeIndustry.resume_id).where(
+                        ResumeIndustry.industry.in_(filters.industries),
+                        ResumeIndustry.confidence >= self.min_confidence,
+                    )
+                )
+            )
+        city = normalize_city(filters.city)
+        if city or filters.min_years:
+            stmt = stmt.outerjoin(ResumeFacet, ResumeFacet.resume_id == Resume.id)
+        if city:
+            stmt = stmt.where(or_(ResumeFacet.city.is_(None), ResumeFacet.city == city))
+        if filters.min_years:
+            stmt = stmt.where(
+                or_(
+                    ResumeFacet.years_experience.is_(None),
+                    ResumeFacet.years_experience >= filters.min_years,
+                )
+            )
+        return list(self.session.scalars(stmt.limit(MAX_FILTER_IDS + 1)))
+
+
+@lru_cache(maxsize=None)
+def get_filter_cache() -> TTLCache:
+    return TTLCache(maxsize=SEARCH_FILTER_CACHE_SIZE)
+
+
+class SearchFilterExtractor:
+    """Extracts the `SearchFilters` of a job description with an LLM.
+
+    Results are cached per job description and model. A failed extraction
+    returns empty filters, the search then runs over all resumes.
+    """
+
+    def __init__(self, llm: Runnable, model: str, cache: Optional[TTLCache] = None):
+        self.chain = (SEARCH_FILTER_PROMPT | llm | JsonOutputParser()).with_config(
+            run_name="search_filters"
+        )
+        self.model = model
+        self.cache = cache if cache is not None else get_filter_cache()
+
+    def _parse(self, output) -> SearchFilters:
+        if not isinstance(output, dict):
+            raise ValueError(f"Expected a JSON object, got {output!r}")
+        return SearchFilters.parse_obj(output)
+
+    def extract(self, jd: str, callbacks=None) -> SearchFilters:
+        key = (jd_hash(jd), self.model)
+        filters = self.cache.get(key)
+        if filters is None:
+            try:
+                output = self.chain.invoke({"jd": jd}, config={"callbacks": callbacks})
+                filters = self._parse(output)
+            except Exception as e:
+                logger.warning(f"Cannot extract search filters: {e}")
+                return SearchFilters()
+            self.cache.set(key, filters)
+        return filters
+
+    async def aextract(self, jd: str, callbacks=None) -> SearchFilters:
+        key = (jd_hash(jd), self.model)
+        filters = self.cache.get(key)
+        if filters is None:
+            try:
+                output = await self.chain.ainvoke(
+                    {"jd": jd}, config={"callbacks": callbacks}
+                )
+                filters = self._parse(output)
+            except Exception as e:
+                logger.warning(f"Cannot extract search filters: {e}")
+                return SearchFilters()
+            self.cache.set(key, filters)
+        return filters
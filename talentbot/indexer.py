@@ -0,0 +1,180 @@
+"""Incremental, resumable indexing of resume summaries."""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+from sqlalchemy import Engine, select, tuple_
+from sqlalchemy.orm import Session
+
+from talentbot.constants import INDEX_RESUMES
+from talentbot.filters import FacetStore
+from talentbot.lexical import LexicalIndex
+from talentbot.models import IndexState, Resume, ensure_resume_tables, ensure_tables
+from talentbot.retriever import ResumeVectorSearch
+
+logger = logging.getLogger(__name__)
+
+_READY = "ready"
+_BUILDING = "building"
+
+
+class ResumeIndexer:
+    """Keeps the vector index in sync with the resumes table.
+
+    Resumes are streamed with a server-side cursor in ``(updated_at, id)``
+    order and the position of the last indexed row is stored in
+    ``index_state`` after every batch, so an interrupted run picks up where
+    it stopped. A full rebuild writes into a shadow index that replaces the
+    live one through an alias swap once it has caught up; on OpenSearch
+    Serverless, which has no aliases, it re-indexes in place instead.
+
+    Deleted resumes are only dropped from the index by a full rebuild. The
+    full-text documents and filter facets of the resumes are refreshed along
+    with each batch.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        db: ResumeVectorSearch,
+        text_splitter: TextSplitter,
+        alias: str = INDEX_RESUMES,
+        batch_size: int = 200,
+        lag: timedelta = timedelta(seconds=60),
+    ):
+        self.engine = engine
+        self.db = db
+        self.text_splitter = text_splitter
+        self.alias = alias
+        self.batch_size = batch_size
+        # rows committed late by long transactions may carry an updated_at
+        # just before the watermark, so incremental runs re-read a short window
+        self.lag = lag
+        ensure_tables(engine, IndexState)
+        # also creates the (updated_at, id) index on an existing resumes table,
+        # and the tables updated with the watermark
+        ensure_resume_tables(engine)
+
+    def state(self) -> IndexState:
+        with Session(self.engine, expire_on_commit=False) as session:
+            return self._get_state(session)
+
+    def _get_state(self, session: Session) -> IndexState:
+        state = session.scalar(select(IndexState).where(IndexState.alias == self.alias))
+        if state is None:
+            state = IndexState(
+                alias=self.alias,
+                target_index=self.alias,
+                status=_READY,
+                last_resume_id=0,
+            )
+            session.add(state)
+            session.commit()
+        return state
+
+    def run(
+        self, full: bool = False, progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """Index resumes changed since the last run and return how many.
+
+        With `full`, start a rebuild from scratch unless one is already in
+        progress, in which case it is resumed.
+        """
+        with Session(self.engine, expire_on_commit=False) as session:
+            state = self._get_state(session)
+            if full and state.status != _BUILDING:
+                if self.db.supports_aliases:
+                    state.target_index = f"{self.alias}-{int(time.time())}"
+                else:
+                    state.target_index = self.alias
+                state.status = _BUILDING
+                state.last_updated_at = None
+                state.last_resume_id = 0
+                session.commit()
+            building = state.status == _BUILDING
+
+            if building or state.last_updated_at is None:
+                since, since_id = state.last_updated_at, state.last_resume_id
+            else:
+                since, since_id = state.last_updated_at - self.lag, 0
+
+            target = self.db.for_index(state.target_index)
+            total = 0
+            while True:
+                # keep reading until a pass finds nothing new, so a shadow
+                # index has caught up with concurrent uploads before the swap
+                count = self._index_since(
+                    session, state, target, since, since_id, total, progress
+                )
+                total += count
+                if count == 0 or not building:
+                    break
+                since, since_id = state.last_updated_at, state.last_resume_id
+
+            if building:
+                self._finish_build(session, state, target)
+        return total
+
+    def _index_since(
+        self,
+        session: Session,
+        state: IndexState,
+        target: ResumeVectorSearch,
+        since: Optional[datetime],
+        since_id: int,
+        done: int,
+        progress: Optional[Callable[[int], None]],
+    ) -> int:
+        stmt = select(
+            Resume.id, Resume.data, Resume.summary, Resume.updated_at
+        ).order_by(Resume.updated_at, Resume.id)
+        if since is not None:
+            stmt = stmt.where(
+                tuple_(Resume.updated_at, Resume.id) > tuple_(since, since_id)
+            )
+        stmt = stmt.execution_options(yield_per=self.batch_size)
+
+        count = 0
+        # a separate connection keeps the server-side cursor open while the
+        # watermark is committed after every batch
+        with Session(self.engine) as reader:
+            for rows in reader.execute(stmt).partitions():
+                self._index_rows(target, rows)
+                data = {row.id: row.data for row in rows}
+                LexicalIndex(session).update(data)
+                FacetStore(session).update(data)
+                state.last_updated_at = rows[-1].updated_at
+                state.last_resume_id = rows[-1].id
+                session.commit()
+                count += len(rows)
+                logger.info(
+                    f"Indexed {count} resumes into {target.index_name}, "
+                    f"watermark {state.last_updated_at}/{state.last_resume_id}"
+                )
+                if progress:
+                    progress(done + count)
+        return count
+
+    def _index_rows(self, target: ResumeVectorSearch, rows: List) -> None:
+        target.delete_resumes([row.id for row in rows])
+        docs = [
+            Document(page_content=row.summary, metadata={"resume_id": row.id})
+            for row in rows
+            if row.summary
+        ]
+        docs = self.text_splitter.split_documents(docs)
+        if docs:
+            target.add_documents(docs)
+
+    def _finish_build(
+        self, session: Session, state: IndexState, target: ResumeVectorSearch
+    ) -> None:
+        if target.index_name != self.alias and target.index_exists():
+            for name in target.swap_alias(self.alias):
+                target.for_index(name).delete_index()
+            logger.info(f"Alias {self.alias} now points to {target.index_name}")
+        state.status = _READY
+        session.commit()
@@ -0,0 +1,535 @@
+"""Streaming resume ingestion: parse, extract, upload, store and index."""
+import asyncio
+import io
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain.pydantic_v1 import ValidationError
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+from langchain_core.vectorstores import VectorStore
+from langchain_text_splitters import TextSplitter
+from sqlalchemy import Engine, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.constants import (
+    BUCKET_NAME,
+    EXTRACTION_CALLS,
+    EXTRACTION_MODE,
+    INGEST_BATCH_SIZE,
+    INGEST_LLM_CONCURRENCY,
+    INGEST_LLM_RPM,
+    INGEST_QUEUE_SIZE,
+    INGEST_RETRIES,
+    INGEST_UPLOAD_WORKERS,
+)
+from talentbot.dedup import SourceStore, file_hash, text_hash
+from talentbot.filters import FacetStore
+from talentbot.lexical import LexicalIndex
+from talentbot.models import (
+    JsonResume,
+    Resume,
+    ResumeIndustry,
+    ResumeSource,
+    ensure_resume_tables,
+)
+from talentbot.parsing import ParseError, ParsingService, get_parsing_service
+from talentbot.rendering import RenderStore
+from talentbot.rerank import RerankResultCache
+from talentbot.scheduler import BULK
+from talentbot.usage import UsageTracker
+from talentbot.utils import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("parse", "extract", "upload", "store", "index")
+
+
+class IngestError(Exception):
+    """A file that can't be ingested, retrying won't help."""
+
+
+@dataclass
+class SourceFile:
+    """An uploaded resume, picklable so it can be parsed in another process."""
+
+    name: str
+    type: str
+    data: bytes
+    key: str
+    """S3 key the original file is uploaded to."""
+
+    def open(self) -> io.BytesIO:
+        file = io.BytesIO(self.data)
+        file.name = self.name
+        file.type = self.type
+        return file
+
+
+@dataclass
+class IngestItem:
+    file: SourceFile
+    document: Optional[Document] = None
+    resume: Optional[JsonResume] = None
+    summary: Optional[str] = None
+    resume_id: Optional[int] = None
+    stage: str = "parse"
+    error: Optional[str] = None
+    file_hash: Optional[str] = None
+    text_hash: Optional[str] = None
+    duplicate: bool = False
+    """The file was ingested before, `resume_id` is the existing resume."""
+    cv_file: Optional[str] = None
+    """S3 key of the stored original if not `file.key`, which isn't uploaded."""
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.stage == "done"
+
+
+def check_extraction(result: Dict) -> Tuple[JsonResume, str]:
+    """Validated resume and summary of an extraction chain result."""
+    structured = result.get("structured") or {"error": "Cannot process the resume"}
+    summary = result.get("summary")
+    if "error" in structured or summary == "I don't know":
+        raise IngestError(structured.get("error", "Cannot summarize the resume"))
+    try:
+        return JsonResume.parse_obj(structured), summary
+    except ValidationError as e:
+        raise IngestError(f"Invalid resume: {e}") from e
+
+
+def upsert_resumes(session: Session, rows: List) -> List[int]:
+    """Insert or update ``(resume, cv_file, summary)`` rows by email.
+
+    Everything is written in one transaction, returns the ids in order.
+    `session` must not have started a transaction yet.
+    """
+    if not rows:
+        return []
+    # up front: inside the transaction, creating them waits on its own locks
+    ensure_resume_tables(session.get_bind())
+    # a statement can't update the same row twice, the last upload wins
+    latest = {}
+    for i, (resume, _, _) in enumerate(rows):
+        latest[resume.email if resume.email else ("row", i)] = i
+    unique = sorted(latest.values())
+    stmt = pg_insert(Resume)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Resume.email],
+        set_=dict(
+            name=stmt.excluded.name,
+            data=stmt.excluded.data,
+            cv_file=stmt.excluded.cv_file,
+            summary=stmt.excluded.summary,
+            updated_at=func.now(),
+        ),
+    ).returning(Resume.id, sort_by_parameter_order=True)
+    params = [
+        dict(
+            name=rows[i][0].name,
+            email=rows[i][0].email,
+            data=rows[i][0].dict(),
+            cv_file=rows[i][1],
+            summary=rows[i][2],
+        )
+        for i in unique
+    ]
+    ids = dict(zip(unique, session.scalars(stmt, params).all()))
+
+    session.execute(
+        delete(ResumeIndustry).where(ResumeIndustry.resume_id.in_(ids.values()))
+    )
+    RerankResultCache.invalidate(session, ids.values())
+    data = {ids[i]: p["data"] for i, p in zip(unique, params)}
+    LexicalIndex(session).update(data)
+    FacetStore(session).update(data)
+    RenderStore(session).update(data)
+    for i, resume_id in ids.items():
+        for industry in rows[i][0].prediction.industries:
+            session.add(
+                ResumeIndustry(
+                    resume_id=resume_id,
+                    industry=industry.name,
+                    confidence=industry.confidence,
+                )
+            )
+    session.commit()
+
+    by_key = {key: ids[i] for key, i in latest.items()}
+    return [
+        by_key[resume.email if resume.email else ("row", i)]
+        for i, (resume, _, _) in enumerate(rows)
+    ]
+
+
+def index_resumes(
+    db: VectorStore, text_splitter: TextSplitter, summaries: Dict[int, str]
+) -> None:
+    """Replace the chunks of many resumes with one delete and one add."""
+    db.delete_resumes(list(summaries))
+    docs = [
+        Document(page_content=summary, metadata={"resume_id": resume_id})
+        for resume_id, summary in summaries.items()
+        if summary
+    ]
+    docs = text_splitter.split_documents(docs)
+    if docs:
+        db.add_documents(docs)
+
+
+def load_source(
+    source: ResumeSource,
+    parser: Optional[ParsingService] = None,
+    bucket: str = BUCKET_NAME,
+) -> Document:
+    """Parsed text of a previously uploaded file, for re-extraction.
+
+    The text cache is read first, the original is only downloaded from S3
+    and parsed again on a miss.
+    """
+    parser = parser or get_parsing_service()
+    doc = parser.cache.get(source.file_hash) if parser.cache else None
+    if doc is not None:
+        return doc
+    response = get_s3_client().get_object(Bucket=bucket, Key=source.cv_file)
+    return parser.parse(
+        response["Body"].read(),
+        response.get("ContentType"),
+        source.cv_file.rsplit("/", 1)[-1],
+    )
+
+
+class RateLimiter:
+    """Spaces out the start of requests to at most `rpm` per minute."""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self, requests: int = 1) -> None:
+        """Wait until `requests` more requests may start."""
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval * requests
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_DONE = object()
+
+
+class IngestionPipeline:
+    """Ingests many resumes through concurrent stages.
+
+    Parsing runs in the `ParsingService` process pool, LLM extraction as rate-limited async
+    calls, S3 uploads in a thread pool, and database upserts and indexing
+    in batches. Stages are joined by bounded queues, so a file can be
+    indexed while later ones are still being parsed. Each file is retried
+    up to `retries` times per stage, a failing file is reported and dropped
+    without affecting the others.
+
+    With `dedup`, files seen before are matched by the hash of their bytes
+    before parsing and by the hash of their normalized text after parsing,
+    and skip the remaining stages.
+
+    Args:
+        engine: database the resumes are stored in
+        db: vector store the summaries are indexed into
+        text_splitter: splits summaries into indexed chunks
+        extraction_chain: turns a parsed document into
+            ``{"structured", "summary"}``
+        progress: called with ``(stage, done, total)`` whenever a file
+            leaves a stage
+        llm_calls: LLM requests one run of `extraction_chain` makes,
+            counted against `llm_rpm`
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        db: VectorStore,
+        text_splitter: TextSplitter,
+        extraction_chain: Runnable,
+        bucket: str = BUCKET_NAME,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        llm_concurrency: int = INGEST_LLM_CONCURRENCY,
+        llm_rpm: float = INGEST_LLM_RPM,
+        llm_calls: int = EXTRACTION_CALLS.get(EXTRACTION_MODE, 1),
+        upload_workers: int = INGEST_UPLOAD_WORKERS,
+        batch_size: int = INGEST_BATCH_SIZE,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        retries: int = INGEST_RETRIES,
+        parser: Optional[ParsingService] = None,
+        dedup: bool = True,
+    ):
+        self.engine = engine
+        self.db = db
+        self.text_splitter = text_splitter
+        self.extraction_chain = extraction_chain
+        self.bucket = bucket
+        self.progress = progress
+        self.llm_concurrency = max(llm_concurrency, 1)
+        self.llm_rpm = llm_rpm
+        self.llm_calls = max(llm_calls, 1)
+        self.upload_workers = max(upload_workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.queue_size = queue_size
+        self.retries = retries
+        self.parser = parser or get_parsing_service()
+        self.dedup = dedup
+        # token usage of the extraction calls, summed over runs
+        self.usage = UsageTracker()
+
+    def run(self, files: Iterable[SourceFile]) -> List[IngestItem]:
+        return asyncio.run(self.arun(files))
+
+    async def arun(self, files: Iterable[SourceFile]) -> List[IngestItem]:
+        """Ingest `files`, return one item per file with its outcome."""
+        items = [IngestItem(file, file_hash=file_hash(file.data)) for file in files]
+        self._total = len(items)
+        self._done = dict.fromkeys(STAGES, 0)
+        self._limiter = RateLimiter(self.llm_rpm)
+        self._threads = ThreadPoolExecutor(max_workers=self.upload_workers)
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in STAGES]
+        # identical files in the same upload are only ingested once
+        first: Dict[str, IngestItem] = {}
+        for item in items:
+            first.setdefault(item.file_hash, item)
+        unique = list(first.values())
+        try:
+            if self.dedup:
+                unique = await self._skip_known(unique)
+            await asyncio.gather(
+                self._feed(unique, queues[0]),
+                self._workers(
+                    self._parse, queues[0], queues[1], 2 * self.parser.workers
+                ),
+                self._workers(
+                    self._extract, queues[1], queues[2], self.llm_concurrency
+                ),
+                self._workers(self._upload, queues[2], queues[3], self.upload_workers),
+                self._batches(self._store, queues[3], queues[4]),
+                self._batches(self._index, queues[4], None),
+            )
+        finally:
+            self._threads.shutdown(wait=False)
+        for item in items:
+            original = first[item.file_hash]
+            if item is not original:
+                item.resume_id, item.error = original.resume_id, original.error
+                item.duplicate = True
+                if original.error is None:
+                    self._skip(item)
+        return items
+
+    async def _skip_known(self, items: List[IngestItem]) -> List[IngestItem]:
+        """Finish files ingested before, return the others."""
+        loop = asyncio.get_running_loop()
+        known = await loop.run_in_executor(
+            self._threads, self._find, "by_file_hash", [i.file_hash for i in items]
+        )
+        for item in items:
+            if item.file_hash in known:
+                item.resume_id = known[item.file_hash].resume_id
+                item.duplicate = True
+                self._skip(item)
+        return [item for item in items if not item.duplicate]
+
+    def _find(self, method: str, hashes: List[str]) -> Dict[str, ResumeSource]:
+        try:
+            with Session(self.engine, expire_on_commit=False) as session:
+                return getattr(SourceStore(session), method)(hashes)
+        except Exception as e:
+            logger.warning(f"Duplicate lookup failed, ingesting anyway: {e}")
+            return {}
+
+    def _record(self, items: List[IngestItem]) -> None:
+        with Session(self.engine) as session:
+            SourceStore(session).add_many(
+                [
+                    dict(
+                        file_hash=item.file_hash,
+                        text_hash=item.text_hash,
+                        resume_id=item.resume_id,
+                        cv_file=item.cv_file or item.file.key,
+                        structured=item.resume.dict() if item.resume else None,
+                        summary=item.summary,
+                    )
+                    for item in items
+                ]
+            )
+
+    def _skip(self, item: IngestItem) -> None:
+        """Count `item` as done in its current and all remaining stages."""
+        while item.stage != "done":
+            self._advance(item)
+
+    async def _feed(self, items: List[IngestItem], out: asyncio.Queue) -> None:
+        for item in items:
+            await out.put(item)
+        await out.put(_DONE)
+
+    async def _workers(self, handle, inbox, out, count: int) -> None:
+        """Run `count` workers that pass each item through `handle`."""
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # let the other workers see the end of the stream too
+                    await inbox.put(_DONE)
+                    return
+                if await self._attempt(handle, item) and not item.duplicate:
+                    await out.put(item)
+
+        await asyncio.gather(*(worker() for _ in range(max(count, 1))))
+        await out.put(_DONE)
+
+    async def _batches(self, handle, inbox, out) -> None:
+        """Pass items through `handle` in batches of up to `batch_size`.
+
+        A batch is flushed as soon as the queue is empty, so a slow stage
+        upstream doesn't hold back finished files.
+        """
+        finished = False
+        while not finished:
+            batch = [await inbox.get()]
+            while len(batch) < self.batch_size and not inbox.empty():
+                batch.append(inbox.get_nowait())
+            if batch[-1] is _DONE:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+            try:
+                await handle(batch)
+                passed = batch
+            except Exception as e:
+                logger.warning(
+                    f"Batch of {len(batch)} failed, retrying one by one: {e}"
+                )
+                passed = [item for item in batch if await self._attempt(handle, [item])]
+            for item in passed:
+                self._advance(item)
+                if out is not None:
+                    await out.put(item)
+        if out is not None:
+            await out.put(_DONE)
+
+    async def _attempt(self, handle, item) -> bool:
+        """Run one stage for `item`, return whether it can move on."""
+        items = item if isinstance(item, list) else [item]
+        try:
+            await self._retry(handle, item)
+        except Exception as e:
+            for failed in items:
+                failed.error = str(e) or type(e).__name__
+                logger.warning(
+                    f"Failed to ingest {failed.file.name} at {failed.stage}: {e}"
+                )
+            return False
+        if not isinstance(item, list) and not item.duplicate:
+            self._advance(item)
+        return True
+
+    async def _retry(self, handle, item) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                return await handle(item)
+            except (IngestError, ImportError):
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = min(2**attempt, 30) * (1 + random.random())
+                logger.info(f"Retrying {handle.__name__} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    def _advance(self, item: IngestItem) -> None:
+        stage = item.stage
+        self._done[stage] += 1
+        next_stage = STAGES.index(stage) + 1
+        item.stage = STAGES[next_stage] if next_stage < len(STAGES) else "done"
+        if self.progress:
+            self.progress(stage, self._done[stage], self._total)
+
+    async def _parse(self, item: IngestItem) -> None:
+        file = item.file
+        try:
+            item.document = await self.parser.aparse(file.data, file.type, file.name)
+        except ParseError as e:
+            raise IngestError(str(e)) from e
+        item.text_hash = text_hash(item.document.page_content)
+        if not self.dedup:
+            return
+        loop = asyncio.get_running_loop()
+        known = await loop.run_in_executor(
+            self._threads, self._find, "by_text_hash", [item.text_hash]
+        )
+        if item.text_hash in known:
+            item.resume_id = known[item.text_hash].resume_id
+            # these bytes are never uploaded, point at the original's
+            item.cv_file = known[item.text_hash].cv_file
+            item.duplicate = True
+            self._skip(item)
+            # remember the new bytes, the next upload is skipped before parsing
+            await loop.run_in_executor(self._threads, self._record, [item])
+
+    async def _extract(self, item: IngestItem) -> None:
+        await self._limiter.wait(self.llm_calls)
+        result = await self.extraction_chain.ainvoke(
+            item.document,
+            config={"callbacks": [self.usage], "metadata": {"llm_priority": BULK}},
+        )
+        item.resume, item.summary = check_extraction(result)
+        item.document = None  # no longer needed, keep memory flat
+
+    async def _upload(self, item: IngestItem) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._threads, self._put_object, item.file)
+
+    def _put_object(self, file: SourceFile) -> None:
+        get_s3_client().put_object(
+            Bucket=self.bucket, Key=file.key, Body=file.data, ContentType=file.type
+        )
+
+    async def _store(self, items: List[IngestItem]) -> None:
+        loop = asyncio.get_running_loop()
+        ids = await loop.run_in_executor(self._threads, self._upsert, items)
+        for item, resume_id in zip(items, ids):
+            item.resume_id = resume_id
+
+    def _upsert(self, items: List[IngestItem]) -> List[int]:
+        with Session(self.engine) as session:
+            ids = upsert_resumes(
+                session, [(item.resume, item.file.key, item.summary) for item in items]
+            )
+        for item, resume_id in zip(items, ids):
+            item.resume_id = resume_id
+        return ids
+
+    async def _index(self, items: List[IngestItem]) -> None:
+        summaries: Dict[int, Any] = {item.resume_id: item.summary for item in items}
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._threads, index_resumes, self.db, self.text_splitter, summaries
+        )
+        # only indexed files are skipped when uploaded again
+        await loop.run_in_executor(self._threads, self._record_indexed, items)
+
+    def _record_indexed(self, items: List[IngestItem]) -> None:
+        try:
+            self._record(items)
+        except Exception as e:
+            # only costs a re-extraction if the same file is uploaded again
+            logger.warning(f"Failed to record uploaded files: {e}")
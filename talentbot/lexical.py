@@ -0,0 +1,180 @@
+"""Full-text search over the exact terms of structured resumes.
+
+Skill, certificate and company names often get lost in the embedding of
+the summary. They are indexed as a weighted Postgres ``tsvector`` with a
+GIN index, and searched with the terms of the job description.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import Engine, func, literal, select
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.constants import LEXICAL_K, LEXICAL_TS_CONFIG
+from talentbot.models import ResumeSearchText, ensure_tables
+
+# at most this many terms of a job description are searched, the most
+# frequent ones
+MAX_QUERY_TERMS = 200
+
+# fields of JsonResume items indexed under each weight
+_WEIGHTS = {
+    "A": {
+        "skills": ("name", "keywords"),
+        "certificates": ("name", "issuer"),
+    },
+    "B": {
+        "work": ("position", "name"),
+        "projects": ("name",),
+        "volunteer": ("position", "organization"),
+    },
+    "C": {
+        "education": ("area", "study_type", "institution"),
+        "languages": ("language",),
+        "awards": ("title", "awarder"),
+        "publications": ("name",),
+    },
+}
+
+
+def _values(value) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [v for v in value if isinstance(v, str)]
+    return []
+
+
+def search_texts(data: Dict) -> Dict[str, str]:
+    """Text indexed under each weight, from the data of a resume."""
+    texts = {}
+    for weight, sections in _WEIGHTS.items():
+        terms = []
+        for section, fields in sections.items():
+            for item in data.get(section) or []:
+                if isinstance(item, dict):
+                    for field in fields:
+                        terms += _values(item.get(field))
+        if weight == "A":
+            terms += _values(data.get("label"))
+        texts[weight] = "\n".join(terms)
+    return texts
+
+
+def _document(data: Dict, config: str):
+    document = None
+    for weight, text in search_texts(data).items():
+        vector = func.setweight(
+            func.to_tsvector(literal(config, REGCONFIG), text), weight
+        )
+        document = vector if document is None else document.op("||")(vector)
+    return document
+
+
+class LexicalIndex:
+    """Full-text documents of resumes, one row per resume.
+    The table is created by `ensure_resume_tables` before resumes are
+    written, not here.
+    """
+
+    def __init__(self, session: Session, config: str = LEXICAL_TS_CONFIG):
+        self.session = session
+        self.config = config
+
+    def update(self, resumes: Dict[int, Dict]) -> None:
+        """Replace the documents of ``{resume_id: data}``, without committing."""
+        if not resumes:
+            return
+        stmt = pg_insert(ResumeSearchText).values(
+            [
+                {"resume_id": resume_id, "document": _document(data, self.config)}
+                for resume_id, data in resumes.items()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ResumeSearchText.resume_id],
+            set_={"document": stmt.excluded.document, "updated_at": func.now()},
+        )
+        self.session.execute(stmt)
+
+    def query_terms(self, text: str) -> List[str]:
+        """Normalized terms of `text`, as the index stores them.
+
+        Terms repeated most in `text` come first, so a long job description
+        keeps its main terms within `MAX_QUERY_TERMS`.
+        """
+        vector = func.to_tsvector(literal(self.config, REGCONFIG), text)
+        terms = func.unnest(vector).table_valued("lexeme", "positions", "weights")
+        stmt = (
+            select(terms.c.lexeme)
+            .order_by(func.cardinality(terms.c.positions).desc(), terms.c.lexeme)
+            .limit(MAX_QUERY_TERMS)
+        )
+        return list(self.session.scalars(stmt))
+
+    def search(
+        self,
+        text: str,
+        k: int = LEXICAL_K,
+        resume_ids: Optional[List[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Resumes matching any term of `text`, best ranked first.
+
+        With `resume_ids`, only those resumes are searched.
+        """
+        terms = self.query_terms(text)
+        if not terms:
+            return []
+        # terms are already normalized, "simple" keeps them as they are
+        query = func.to_tsquery(
+            literal("simple", REGCONFIG),
+            " | ".join("'{}'".format(term.replace("'", "''")) for term in terms),
+        )
+        rank = func.ts_rank_cd(ResumeSearchText.document, query)
+        stmt = select(ResumeSearchText.resume_id, rank.label("rank")).where(
+            ResumeSearchText.document.op("@@")(query)
+        )
+        if resume_ids is not None:
+            stmt = stmt.where(ResumeSearchText.resume_id.in_(resume_ids))
+        rows = self.session.execute(stmt.order_by(rank.desc()).limit(k))
+        return [(row.resume_id, row.rank) for row in rows]
+
+
+class LexicalRetriever(BaseRetriever):
+    """Resumes whose skills, positions or certificates match the query.
+
+    Returns one empty document per resume with ``resume_id`` and the text
+    rank as ``score`` in its metadata, like the vector retrievers.
+    """
+
+    engine: Engine
+    k: int = LEXICAL_K
+    config: str = LEXICAL_TS_CONFIG
+    resume_ids: Optional[List[int]] = None
+    """Only search these resumes, `None` for all."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def filtered(self, resume_ids: List[int]) -> "LexicalRetriever":
+        return self.copy(update={"resume_ids": resume_ids})
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: Optional[CallbackManagerForRetrieverRun] = None,
+    ) -> List[Document]:
+        ensure_tables(self.engine, ResumeSearchText)
+        with Session(self.engine) as session:
+            hits = LexicalIndex(session, self.config).search(
+                query, self.k, self.resume_ids
+            )
+        return [
+            Document(page_content="", metadata={"resume_id": resume_id, "score": rank})
+            for resume_id, rank in hits
+        ]
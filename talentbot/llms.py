@@ -0,0 +1,248 @@
+"""Chat models with provider-side prompt caching and shared rate limits."""
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import anthropic
+import openai
+from langchain.pydantic_v1 import root_validator
+from langchain_anthropic import ChatAnthropic
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, LLMResult
+from langchain_openai import ChatOpenAI
+
+from talentbot.constants import LLM_MAX_RETRIES, PROMPT_CACHE
+from talentbot.scheduler import INTERACTIVE, get_scheduler
+from talentbot.tokens import count_message_tokens, count_tokens
+from talentbot.usage import token_usage
+
+ANTHROPIC_CACHE_BETA = "prompt-caching-2024-07-31"
+
+
+def _blocks(message: Dict) -> List[Dict]:
+    if isinstance(message["content"], str):
+        message["content"] = [{"type": "text", "text": message["content"]}]
+    return message["content"]
+
+
+def add_cache_breakpoints(params: Dict) -> Dict:
+    """Mark the system prompt and the content before the last input block.
+
+    Prompts put their static part first (instructions, schema, examples,
+    the shared job description) and the per-call input last, so the second
+    to last block ends the prefix that repeats across calls.
+    """
+    cache_control = {"type": "ephemeral"}
+    if isinstance(params.get("system"), str):
+        params["system"] = [
+            {"type": "text", "text": params["system"], "cache_control": cache_control}
+        ]
+    blocks = [block for message in params["messages"] for block in _blocks(message)]
+    if len(blocks) > 1:
+        blocks[-2]["cache_control"] = cache_control
+    return params
+
+
+def _rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def _retryable(error: Exception) -> bool:
+    # connection errors and 5xx, Anthropic's 529 "overloaded" included
+    if isinstance(error, (openai.APIConnectionError, anthropic.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def _backoff(attempt: int) -> float:
+    return min(2**attempt, 30) * (1 + random.random())
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class ScheduledChatModelMixin:
+    """Runs the calls of a chat model through the process-wide scheduler.
+
+    Calls reserve their prompt tokens plus `max_tokens` under the
+    `scheduler_key` field of the model and run with the priority in the
+    ``llm_priority`` metadata of the run config, interactive by default:
+
+        chain.invoke(input, config={"metadata": {"llm_priority": "bulk"}})
+
+    Rate limit errors slow the model down and are retried by the scheduler,
+    connection and server errors are retried after a backoff. The provider
+    clients should not retry on their own, so every attempt is admitted.
+    Streams are admitted once and release the tokens they didn't use.
+    """
+
+    def _budget(self, messages: List[BaseMessage], run_manager) -> Tuple[str, int, str]:
+        tokens = count_message_tokens(messages) + (self.max_tokens or 0)
+        metadata = (run_manager.metadata if run_manager else None) or {}
+        return self.scheduler_key, tokens, metadata.get("llm_priority", INTERACTIVE)
+
+    def _release(self, key: str, tokens: int, result: ChatResult) -> None:
+        usage = token_usage(
+            LLMResult(generations=[result.generations], llm_output=result.llm_output)
+        )
+        used = usage["input_tokens"] + usage["output_tokens"]
+        # unknown usage keeps the reservation
+        get_scheduler().release(key, tokens, used or tokens)
+
+    def _streamed(self, tokens: int, text: List[str]) -> int:
+        # streams don't report usage, count the prompt and the streamed text
+        return tokens - (self.max_tokens or 0) + count_tokens("".join(text))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            # admitted by _stream
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        scheduler = get_scheduler()
+        key, tokens, priority = self._budget(messages, run_manager)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            scheduler.acquire(key, tokens, priority)
+            try:
+                result = super()._generate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                scheduler.release(key, tokens, 0)
+                if not _retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                if _rate_limited(e):
+                    scheduler.rate_limited(key, _retry_after(e))
+                else:
+                    time.sleep(_backoff(attempt))
+                continue
+            self._release(key, tokens, result)
+            return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        scheduler = get_scheduler()
+        key, tokens, priority = self._budget(messages, run_manager)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await scheduler.aacquire(key, tokens, priority)
+            try:
+                result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                scheduler.release(key, tokens, 0)
+                if not _retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                if _rate_limited(e):
+                    scheduler.rate_limited(key, _retry_after(e))
+                else:
+                    await asyncio.sleep(_backoff(attempt))
+                continue
+            self._release(key, tokens, result)
+            return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # a stream can't be retried once it started, it's only admitted
+        scheduler = get_scheduler()
+        key, tokens, priority = self._budget(messages, run_manager)
+        scheduler.acquire(key, tokens, priority)
+        text = []
+        try:
+            for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+                text.append(chunk.text)
+                yield chunk
+        except Exception as e:
+            if _rate_limited(e):
+                scheduler.rate_limited(key, _retry_after(e))
+            raise
+        finally:
+            scheduler.release(key, tokens, self._streamed(tokens, text))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        scheduler = get_scheduler()
+        key, tokens, priority = self._budget(messages, run_manager)
+        await scheduler.aacquire(key, tokens, priority)
+        text = []
+        try:
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                text.append(chunk.text)
+                yield chunk
+        except Exception as e:
+            if _rate_limited(e):
+                scheduler.rate_limited(key, _retry_after(e))
+            raise
+        finally:
+            scheduler.release(key, tokens, self._streamed(tokens, text))
+
+
+class ScheduledChatOpenAI(ScheduledChatModelMixin, ChatOpenAI):
+    """ChatOpenAI within the shared rate limits of `scheduler_key`."""
+
+    scheduler_key: str = "openai_gpt_4o"
+    max_retries: int = 0
+
+
+class CachingChatAnthropic(ScheduledChatModelMixin, ChatAnthropic):
+    """ChatAnthropic that caches the static prefix of its prompts.
+
+    Cached prefixes are read at a tenth of the input price. Prefixes under
+    the model's minimum (1024 tokens for Opus and Sonnet) are not cached
+    and cost the same as without caching. Calls run within the shared rate
+    limits of `scheduler_key`.
+    """
+
+    scheduler_key: str = "anthropic_claude_3_opus"
+    max_retries: int = 0
+    prompt_cache: bool = PROMPT_CACHE
+
+    @root_validator(pre=True)
+    def add_beta_header(cls, values: Dict) -> Dict:
+        if values.get("prompt_cache", PROMPT_CACHE):
+            values["default_headers"] = {
+                "anthropic-beta": ANTHROPIC_CACHE_BETA,
+                **(values.get("default_headers") or {}),
+            }
+        return values
+
+    def _format_params(
+        self,
+        *,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Dict:
+        params = super()._format_params(messages=messages, stop=stop, **kwargs)
+        # tool calls go through the tools beta, which sets its own header
+        if self.prompt_cache and not params.get("tools"):
+            add_cache_breakpoints(params)
+        return params
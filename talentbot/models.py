@@ -1,8 +1,18 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from langchain.pydantic_v1 import BaseModel, EmailStr, Field
-from sqlalchemy import JSON, DateTime, Float, ForeignKey, String, func
+from sqlalchemy import (
+    JSON,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    String,
+    UniqueConstraint,
+    func,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -187,8 +197,34 @@ class Base(DeclarativeBase):
     pass
 
 
+_ensured = set()
+
+
+def ensure_tables(bind, *tables) -> None:
+    """Create `tables` and their indexes where missing, once per bind.
+
+    There are no migrations, tables are created on first use instead.
+    Indexes declared on a table that already exists are created too.
+    Accepts mapped classes or `Table` objects.
+    """
+    for table in tables:
+        table = getattr(table, "__table__", table)
+        if (bind, table.name) in _ensured:
+            continue
+        table.create(bind, checkfirst=True)
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+        _ensured.add((bind, table.name))
+
+
 class Resume(Base):
     __tablename__ = "resumes"
+    __table_args__ = (
+        # the resumes list pages through rows in (created_at, id) order
+        Index("ix_resumes_created_at_id", "created_at", "id"),
+        # incremental reindex streams rows in (updated_at, id) order
+        Index("ix_resumes_updated_at_id", "updated_at", "id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(256))
     # email is unique
@@ -211,6 +247,10 @@ class Resume(Base):
 
 class ResumeIndustry(Base):
     __tablename__ = "resume_industry"
+    __table_args__ = (
+        # search filters look up resumes by industry
+        Index("ix_resume_industry_industry", "industry", "confidence"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     resume_id: Mapped[int] = mapped_column(ForeignKey("resumes.id"))
     resume: Mapped["Resume"] = relationship(back_populates="industries")
@@ -219,3 +259,150 @@ class ResumeIndustry(Base):
 
     def __repr__(self) -> str:
         return f"ResumeIndustry(id={self.id!r}, resume_id={self.resume_id!r}, industry={self.industry!r}, confidence={self.confidence!r})"
+
+
+class IndexState(Base):
+    """Progress of the resume search index, one row per index alias."""
+
+    __tablename__ = "index_state"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    alias: Mapped[str] = mapped_column(String(256), unique=True)
+    # index currently being written, either the live one or a shadow index
+    target_index: Mapped[str] = mapped_column(String(256))
+    # "ready" or "building" (a full rebuild into a shadow index is running)
+    status: Mapped[str] = mapped_column(String(32), default="ready")
+    last_updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    last_resume_id: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"IndexState(alias={self.alias!r}, target_index={self.target_index!r}, status={self.status!r}, last_updated_at={self.last_updated_at!r}, last_resume_id={self.last_resume_id!r})"
+
+
+class RerankCache(Base):
+    """LLM rerank score of a resume for a job description."""
+
+    __tablename__ = "rerank_cache"
+    __table_args__ = (
+        UniqueConstraint("jd_hash", "resume_id", "resume_updated_at", "model"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # sha256 of the normalized job description
+    jd_hash: Mapped[str] = mapped_column(String(64))
+    resume_id: Mapped[int] = mapped_column(
+        ForeignKey("resumes.id", ondelete="CASCADE"), index=True
+    )
+    resume_updated_at: Mapped[datetime] = mapped_column(DateTime)
+    # key of MODEL_OPTIONS and version of the rerank prompts, "<key>:<version>"
+    model: Mapped[str] = mapped_column(String(64))
+    score: Mapped[int]
+    reason: Mapped[Optional[str]] = mapped_column(String())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    last_used_at: Mapped[datetime] = mapped_column(
+        DateTime, default=func.now(), index=True
+    )
+
+    def __repr__(self) -> str:
+        return f"RerankCache(jd_hash={self.jd_hash!r}, resume_id={self.resume_id!r}, model={self.model!r}, score={self.score!r})"
+
+
+class ResumeSource(Base):
+    """An uploaded file and the resume that was extracted from it."""
+
+    __tablename__ = "resume_sources"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # sha256 of the raw file
+    file_hash: Mapped[str] = mapped_column(String(64), unique=True)
+    # sha256 of the normalized text, matches re-exports of the same document
+    text_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)
+    resume_id: Mapped[int] = mapped_column(
+        ForeignKey("resumes.id", ondelete="CASCADE"), index=True
+    )
+    cv_file: Mapped[str] = mapped_column(String(256))
+    structured: Mapped[Optional[dict]] = mapped_column(JSON())
+    summary: Mapped[Optional[str]] = mapped_column(String())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+    def __repr__(self) -> str:
+        return f"ResumeSource(file_hash={self.file_hash!r}, resume_id={self.resume_id!r}, cv_file={self.cv_file!r})"
+
+
+class ResumeSearchText(Base):
+    """Full-text search document of the exact terms of a resume."""
+
+    __tablename__ = "resume_search_text"
+    __table_args__ = (
+        Index("ix_resume_search_text_document", "document", postgresql_using="gin"),
+    )
+    resume_id: Mapped[int] = mapped_column(
+        ForeignKey("resumes.id", ondelete="CASCADE"), primary_key=True
+    )
+    # skills and certificates weigh A, positions and companies B, the rest C
+    document: Mapped[str] = mapped_column(TSVECTOR)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"ResumeSearchText(resume_id={self.resume_id!r})"
+
+
+class ResumeFacet(Base):
+    """Search filter values precomputed from the data of a resume."""
+
+    __tablename__ = "resume_facets"
+    resume_id: Mapped[int] = mapped_column(
+        ForeignKey("resumes.id", ondelete="CASCADE"), primary_key=True
+    )
+    # total years of work experience, overlapping jobs counted once
+    years_experience: Mapped[Optional[float]] = mapped_column(Float, index=True)
+    # lowercase ASCII city name without spaces, see filters.normalize_city
+    city: Mapped[Optional[str]] = mapped_column(String(128), index=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"ResumeFacet(resume_id={self.resume_id!r}, years_experience={self.years_experience!r}, city={self.city!r})"
+
+
+class ResumeRender(Base):
+    """Resume data rendered with the text and markdown templates."""
+
+    __tablename__ = "resume_renders"
+    resume_id: Mapped[int] = mapped_column(
+        ForeignKey("resumes.id", ondelete="CASCADE"), primary_key=True
+    )
+    # sha256 of the template sources, renders of older templates are redone
+    template_hash: Mapped[str] = mapped_column(String(64))
+    # resume.txt.jinja, sent to the LLM
+    rendered_text: Mapped[str] = mapped_column(String())
+    # resume.md, shown on the Resumes page
+    rendered_md: Mapped[str] = mapped_column(String())
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"ResumeRender(resume_id={self.resume_id!r}, template_hash={self.template_hash!r})"
+
+
+def ensure_resume_tables(bind) -> None:
+    """Create the resumes table and every table kept alongside it.
+
+    Creating a table referencing ``resumes``, or an index on a table being
+    written, waits for the transactions writing to it. Call this before a
+    write transaction starts, never from inside one.
+    """
+    ensure_tables(
+        bind,
+        Resume,
+        ResumeIndustry,
+        ResumeSource,
+        ResumeSearchText,
+        ResumeFacet,
+        ResumeRender,
+        RerankCache,
+    )
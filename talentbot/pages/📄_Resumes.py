@@ -1,46 +1,79 @@
 import pandas as pd
 import streamlit as st
-from jinja2 import Environment, PackageLoader, select_autoescape
-from sqlalchemy import select
+from sqlalchemy import func, select, text, tuple_
 
 from talentbot.constants import DB_DSN
-from talentbot.models import Resume
-from talentbot.utils import generate_signed_url
+from talentbot.models import Resume, ensure_resume_tables
+from talentbot.rendering import RenderStore
+from talentbot.utils import generate_signed_url, generate_signed_urls
 
 st.set_page_config(page_title="Resumes", page_icon="📄", layout="wide")
 
-
-@st.cache_resource(ttl="1h")
-def configure_env():
-    env = Environment(
-        loader=PackageLoader("talentbot", "templates"),
-        autoescape=select_autoescape(["html", "xml"]),
-    )
-    return env
+PAGE_SIZE = 50
+# below this the planner estimate isn't worth it, count exactly
+_EXACT_COUNT_LIMIT = 10000
 
 
 conn = st.connection("sql", type="sql", url=DB_DSN)
-env = configure_env()
-template = env.get_template("resume.md")
-# template2 = env.get_template("resume.txt.jinja")
+# tables created before the (created_at, id) index was declared lack it,
+# renders are stored on first view
+ensure_resume_tables(conn.engine)
 
 
-with conn.session as s:
-    if not st.query_params.get("id"):
-        count = s.query(Resume).count()
-        st.header(f"Resumes ({count})")
-        stmt = select(
+@st.cache_data(ttl="10m")
+def count_resumes():
+    with conn.session as s:
+        # reltuples is the planner's row estimate, -1 if never analyzed
+        estimate = s.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'resumes'")
+        )
+        if estimate is None or estimate < _EXACT_COUNT_LIMIT:
+            return s.scalar(select(func.count(Resume.id)))
+        return estimate
+
+
+def fetch_page(s, cursor):
+    stmt = (
+        select(
             Resume.id,
             Resume.name,
             Resume.email,
             Resume.cv_file,
             Resume.created_at,
-        ).order_by(Resume.created_at.desc())
-        result = s.execute(stmt).all()
+        )
+        .order_by(Resume.created_at.desc(), Resume.id.desc())
+        .limit(PAGE_SIZE + 1)
+    )
+    if cursor:
+        stmt = stmt.where(tuple_(Resume.created_at, Resume.id) < tuple_(*cursor))
+    rows = s.execute(stmt).all()
+    return rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+
+def next_page(row):
+    st.session_state.resume_cursors.append((row.created_at, row.id))
+
+
+def previous_page():
+    st.session_state.resume_cursors.pop()
+
+
+with conn.session as s:
+    if not st.query_params.get("id"):
+        count = count_resumes()
+        approx = "~" if count >= _EXACT_COUNT_LIMIT else ""
+        st.header(f"Resumes ({approx}{count})")
+        # keyset pagination: one (created_at, id) cursor per page visited
+        if "resume_cursors" not in st.session_state:
+            st.session_state.resume_cursors = [None]
+        cursors = st.session_state.resume_cursors
+        result, has_next = fetch_page(s, cursors[-1])
 
         df = pd.DataFrame(result, columns=["ID", "Name", "Email", "CV", "Created At"])
         df["ID"] = df["ID"].apply(lambda x: f"?id={x}")
-        df["CV"] = df["CV"].apply(lambda x: generate_signed_url(x))
+        # only the rows on this page are signed, in one pass
+        cv_urls = generate_signed_urls(df["CV"])
+        df["CV"] = df["CV"].map(cv_urls)
         st.dataframe(
             df,
             hide_index=True,
@@ -49,9 +82,23 @@ with conn.session as s:
                 "CV": st.column_config.LinkColumn(display_text="Download"),
             },
         )
+        prev_col, page_col, next_col = st.columns([1, 4, 1])
+        prev_col.button("Previous", disabled=len(cursors) == 1, on_click=previous_page)
+        page_col.caption(f"Page {len(cursors)}")
+        next_col.button(
+            "Next",
+            disabled=not has_next,
+            on_click=next_page,
+            args=(result[-1],) if result else None,
+        )
     else:
-        resume_id = st.query_params.get("id")
-        resume = s.get(Resume, resume_id)
+        resume_id = int(st.query_params.get("id"))
+        # the rendered markdown is stored, the JSON data isn't needed
+        resume = s.execute(
+            select(Resume.name, Resume.cv_file, Resume.summary).where(
+                Resume.id == resume_id
+            )
+        ).first()
         st.header(resume.name)
         if resume.cv_file:
             cv_url = generate_signed_url(resume.cv_file)
@@ -59,9 +106,7 @@ with conn.session as s:
         profile_tab, summary_tab = st.tabs(["Profile", "Summary"])
 
         with profile_tab:
-            # profile = template2.render(**resume.data)
-            # st.text(profile)
-            profile = template.render(**resume.data)
+            profile = RenderStore(s).markdowns([resume_id]).get(resume_id, "")
             st.write(profile)
 
         with summary_tab:
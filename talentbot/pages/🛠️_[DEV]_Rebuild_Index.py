@@ -1,11 +1,9 @@
-import time
-
 import streamlit as st
-from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sqlalchemy import select
+from sqlalchemy import func, select
 
 from talentbot.constants import DB_DSN, INDEX_RESUMES
+from talentbot.indexer import ResumeIndexer
 from talentbot.models import Resume
 from talentbot.retriever import create_vector_store
 
@@ -30,6 +28,21 @@ db = configure_vector_store(INDEX_RESUMES)
 
 conn = st.connection("sql", type="sql", url=DB_DSN)
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=250)
+indexer = ResumeIndexer(conn.engine, db, text_splitter, alias=INDEX_RESUMES)
+
+
+def run_indexer(full):
+    with conn.session as s:
+        total = s.scalar(select(func.count(Resume.id)))
+    bar = st.progress(0.0, text="Indexing resumes...")
+
+    def progress(done):
+        bar.progress(min(done / max(total, 1), 1.0), text=f"Indexed {done} resumes")
+
+    count = indexer.run(full=full, progress=progress)
+    bar.empty()
+    return count
+
 
 with st.form("check_form", clear_on_submit=True):
     submitted = st.form_submit_button("Check Index Status")
@@ -47,32 +60,33 @@ with st.form("check_form", clear_on_submit=True):
             # response = db.client.search(index="resumes", body=query)
             # ids = [hit['_source']['id'] for hit in response["hits"]["hits"]]
             # st.text(ids)
-            count = db.client.count(index="resumes").get("count", 0)
+            count = db.count()
             if count > 0:
                 st.success(f"Index contains {count} documents")
             else:
                 st.error("Index is empty")
+            state = indexer.state()
+            st.text(
+                f"Status: {state.status}, writing to {state.target_index}\n"
+                f"Indexed up to {state.last_updated_at} (resume {state.last_resume_id})"
+            )
+
+with st.form("update_form", clear_on_submit=True):
+    submitted = st.form_submit_button("Update Index")
+
+    if submitted:
+        with st.spinner("Indexing changed resumes..."):
+            count = run_indexer(full=False)
+            st.success(f"{count} resumes indexed")
 
 with st.form("form", clear_on_submit=True):
+    st.caption(
+        "Rebuilds into a new index and swaps it in when done. "
+        "An interrupted rebuild continues where it stopped."
+    )
     submitted = st.form_submit_button("Rebuild Index")
 
     if submitted:
         with st.spinner("Rebuilding index..."):
-            with conn.session as s:
-                try:
-                    db.delete_index()
-                except Exception:
-                    pass
-                time.sleep(1)
-                stmt = select(Resume.id, Resume.summary).order_by(
-                    Resume.created_at.desc()
-                )
-                result = s.execute(stmt).all()
-                docs = [
-                    Document(page_content=res.summary, metadata={"resume_id": res.id})
-                    for res in result
-                ]
-                docs = text_splitter.split_documents(docs)
-                st.write(db.add_documents(docs))
-
-                st.success("Index rebuilt successfully")
+            count = run_indexer(full=True)
+            st.success(f"Index rebuilt successfully, {count} resumes indexed")
@@ -1,12 +1,11 @@
-from typing import Any, Dict, List, Optional
-from uuid import UUID
+import asyncio
+import time
 
 import streamlit as st
 from langchain.agents import (
     AgentExecutor,
     create_tool_calling_agent,
 )
-from langchain.callbacks.base import BaseCallbackHandler
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
@@ -14,6 +13,8 @@ from talentbot.chain import (
     llm,
 )
 from talentbot.constants import DB_DSN, INDEX_RESUMES, MODEL_OPTIONS
+from talentbot.filters import SearchFilters
+from talentbot.models import ensure_resume_tables
 from talentbot.prompts import CHAT_PROMPT
 from talentbot.retriever import create_retriever, create_vector_store
 from talentbot.tools import ResumeDetailsTool, ResumeSearchTool, ResumeSummarizationTool
@@ -26,14 +27,24 @@ def configure_vector_store(index_name):
     return create_vector_store(index_name)
 
 
+model_options = MODEL_OPTIONS
+model = st.sidebar.selectbox(
+    "Select a model you want to use",
+    list(model_options.keys()),
+    format_func=lambda x: model_options[x],
+)
+
 conn = st.connection("sql", type="sql", url=DB_DSN)
+# the tools read the facets, renders and rerank cache
+ensure_resume_tables(conn.engine)
 vector_store = configure_vector_store(INDEX_RESUMES)
-retriever = create_retriever(llm, vector_store)
+retriever = create_retriever(llm, vector_store, conn.engine)
 
 resume_search_tool = ResumeSearchTool(
     llm=llm,
     retriever=retriever,
     sesssion=conn.session,
+    model=model,
 )
 resume_summarization_tool = ResumeSummarizationTool(
     sesssion=conn.session,
@@ -57,62 +68,93 @@ agent_with_chat_history = RunnableWithMessageHistory(
 )
 
 
-model_options = MODEL_OPTIONS
-model = st.sidebar.selectbox(
-    "Select a model you want to use",
-    list(model_options.keys()),
-    format_func=lambda x: model_options[x],
-)
+# longest time between two redraws of a streamed answer
+FLUSH_INTERVAL = 1 / 15
 
+TOOL_STATUS = {
+    resume_search_tool.name: "Searching resumes to match the job description...",
+    resume_summarization_tool.name: "Summarizing resume...",
+    resume_details_tool.name: "Getting resume details...",
+}
 
-class ToolStreamHandler(BaseCallbackHandler):
-    def __init__(self, container, initial_text=""):
-        self.container = container
-        self.last_container = None
-
-    def on_tool_start(
-        self,
-        serialized: Dict[str, Any],
-        input_str: str,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        tags: Optional[List[str]] = None,
-        metadata: Optional[Dict[str, Any]] = None,
-        inputs: Optional[Dict[str, Any]] = None,
-        **kwargs: Any,
-    ) -> Any:
-        """Run when tool starts running."""
-        tool_name = serialized["name"]
-        if tool_name == resume_search_tool.name:
-            msg = "Searching resumes to match the job description..."
-        elif tool_name == resume_summarization_tool.name:
-            msg = "Summarizing resume..."
-        elif tool_name == resume_details_tool.name:
-            msg = "Getting resume details..."
-        self.last_container = self.container.empty()
-        self.last_container.status(msg)
-
-    def on_tool_end(
-        self,
-        output: Any,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        """Run when tool ends running."""
-        self.last_container.empty()
-
-
-class StreamHandler(BaseCallbackHandler):
-    def __init__(self, container, initial_text=""):
+
+class ResponseWriter:
+    """Renders a streamed answer at most once per `FLUSH_INTERVAL`.
+
+    Redrawing the markdown on every token costs O(n²) for long answers,
+    tokens arriving between two frames are drawn together instead.
+    """
+
+    def __init__(self, container):
         self.container = container
-        self.text = initial_text
+        self.text = ""
+        self.flushed_at = 0.0
+        self.pending = False
 
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
+    def write(self, token: str) -> None:
         self.text += token
-        self.container.markdown(self.text)
+        self.pending = True
+        if time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.container.markdown(self.text)
+            self.flushed_at = time.monotonic()
+            self.pending = False
+
+
+async def stream_response(input: str, container) -> str:
+    """Run the agent, streaming its answer and the progress of its tools."""
+    status = container.empty()
+    writer = ResponseWriter(container.empty())
+    output = None
+    tool = None
+    reranked = 0
+    async for event in agent_with_chat_history.astream_events(
+        {"input": input},
+        {"configurable": {"session_id": "any", "llm": model}},
+        version="v1",
+    ):
+        kind = event["event"]
+        if kind == "on_tool_start":
+            tool = event["name"]
+            reranked = 0
+            status.status(TOOL_STATUS.get(tool, f"Running {tool}..."))
+        elif kind == "on_tool_end":
+            tool = None
+            status.empty()
+        elif kind == "on_chain_end" and event["name"] == "search_filters":
+            filters_output = event["data"].get("output")
+            filters = SearchFilters.parse_obj(
+                filters_output if isinstance(filters_output, dict) else {}
+            )
+            if not filters.empty:
+                status.status(f"Searching resumes for {filters.describe()}...")
+        elif kind == "on_retriever_end" and event["name"] == retriever.get_name():
+            documents = event["data"].get("output") or []
+            if isinstance(documents, dict):
+                documents = documents.get("documents", [])
+            status.status(f"Retrieved {len(documents)} resumes, reranking...")
+        elif kind == "on_chain_end" and event["name"] == "cross_encoder":
+            scores = event["data"].get("output") or []
+            status.status(f"Scored {len(scores)} resumes, reranking the best...")
+        elif kind == "on_chain_end" and event["name"] == "rerank":
+            reranked += event["metadata"].get("rerank_resumes", 1)
+            total = event["metadata"].get("rerank_total", reranked)
+            status.status(f"Reranked {reranked}/{total} resumes...")
+        elif kind == "on_chat_model_stream" and tool is None:
+            # tool calls stream chunks without text
+            content = event["data"]["chunk"].content
+            if isinstance(content, str) and content:
+                writer.write(content)
+        elif kind == "on_chain_end" and event["name"] == agent_executor.get_name():
+            output = (event["data"].get("output") or {}).get("output")
+    writer.flush()
+    if not writer.text and output:
+        writer.write(output)
+        writer.flush()
+    return writer.text or output
 
 
 for msg in msgs.messages:
@@ -122,19 +164,4 @@ for msg in msgs.messages:
 if msg := st.chat_input():
     st.chat_message("user").write(msg)
     with st.chat_message("assistant"):
-        message_placeholder = st.container()
-        empty = message_placeholder.empty()
-        # container.status("running")
-        # message_placeholder.markdown("Running...")
-        # st.write("heklo")
-        st_callback = ToolStreamHandler(message_placeholder)
-        # e.status("running")
-        # st_callback = StreamlitCallbackHandler(st.container())
-        stream_handler = StreamHandler(empty)
-        response = agent_with_chat_history.invoke(
-            {"input": msg},
-            {
-                "configurable": {"session_id": "any", "llm": model},
-                "callbacks": [st_callback, stream_handler],
-            },
-        )
+        asyncio.run(stream_response(msg, st.container()))
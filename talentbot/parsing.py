@@ -0,0 +1,315 @@
+"""Document parsing in a pool of warm worker processes."""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from langchain_community.document_loaders import UnstructuredFileLoader
+from langchain_core.documents import Document
+
+from talentbot.constants import (
+    PARSE_MAX_BYTES,
+    PARSE_MAX_PAGES,
+    PARSE_TIMEOUT,
+    PARSE_WORKERS,
+)
+from talentbot.dedup import file_hash
+from talentbot.document_loader import (
+    DocxDocumentLoader,
+    PDFDocumentLoader,
+)
+from talentbot.text_cache import get_text_cache
+
+logger = logging.getLogger(__name__)
+
+# bump when a change to parsing changes the text, to invalidate cached texts
+PARSER_VERSION = "1"
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DOC = "application/msword"
+PDF = "application/pdf"
+
+
+class ParseError(ValueError):
+    """A file that can't be parsed within the budget."""
+
+
+def _open(data: bytes, type: str, name: Optional[str] = None) -> io.BytesIO:
+    file = io.BytesIO(data)
+    file.name = name
+    file.type = type
+    return file
+
+
+def parse_document(file) -> Document:
+    """Extract the text of an uploaded file in the current process."""
+    if file.type == XLSX:
+        import pandas as pd
+        from openpyxl import load_workbook
+
+        wb = load_workbook(file)
+        sheet = wb.active
+        df = pd.DataFrame(sheet.values)
+        text = df.to_csv(sep="\t", index=False)
+        return Document(page_content=text, metadata={"is_csv": True})
+    if file.type == DOCX:
+        loader_name = DocxDocumentLoader
+    elif file.type == PDF:
+        loader_name = PDFDocumentLoader
+    else:
+        loader_name = UnstructuredFileLoader
+    loader = loader_name(
+        None,
+        file=file,
+        strategy="fast",  # without OCR
+    )
+    return loader.load()[0]
+
+
+def trim_pdf(data: bytes, max_pages: int) -> bytes:
+    """Keep the first `max_pages` pages of a PDF."""
+    import fitz
+
+    with fitz.open(stream=data, filetype="pdf") as pdf:
+        if pdf.page_count <= max_pages:
+            return data
+        pdf.select(range(max_pages))
+        return pdf.tobytes(garbage=3, deflate=True)
+
+
+# per-worker state, set up by _init_worker
+_profile_dir: Optional[str] = None
+
+
+def _init_worker() -> None:
+    """Pay the import and LibreOffice start-up costs once per worker."""
+    global _profile_dir
+    try:
+        import unstructured.partition.docx  # noqa: F401
+        import unstructured.partition.pdf  # noqa: F401
+    except ImportError:
+        logger.warning("unstructured is not installed, parsing will fail")
+    # each worker owns a LibreOffice profile, so conversions can run in
+    # parallel and only the first one initializes the profile
+    _profile_dir = tempfile.mkdtemp(prefix="talentbot-soffice-")
+    if shutil.which("soffice"):
+        subprocess.run(
+            [
+                "soffice",
+                f"-env:UserInstallation=file://{_profile_dir}",
+                "--headless",
+                "--terminate_after_init",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=PARSE_TIMEOUT,
+            check=False,
+        )
+
+
+def convert_doc(data: bytes, timeout: float = PARSE_TIMEOUT) -> bytes:
+    """Convert a .doc file to .docx with the worker's LibreOffice profile."""
+    with tempfile.TemporaryDirectory() as target_dir:
+        source = os.path.join(target_dir, "document.doc")
+        with open(source, "wb") as f:
+            f.write(data)
+        command = ["soffice"]
+        if _profile_dir:
+            command.append(f"-env:UserInstallation=file://{_profile_dir}")
+        command += [
+            "--headless",
+            "--convert-to",
+            "docx:MS Word 2007 XML",
+            "--outdir",
+            target_dir,
+            source,
+        ]
+        try:
+            subprocess.run(command, capture_output=True, timeout=timeout, check=False)
+        except subprocess.TimeoutExpired as e:
+            raise ParseError(f"Converting the document took over {timeout}s") from e
+        target = os.path.join(target_dir, "document.docx")
+        if not os.path.exists(target):
+            raise ParseError("Cannot convert the document to .docx")
+        with open(target, "rb") as f:
+            return f.read()
+
+
+def _parse(data: bytes, type: str, name: Optional[str], max_pages: int) -> Document:
+    if type == DOC:
+        data, type = convert_doc(data), DOCX
+    elif type == PDF and max_pages:
+        data = trim_pdf(data, max_pages)
+    return parse_document(_open(data, type, name))
+
+
+class ParsingService:
+    """Parses documents in a pool of long-lived processes.
+
+    Workers import ``unstructured`` and set up a LibreOffice profile once,
+    so parsing throughput scales with the number of cores instead of being
+    bound by the GIL. Files over `max_bytes` are rejected and PDFs are cut
+    to their first `max_pages` pages, 0 disables either budget.
+
+    With `use_cache`, parsed documents are stored in the text cache by file
+    hash, so parsing the same file again, e.g. to re-extract it with a new
+    prompt, skips partitioning.
+
+    A file still parsing after `timeout` seconds is rejected and the pool
+    recycled, since a running task can't be cancelled. At most `workers`
+    files are parsed at once, so time spent queued doesn't count.
+    """
+
+    def __init__(
+        self,
+        workers: int = PARSE_WORKERS,
+        max_bytes: int = PARSE_MAX_BYTES,
+        max_pages: int = PARSE_MAX_PAGES,
+        use_cache: bool = True,
+        timeout: float = PARSE_TIMEOUT,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.timeout = timeout
+        # one per worker, a submitted file starts parsing right away
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self.cache = get_text_cache(self.version) if use_cache else None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process with running threads isn't safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        """Replace `pool` and kill its workers, e.g. one stuck on a file."""
+        self._discard(pool)
+        # the executor has no public way to stop a running task
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(
+        self, data: bytes, type: str, name: Optional[str]
+    ) -> Tuple[ProcessPoolExecutor, Future]:
+        if self.max_bytes and len(data) > self.max_bytes:
+            raise ParseError(
+                f"{name or 'File'} is {len(data)} bytes, over the limit of "
+                f"{self.max_bytes}"
+            )
+        pool = self._get_pool()
+        try:
+            return pool, pool.submit(_parse, data, type, name, self.max_pages)
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for using too much memory
+            self._discard(pool)
+            pool = self._get_pool()
+            return pool, pool.submit(_parse, data, type, name, self.max_pages)
+
+    def submit(self, data: bytes, type: str, name: Optional[str] = None) -> Future:
+        """Parse in a worker, without the `timeout`."""
+        return self._submit(data, type, name)[1]
+
+    def _timed_out(self, pool: ProcessPoolExecutor, name: Optional[str]):
+        self._recycle(pool)
+        return ParseError(f"Parsing {name or 'the file'} took over {self.timeout}s")
+
+    def _run(self, data: bytes, type: str, name: Optional[str]) -> Document:
+        with self._slots:
+            for attempt in range(2):
+                pool, future = self._submit(data, type, name)
+                try:
+                    return future.result(timeout=self.timeout or None)
+                except FutureTimeoutError as e:
+                    raise self._timed_out(pool, name) from e
+                except BrokenProcessPool:
+                    # another file's timeout recycled the pool, or a worker died
+                    if attempt:
+                        raise
+
+    async def _arun(self, data: bytes, type: str, name: Optional[str]) -> Document:
+        loop = asyncio.get_running_loop()
+        acquire = loop.run_in_executor(None, self._slots.acquire)
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            acquire.add_done_callback(lambda _: self._slots.release())
+            raise
+        try:
+            for attempt in range(2):
+                pool, future = self._submit(data, type, name)
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.wrap_future(future), self.timeout or None
+                    )
+                except asyncio.TimeoutError as e:
+                    raise self._timed_out(pool, name) from e
+                except BrokenProcessPool:
+                    if attempt:
+                        raise
+        finally:
+            self._slots.release()
+
+    @property
+    def version(self) -> str:
+        """Parser settings the parsed text depends on."""
+        return f"{PARSER_VERSION}p{self.max_pages}"
+
+    def parse(self, data: bytes, type: str, name: Optional[str] = None) -> Document:
+        key = file_hash(data)
+        doc = self.cache.get(key) if self.cache else None
+        if doc is None:
+            doc = self._run(data, type, name)
+            if self.cache:
+                self.cache.put(key, doc)
+        return doc
+
+    async def aparse(
+        self, data: bytes, type: str, name: Optional[str] = None
+    ) -> Document:
+        key = file_hash(data)
+        loop = asyncio.get_running_loop()
+        doc = None
+        if self.cache:
+            doc = await loop.run_in_executor(None, self.cache.get, key)
+        if doc is None:
+            doc = await self._arun(data, type, name)
+            if self.cache:
+                await loop.run_in_executor(None, self.cache.put, key, doc)
+        return doc
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+@lru_cache(maxsize=None)
+def get_parsing_service() -> ParsingService:
+    """Return the process-wide parsing service."""
+    return ParsingService()
@@ -1,10 +1,13 @@
 import json
+import typing
+from typing import Dict, List, Type
 
+from langchain.pydantic_v1 import BaseModel
 from langchain_core.prompts import (
     ChatPromptTemplate,
 )
 
-from talentbot.constants import INDUSTRIES
+from talentbot.constants import INDUSTRIES, SCHEMA_FORMAT
 from talentbot.models import (
     EducationItem,
     Industry,
@@ -15,13 +18,68 @@ from talentbot.models import (
     WorkItem,
 )
 
+
+def _ts_type(type_, interfaces: Dict[str, Type[BaseModel]]) -> str:
+    if typing.get_origin(type_) in (list, List):
+        return f"{_ts_type(typing.get_args(type_)[0], interfaces)}[]"
+    if isinstance(type_, type) and issubclass(type_, BaseModel):
+        interfaces.setdefault(type_.__name__, type_)
+        return type_.__name__
+    if isinstance(type_, type) and issubclass(type_, bool):
+        return "boolean"
+    if isinstance(type_, type) and issubclass(type_, (int, float)):
+        return "number"
+    return "string"
+
+
+def render_schema(model: Type[BaseModel]) -> str:
+    """TypeScript-style interfaces of `model` and the models it nests.
+
+    Carries the same fields, types and descriptions as the JSON schema in
+    a fraction of the tokens. The output only depends on the model, so
+    prompts embedding it keep a stable prefix.
+    """
+    interfaces = {model.__name__: model}
+    lines = []
+    rendered = set()
+    while len(rendered) < len(interfaces):
+        name = next(name for name in interfaces if name not in rendered)
+        rendered.add(name)
+        lines.append(f"interface {name} {{")
+        for field in interfaces[name].__fields__.values():
+            optional = "" if field.required else "?"
+            line = (
+                f"  {field.name}{optional}: {_ts_type(field.outer_type_, interfaces)};"
+            )
+            if field.field_info.description:
+                line += f" // {field.field_info.description}"
+            lines.append(line)
+        lines.append("}")
+    return "\n".join(lines)
+
+
+def _example(resume: JsonResume) -> Dict:
+    # only fields with information, as the instructions ask for
+    return {
+        key: value
+        for key, value in resume.dict(exclude_none=True).items()
+        if value not in ([], {}, "")
+    }
+
+
+def _minify(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
 JSON_SCHEMA = JsonResume.schema_json()
 
+SCHEMA = render_schema(JsonResume) if SCHEMA_FORMAT == "compact" else JSON_SCHEMA
+
 RESTRUCTURE_TEMPLATE = """\
 You are a talent acquisition expert. Your task is to restructure the following resume according to these instructions:
 - The resume content provided is unstructured data, please read it carefully.
 - Translate to English if needed.
-- Restructure the content to match the provided JSON Schema (<json-schema></json-schema>).
+- Restructure the content to match the provided schema (<schema></schema>).
 - Include only fields with available information.
 - Predict suitable industries (<industries></industries>) from the provided list.
 - If you do not know the answer, just return {{ "error": "I don't know" }}, don't try to make up an answer.
@@ -31,9 +89,9 @@ You are a talent acquisition expert. Your task is to restructure the following r
 {industries}
 </industries>
 
-<json-schema>
+<schema>
 {schema}
-</json-schema>"""
+</schema>"""
 
 RESTRUCTURE_FEW_SHOT_HUMAN_TEMPLATE = """\
 Tên: Nguyen Van A
@@ -108,13 +166,13 @@ RESTRUCTURE_FEW_SHOT_AI_RESPONSE = JsonResume(
     ),
 )
 
-RESTRUCTURE_FEW_SHOT_AI_TEMPLATE = json.dumps(RESTRUCTURE_FEW_SHOT_AI_RESPONSE.dict())
+RESTRUCTURE_FEW_SHOT_AI_TEMPLATE = _minify(_example(RESTRUCTURE_FEW_SHOT_AI_RESPONSE))
 
 RESTRUCTURE_CSV_TEMPLATE = """\
 You are a talent acquisition expert. Your task is to restructure the following resume according to these instructions:
 - The resume content provided is unstructured TSV table data, please read it carefully.
 - Translate to English if needed.
-- Restructure the content to match the provided JSON Schema (<json-schema></json-schema>).
+- Restructure the content to match the provided schema (<schema></schema>).
 - Include only fields with available information.
 - Predict suitable industries (<industries></industries>) from the provided list.
 - If you do not know the answer, just return {{ "error": "I don't know" }}, don't try to make up an answer.
@@ -124,9 +182,9 @@ You are a talent acquisition expert. Your task is to restructure the following r
 {industries}
 </industries>
 
-<json-schema>
+<schema>
 {schema}
-</json-schema>"""
+</schema>"""
 
 RESTRUCTURE_CSV_FEW_SHOT_HUMAN_TEMPLATE = """\
 Thông tin ứng viên					
@@ -164,7 +222,7 @@ RESTRUCTURE_CSV_PROMPT = ChatPromptTemplate.from_messages(
         ("human", "This is CSV data:\n{input}"),
     ]
 ).partial(
-    schema=JSON_SCHEMA,
+    schema=SCHEMA,
     industries="\n".join(INDUSTRIES),
     example=RESTRUCTURE_CSV_FEW_SHOT_AI_TEMPLATE,
 )
@@ -177,7 +235,7 @@ RESTRUCTURE_PROMPT = ChatPromptTemplate.from_messages(
         ("human", "{input}"),
     ]
 ).partial(
-    schema=JSON_SCHEMA,
+    schema=SCHEMA,
     industries="\n".join(INDUSTRIES),
     example=RESTRUCTURE_FEW_SHOT_AI_TEMPLATE,
 )
@@ -187,16 +245,115 @@ You are an expert in talent acquisition.
 Your task is to summarize the following resume in English.
 Ensure the summary includes all important information such as: name, age, education, work experience, professional skills, soft skills, notable achievements, objectives etc.
 The summary should not exceed 4 paragraphs.
-If you do not know the answer, just say "I don't know.", don't try to make up an answer.
-The current GMT time is {current_time}"""
+If you do not know the answer, just say "I don't know.", don't try to make up an answer."""
 
 SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
     [
         ("system", SUMMARY_TEMPLATE),
-        ("user", "This is resume:\n{input}"),
+        ("user", "The current GMT time is {current_time}\n\nThis is resume:\n{input}"),
     ]
 )
 
+SUMMARY_FROM_JSON_TEMPLATE = """\
+You are an expert in talent acquisition.
+Your task is to summarize the following resume in English. The resume is given as JSON following the JSON Resume format.
+Ensure the summary includes all important information such as: name, age, education, work experience, professional skills, soft skills, notable achievements, objectives etc.
+The summary should not exceed 4 paragraphs.
+If you do not know the answer, just say "I don't know.", don't try to make up an answer."""
+
+SUMMARY_FROM_JSON_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SUMMARY_FROM_JSON_TEMPLATE),
+        ("user", "The current GMT time is {current_time}\n\nThis is resume:\n{input}"),
+    ]
+)
+
+EXTRACT_TEMPLATE = """\
+You are a talent acquisition expert. Your task is to restructure and summarize the following resume according to these instructions:
+- The resume content provided is {content}, please read it carefully.
+- Translate to English if needed.
+- Restructure the content to match the provided schema (<schema></schema>).
+- Include only fields with available information.
+- Predict suitable industries (<industries></industries>) from the provided list.
+- Summarize the resume in English, including all important information such as: name, age, education, work experience, professional skills, soft skills, notable achievements, objectives etc. The summary should not exceed 4 paragraphs.
+- Return a minified JSON object without whitespace in one line, with the restructured resume in "resume" and the summary in "summary".
+- If you do not know the answer, just return {{ "error": "I don't know" }}, don't try to make up an answer.
+
+<industries>
+{industries}
+</industries>
+
+<schema>
+{schema}
+</schema>"""
+
+EXTRACT_FEW_SHOT_SUMMARY = """\
+Nguyen Van A is a Java developer who graduated in IT Engineering from Hanoi University of Science and Technology (2010-2014) with a GPA of 3.5.
+
+From 2015 to 2017, Nguyen Van A worked at ABC Company, developing web applications with Java, Spring Boot and Angular. Skills include Java, Spring Boot, Angular, SQL and HTML. Languages: intermediate English and Japanese at N5 level."""
+
+EXTRACT_FEW_SHOT_AI_TEMPLATE = _minify(
+    {
+        "resume": _example(RESTRUCTURE_FEW_SHOT_AI_RESPONSE),
+        "summary": EXTRACT_FEW_SHOT_SUMMARY,
+    }
+)
+
+EXTRACT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", EXTRACT_TEMPLATE),
+        ("human", RESTRUCTURE_FEW_SHOT_HUMAN_TEMPLATE),
+        ("ai", "{example}"),
+        ("human", "The current GMT time is {current_time}\n\n{input}"),
+    ]
+).partial(
+    content="unstructured data",
+    schema=SCHEMA,
+    industries="\n".join(INDUSTRIES),
+    example=EXTRACT_FEW_SHOT_AI_TEMPLATE,
+)
+
+EXTRACT_CSV_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", EXTRACT_TEMPLATE),
+        ("human", RESTRUCTURE_CSV_FEW_SHOT_HUMAN_TEMPLATE),
+        ("ai", "{example}"),
+        (
+            "human",
+            "The current GMT time is {current_time}\n\nThis is CSV data:\n{input}",
+        ),
+    ]
+).partial(
+    content="unstructured TSV table data",
+    schema=SCHEMA,
+    industries="\n".join(INDUSTRIES),
+    example=EXTRACT_FEW_SHOT_AI_TEMPLATE,
+)
+
+SEARCH_FILTER_TEMPLATE = """\
+You are an expert in talent acquisition.
+Your task is to extract the hard requirements of the given job description that can be used to filter resumes before searching them.
+
+Use the following JSON structure for your response:
+{{"industries": [industries], "city": "[city]", "min_years": [years]}}
+
+- "industries": the industries the job belongs to, only from the list of industries (<industries></industries>), empty if unclear
+- "city": the city where the candidate must be located, in English, null if the job is remote or no city is required
+- "min_years": the minimum total years of work experience explicitly required, null if not stated
+
+Only use the information provided in the given job description. Do not make up any requirements of your own.
+
+<industries>
+{industries}
+</industries>"""
+
+SEARCH_FILTER_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SEARCH_FILTER_TEMPLATE),
+        ("human", "{jd}"),
+    ]
+).partial(industries="\n".join(INDUSTRIES))
+
 SEARCH_QUERY_TEMPLATE = """\
 You are an expert in talent acquisition.
 Your task is to generate 4 different versions (in English) of the given job description to retrieve relevant documents from a vector database.
@@ -240,21 +397,36 @@ You are an expert in talent acquisition.
 Evaluate the suitability of the following resume (<resume></resume>) for the job described in the job description (<jd></jd>).
 
 Rate the match between the resume and the job description on a scale of 0-100, and provide an explanation of your reasoning. Use the following JSON structure for your response:
-{{"score": [score], "reason": "[your reason]"}}
+{{"score": [score], "reason": "[your reason]"}}\
+"""
+
+# static instructions, then the job description shared by every candidate of
+# a search, then the resume: each call repeats the longest possible prefix
+RERANK_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", RERANK_PROMPT_TEMPLATE),
+        ("human", "<jd>\n{jd}\n</jd>"),
+        (
+            "human",
+            "<resume>\n{resume}\n</resume>\n\nCurrent GMT time is {current_time}",
+        ),
+    ]
+)
 
-<resume>
-{resume}
-</resume>
+LISTWISE_RERANK_PROMPT_TEMPLATE = """\
+You are an expert in talent acquisition.
 
-<jd>
-{jd}
-</jd>
+Evaluate the suitability of each of the following resumes (<resume id="..."></resume>) for the job described in the job description (<jd></jd>).
 
-Current GMT time is {current_time}\
+Rate the match between each resume and the job description on a scale of 0-100, independently of the other resumes, and provide an explanation of your reasoning. Use the following JSON structure for your response, with one item per resume and its id:
+[{{"id": [id], "score": [score], "reason": "[your reason]"}}]\
 """
 
-RERANK_PROMPT = ChatPromptTemplate.from_messages(
+# several resumes per call share one copy of the instructions and the JD
+LISTWISE_RERANK_PROMPT = ChatPromptTemplate.from_messages(
     [
-        ("system", RERANK_PROMPT_TEMPLATE),
+        ("system", LISTWISE_RERANK_PROMPT_TEMPLATE),
+        ("human", "<jd>\n{jd}\n</jd>"),
+        ("human", "{resumes}\n\nCurrent GMT time is {current_time}"),
     ]
 )
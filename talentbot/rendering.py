@@ -0,0 +1,117 @@
+"""Resume text and markdown rendered once per resume and template version.
+
+Searches send the text of every candidate to the LLM and the Resumes page
+shows the markdown on every rerun. Both are rendered from ``Resume.data``
+when a resume is upserted and stored in ``resume_renders``, so reads only
+select the column they need. Renders of an older template version, or of
+resumes stored before the table existed, are redone on first read.
+"""
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+from jinja2 import Environment, PackageLoader, select_autoescape
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.models import Resume, ResumeRender
+
+TEXT_TEMPLATE = "resume.txt.jinja"
+MD_TEMPLATE = "resume.md"
+
+
+@lru_cache(maxsize=None)
+def get_template_env() -> Environment:
+    return Environment(
+        loader=PackageLoader("talentbot", "templates"),
+        autoescape=select_autoescape(["html", "xml"]),
+    )
+
+
+@lru_cache(maxsize=None)
+def template_hash() -> str:
+    """Hash of the sources of both templates."""
+    env = get_template_env()
+    digest = hashlib.sha256()
+    for name in (TEXT_TEMPLATE, MD_TEMPLATE):
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_text(data: Dict) -> str:
+    return get_template_env().get_template(TEXT_TEMPLATE).render(**data)
+
+
+def render_md(data: Dict) -> str:
+    return get_template_env().get_template(MD_TEMPLATE).render(**data)
+
+
+class RenderStore:
+    """Rendered resumes, one row per resume.
+    Needs `ensure_resume_tables` to have run on the database.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def update(self, resumes: Dict[int, Dict]) -> List[Dict]:
+        """Render ``{resume_id: data}`` and store it, without committing.
+
+        Returns the stored rows.
+        """
+        if not resumes:
+            return []
+        values = [
+            {
+                "resume_id": resume_id,
+                "template_hash": template_hash(),
+                "rendered_text": render_text(data),
+                "rendered_md": render_md(data),
+            }
+            for resume_id, data in resumes.items()
+        ]
+        stmt = pg_insert(ResumeRender).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ResumeRender.resume_id],
+            set_={
+                "template_hash": stmt.excluded.template_hash,
+                "rendered_text": stmt.excluded.rendered_text,
+                "rendered_md": stmt.excluded.rendered_md,
+                "updated_at": func.now(),
+            },
+        )
+        self.session.execute(stmt)
+        return values
+
+    def _get(self, column, resume_ids: Iterable[int]) -> Dict[int, str]:
+        resume_ids = list(resume_ids)
+        if not resume_ids:
+            return {}
+        rows = self.session.execute(
+            select(ResumeRender.resume_id, column).where(
+                ResumeRender.resume_id.in_(resume_ids),
+                ResumeRender.template_hash == template_hash(),
+            )
+        ).all()
+        renders = {row[0]: row[1] for row in rows}
+        missing = [resume_id for resume_id in resume_ids if resume_id not in renders]
+        if missing:
+            data = dict(
+                self.session.execute(
+                    select(Resume.id, Resume.data).where(Resume.id.in_(missing))
+                ).all()
+            )
+            for values in self.update(data):
+                renders[values["resume_id"]] = values[column.key]
+            self.session.commit()
+        return renders
+
+    def texts(self, resume_ids: Iterable[int]) -> Dict[int, str]:
+        """``{resume_id: text}`` of the existing resumes among `resume_ids`."""
+        return self._get(ResumeRender.rendered_text, resume_ids)
+
+    def markdowns(self, resume_ids: Iterable[int]) -> Dict[int, str]:
+        """``{resume_id: markdown}`` of the existing resumes among `resume_ids`."""
+        return self._get(ResumeRender.rendered_md, resume_ids)
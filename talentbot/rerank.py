@@ -0,0 +1,720 @@
+"""Reranking of retrieved resumes against a job description.
+
+An optional local cross-encoder shortlists the candidates, then the LLM
+scores the shortlist and explains each score.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from talentbot.constants import (
+    RERANK_BATCH_SIZE,
+    RERANK_BATCH_TOKENS,
+    RERANK_CACHE_MAX_ROWS,
+    RERANK_CACHE_TTL_DAYS,
+    RERANK_CROSS_ENCODER_BATCH_SIZE,
+    RERANK_CROSS_ENCODER_DEVICE,
+    RERANK_CROSS_ENCODER_MODEL,
+    RERANK_CROSS_ENCODER_TOP_K,
+    RERANK_MAX_CANDIDATES,
+    RERANK_MAX_CONCURRENCY,
+    RERANK_MIN_SCORE_RATIO,
+    RERANK_MODE,
+    RERANK_TOP_N,
+)
+from talentbot.models import RerankCache, ensure_tables
+from talentbot.prompts import LISTWISE_RERANK_PROMPT, RERANK_PROMPT
+from talentbot.tokens import count_message_tokens, count_tokens
+from talentbot.utils import jd_hash
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Candidate:
+    id: int
+    name: str
+    resume: Any
+    vector_score: Optional[float] = None
+    updated_at: Optional[datetime] = None
+    cross_score: Optional[float] = None
+
+
+@dataclass
+class RerankStats:
+    """Latency and scores of both stages of the last rerank."""
+
+    candidates: int = 0
+    # cross-encoder stage, skipped when no model is configured
+    shortlisted: int = 0
+    cross_seconds: float = 0.0
+    cross_scores: List[float] = field(default_factory=list)
+    # LLM stage
+    llm_calls: int = 0
+    cached: int = 0
+    llm_seconds: float = 0.0
+    llm_scores: List[int] = field(default_factory=list)
+
+    def summary(self) -> str:
+        text = f"Reranked {self.candidates} candidates"
+        if self.cross_scores:
+            # scores of the shortlist, best first
+            text += (
+                f", cross-encoder kept {self.shortlisted} in {self.cross_seconds:.2f}s"
+                f" (scores {self.cross_scores[0]:.2f}..{self.cross_scores[-1]:.2f})"
+            )
+        text += (
+            f", LLM scored {self.llm_calls} ({self.cached} cached)"
+            f" in {self.llm_seconds:.2f}s"
+        )
+        if self.llm_scores:
+            text += f" (best {max(self.llm_scores)})"
+        return text
+
+
+# tokens of the <resume id="..."> tags around each resume of a batch
+RESUME_TAG_TOKENS = 12
+
+
+@lru_cache(maxsize=None)
+def _listwise_prefix_tokens() -> int:
+    # everything but the JD and the resumes
+    messages = LISTWISE_RERANK_PROMPT.format_messages(
+        jd="", resumes="", current_time=get_current_time()
+    )
+    return count_message_tokens(messages)
+
+
+@lru_cache(maxsize=None)
+def prompt_version(listwise: bool) -> str:
+    """Short hash of the rerank mode and the templates of its prompts."""
+    digest = hashlib.sha256(b"listwise" if listwise else b"pointwise")
+    # listwise reranks fall back to the pointwise prompt
+    prompts = [LISTWISE_RERANK_PROMPT, RERANK_PROMPT] if listwise else [RERANK_PROMPT]
+    for prompt in prompts:
+        for message in prompt.messages:
+            digest.update(message.prompt.template.encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def get_current_time() -> str:
+    return time.strftime("%A, %B %d, %Y %H:%M", time.localtime(time.time()))
+
+
+class RerankResultCache:
+    """Rerank scores stored in the ``rerank_cache`` table.
+
+    Entries are keyed by JD hash, resume id, the resume's ``updated_at`` and
+    model, so editing a resume or switching model never returns a stale
+    score. The model key includes the `prompt_version` of the reranker, so
+    changing the rerank prompts or mode doesn't either. Entries unused for `ttl` are evicted, as are the least recently
+    used ones beyond `max_rows`.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        ttl: timedelta = timedelta(days=RERANK_CACHE_TTL_DAYS),
+        max_rows: int = RERANK_CACHE_MAX_ROWS,
+        evict_probability: float = 0.05,
+    ):
+        self.session = session
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.evict_probability = evict_probability
+        ensure_tables(session.get_bind(), RerankCache)
+
+    def get_many(
+        self, jd: str, model: str, candidates: Iterable[Candidate]
+    ) -> Dict[int, Tuple[int, Optional[str]]]:
+        """Return ``{resume_id: (score, reason)}`` for cached candidates."""
+        keys = [(c.id, c.updated_at) for c in candidates if c.updated_at]
+        if not keys:
+            return {}
+        key = jd_hash(jd)
+        stmt = select(
+            RerankCache.id, RerankCache.resume_id, RerankCache.score, RerankCache.reason
+        ).where(
+            RerankCache.jd_hash == key,
+            RerankCache.model == model,
+            RerankCache.last_used_at >= func.now() - self.ttl,
+            tuple_(RerankCache.resume_id, RerankCache.resume_updated_at).in_(keys),
+        )
+        rows = self.session.execute(stmt).all()
+        if rows:
+            self.session.execute(
+                update(RerankCache)
+                .where(RerankCache.id.in_([row.id for row in rows]))
+                .values(last_used_at=func.now())
+            )
+            self.session.commit()
+        return {row.resume_id: (row.score, row.reason) for row in rows}
+
+    def put_many(
+        self, jd: str, model: str, entries: List[Tuple[Candidate, int, Optional[str]]]
+    ) -> None:
+        entries = [e for e in entries if e[0].updated_at]
+        if not entries:
+            return
+        key = jd_hash(jd)
+        stmt = pg_insert(RerankCache).values(
+            [
+                dict(
+                    jd_hash=key,
+                    resume_id=candidate.id,
+                    resume_updated_at=candidate.updated_at,
+                    model=model,
+                    score=score,
+                    reason=reason,
+                )
+                for candidate, score, reason in entries
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["jd_hash", "resume_id", "resume_updated_at", "model"],
+            set_=dict(
+                score=stmt.excluded.score,
+                reason=stmt.excluded.reason,
+                last_used_at=func.now(),
+            ),
+        )
+        self.session.execute(stmt)
+        self.session.commit()
+        if random.random() < self.evict_probability:
+            self.evict()
+
+    def evict(self) -> None:
+        self.session.execute(
+            delete(RerankCache).where(RerankCache.last_used_at < func.now() - self.ttl)
+        )
+        if self.max_rows:
+            # last_used_at of the newest row beyond the limit
+            cutoff = (
+                select(RerankCache.last_used_at)
+                .order_by(RerankCache.last_used_at.desc())
+                .offset(self.max_rows)
+                .limit(1)
+                .scalar_subquery()
+            )
+            self.session.execute(
+                delete(RerankCache).where(RerankCache.last_used_at <= cutoff)
+            )
+        self.session.commit()
+
+    @staticmethod
+    def invalidate(session: Session, resume_ids: Iterable[int]) -> None:
+        """Drop cached scores of resumes whose content changed.
+
+        Runs inside the resume upsert transaction, the table is created
+        beforehand by `ensure_resume_tables`.
+        """
+        session.execute(
+            delete(RerankCache).where(RerankCache.resume_id.in_(list(resume_ids)))
+        )
+
+
+@lru_cache(maxsize=None)
+def load_cross_encoder(model_name: str, device: Optional[str] = None):
+    """Return the process-wide sentence-transformers cross-encoder."""
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name, device=device)
+
+
+class CrossEncoderRanker:
+    """Shortlists candidates with a local cross-encoder.
+
+    Scores (job description, resume text) pairs in batches on the CPU,
+    which is much cheaper than an LLM call per candidate, and keeps the
+    `top_k` best candidates.
+
+    Args:
+        render: turns a candidate's resume into the text that is scored
+        model_name: sentence-transformers cross-encoder model
+        top_k: number of candidates kept for the LLM
+    """
+
+    def __init__(
+        self,
+        render: Callable[[Any], str],
+        model_name: str = RERANK_CROSS_ENCODER_MODEL,
+        top_k: int = RERANK_CROSS_ENCODER_TOP_K,
+        batch_size: int = RERANK_CROSS_ENCODER_BATCH_SIZE,
+        device: Optional[str] = RERANK_CROSS_ENCODER_DEVICE,
+    ):
+        self.render = render
+        self.model_name = model_name
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.device = device
+        # a named run reports the latency and scores of the stage in traces
+        self.runnable = RunnableLambda(self._score).with_config(
+            run_name="cross_encoder"
+        )
+
+    def _score(self, inputs: Dict) -> List[float]:
+        candidates = inputs["candidates"]
+        if not candidates:
+            return []
+        model = load_cross_encoder(self.model_name, self.device)
+        pairs = [(inputs["jd"], self.render(c.resume) or "") for c in candidates]
+        scores = model.predict(
+            pairs, batch_size=self.batch_size, show_progress_bar=False
+        )
+        return [float(score) for score in scores]
+
+    def _shortlist(
+        self, candidates: List[Candidate], scores: List[float]
+    ) -> List[Candidate]:
+        for candidate, score in zip(candidates, scores):
+            candidate.cross_score = score
+        ranked = sorted(candidates, key=lambda c: c.cross_score, reverse=True)
+        return ranked[: self.top_k] if self.top_k else ranked
+
+    def shortlist(
+        self, jd: str, candidates: List[Candidate], callbacks: Callbacks = None
+    ) -> List[Candidate]:
+        """The `top_k` candidates by cross-encoder score, best first.
+
+        If the model can't be loaded or run, all candidates are returned as
+        they are and only the LLM reranks them.
+        """
+        try:
+            scores = self.runnable.invoke(
+                {"jd": jd, "candidates": candidates}, config={"callbacks": callbacks}
+            )
+        except Exception as e:
+            logger.warning(f"Cross-encoder failed, reranking with the LLM only: {e}")
+            return candidates
+        return self._shortlist(candidates, scores)
+
+    async def ashortlist(
+        self, jd: str, candidates: List[Candidate], callbacks: Callbacks = None
+    ) -> List[Candidate]:
+        # RunnableLambda runs the blocking model in the default executor
+        try:
+            scores = await self.runnable.ainvoke(
+                {"jd": jd, "candidates": candidates}, config={"callbacks": callbacks}
+            )
+        except Exception as e:
+            logger.warning(f"Cross-encoder failed, reranking with the LLM only: {e}")
+            return candidates
+        return self._shortlist(candidates, scores)
+
+
+class Reranker:
+    """Scores candidates with one LLM call each, within a budget.
+
+    Candidates are ranked by vector score first. Only the best
+    `max_candidates` are considered, and candidates below `min_score_ratio`
+    of the best vector score are dropped. The rest are scored best first
+    with at most `max_concurrency` calls in flight. Once `top_n` candidates
+    have reached `threshold`, the calls not started yet are skipped, and
+    only the best `top_n` results are returned.
+
+    In listwise mode the instructions and JD are sent once per batch of
+    resumes, resumes missing from a batch's answer are scored on their own.
+    With a `first_stage`, every candidate left by the vector score cuts is
+    scored by it and only its shortlist goes to the LLM. The latency and
+    scores of both stages of the last call are kept in `stats`.
+
+    Args:
+        llm: chat model used for scoring
+        render: turns a candidate's resume into the text sent to the LLM
+        threshold: minimum LLM score for a candidate to be returned
+        cache: where scores are looked up before calling the LLM
+        model: key of MODEL_OPTIONS the scores are cached under, with the
+            `prompt_version`
+        first_stage: cheap ranker shortlisting the candidates for the LLM
+        listwise: score up to `batch_size` resumes per call, within
+            `batch_tokens` prompt tokens, instead of one resume per call
+    """
+
+    def __init__(
+        self,
+        llm: Runnable,
+        render: Callable[[Any], str],
+        threshold: int = 70,
+        cache: Optional[RerankResultCache] = None,
+        model: Optional[str] = None,
+        max_concurrency: int = RERANK_MAX_CONCURRENCY,
+        top_n: int = RERANK_TOP_N,
+        max_candidates: int = RERANK_MAX_CANDIDATES,
+        min_score_ratio: float = RERANK_MIN_SCORE_RATIO,
+        first_stage: Optional[CrossEncoderRanker] = None,
+        listwise: bool = RERANK_MODE == "listwise",
+        batch_size: int = RERANK_BATCH_SIZE,
+        batch_tokens: int = RERANK_BATCH_TOKENS,
+    ):
+        self.chain = RERANK_PROMPT | llm | JsonOutputParser()
+        self.list_chain = LISTWISE_RERANK_PROMPT | llm | JsonOutputParser()
+        self.listwise = listwise
+        self.batch_size = max(batch_size, 1)
+        self.batch_tokens = batch_tokens
+        self.render = render
+        self.threshold = threshold
+        self.cache = cache
+        self.model = model
+        self.max_concurrency = max(max_concurrency, 1)
+        self.top_n = top_n
+        self.max_candidates = max_candidates
+        self.min_score_ratio = min_score_ratio
+        self.first_stage = first_stage
+        self.stats = RerankStats()
+
+    def select(self, candidates: List[Candidate]) -> List[Candidate]:
+        """Order candidates by vector score and cut the long tail.
+
+        Candidates without a vector score, found by full-text search only,
+        come last but aren't cut by `min_score_ratio`.
+        """
+        ranked = sorted(
+            candidates,
+            key=lambda c: c.vector_score if c.vector_score is not None else 0,
+            reverse=True,
+        )
+        if self.min_score_ratio and ranked and ranked[0].vector_score:
+            min_score = ranked[0].vector_score * self.min_score_ratio
+            ranked = [
+                c
+                for c in ranked
+                if c.vector_score is None or c.vector_score >= min_score
+            ]
+        if self.max_candidates:
+            ranked = ranked[: self.max_candidates]
+        return ranked
+
+    def _config(self, candidates: List[Candidate], callbacks: Callbacks) -> Dict:
+        # the number of resumes to score, for progress reports
+        return {
+            "max_concurrency": self.max_concurrency,
+            "callbacks": callbacks,
+            "metadata": {"rerank_total": len(candidates)},
+        }
+
+    def _call_configs(
+        self, config: Dict, run_name: str, sizes: List[int]
+    ) -> List[Dict]:
+        # named runs with the number of resumes each scores, for progress
+        # reports, listwise fallbacks are named apart so they aren't counted twice
+        return [
+            {
+                **config,
+                "run_name": run_name,
+                "metadata": {
+                    **config["metadata"],
+                    "rerank_resumes": size,
+                },
+            }
+            for size in sizes
+        ]
+
+    def _pointwise_run_name(self) -> str:
+        return "rerank_fallback" if self.listwise else "rerank"
+
+    def _batches(
+        self, jd: str, candidates: List[Candidate]
+    ) -> List[List[Tuple[Candidate, str]]]:
+        """Pack rendered resumes into calls of at most `batch_size` resumes
+        and `batch_tokens` prompt tokens. A resume over the budget on its
+        own still gets a call."""
+        fixed = _listwise_prefix_tokens() + count_tokens(jd)
+        batches, batch, used = [], [], fixed
+        for candidate in candidates:
+            text = self.render(candidate.resume)
+            tokens = count_tokens(text) + RESUME_TAG_TOKENS
+            if batch and (
+                len(batch) >= self.batch_size or used + tokens > self.batch_tokens
+            ):
+                batches.append(batch)
+                batch, used = [], fixed
+            batch.append((candidate, text))
+            used += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _batch_inputs(self, jd: str, batches, current_time: str) -> List[Dict]:
+        return [
+            {
+                "jd": jd,
+                "resumes": "\n\n".join(
+                    f'<resume id="{candidate.id}">\n{text}\n</resume>'
+                    for candidate, text in batch
+                ),
+                "current_time": current_time,
+            }
+            for batch in batches
+        ]
+
+    def _parse_batches(self, batches, outputs):
+        """Scores found in the listwise outputs, and the candidates without one."""
+        scored, missing = [], []
+        for batch, output in zip(batches, outputs):
+            candidates = {candidate.id: candidate for candidate, _ in batch}
+            if isinstance(output, Exception):
+                logger.warning(f"Listwise rerank failed: {output}")
+                output = []
+            elif isinstance(output, dict):
+                # {"results": [...]} instead of a bare array
+                output = next((v for v in output.values() if isinstance(v, list)), [])
+            elif not isinstance(output, list):
+                logger.warning(f"Invalid listwise rerank output: {output}")
+                output = []
+            for item in output:
+                try:
+                    candidate = candidates.pop(int(item["id"]))
+                    score = int(item["score"])
+                except (KeyError, TypeError, ValueError):
+                    logger.warning(f"Invalid listwise rerank item: {item}")
+                    continue
+                scored.append((candidate, score, item.get("reason")))
+            missing += candidates.values()
+        return scored, missing
+
+    def _parse_batch(self, batch, output):
+        return self._parse_batches([batch], [output])
+
+    def _parse_one(self, candidate: Candidate, output):
+        return self._parse([candidate], [output]), []
+
+    def _run(self, chain, inputs, units, parse, configs, results, scored):
+        """Call `chain` on `inputs`, at most `max_concurrency` at a time, and
+        collect the scores of each call as it completes. Calls not started
+        yet are skipped once `top_n` candidates have passed. Returns the
+        candidates missing from the outputs."""
+        missing = []
+        executor = ContextThreadPoolExecutor(max_workers=self.max_concurrency)
+        futures = {
+            executor.submit(chain.invoke, input, configs[i]): i
+            for i, input in enumerate(inputs)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    output = future.result()
+                except Exception as e:
+                    output = e
+                self.stats.llm_calls += 1
+                found, lost = parse(units[i], output)
+                scored += found
+                missing += lost
+                self._collect(found, results)
+                if self._done(results):
+                    break
+        finally:
+            # calls in flight finish in the background, unused
+            executor.shutdown(wait=False, cancel_futures=True)
+        return missing
+
+    async def _arun(self, chain, inputs, units, parse, configs, results, scored):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def call(i: int):
+            async with semaphore:
+                try:
+                    return i, await chain.ainvoke(inputs[i], configs[i])
+                except Exception as e:
+                    return i, e
+
+        missing = []
+        tasks = [asyncio.ensure_future(call(i)) for i in range(len(inputs))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, output = await next_done
+                self.stats.llm_calls += 1
+                found, lost = parse(units[i], output)
+                scored += found
+                missing += lost
+                self._collect(found, results)
+                if self._done(results):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return missing
+
+    def _inputs(self, jd: str, wave: List[Candidate], current_time: str) -> List[Dict]:
+        return [
+            {
+                "id": candidate.id,
+                "jd": jd,
+                "resume": self.render(candidate.resume),
+                "current_time": current_time,
+            }
+            for candidate in wave
+        ]
+
+    def _parse(self, wave, outputs) -> List[Tuple[Candidate, int, Optional[str]]]:
+        scored = []
+        for candidate, output in zip(wave, outputs):
+            if isinstance(output, Exception):
+                logger.warning(f"Rerank failed for resume {candidate.id}: {output}")
+                continue
+            try:
+                scored.append((candidate, int(output["score"]), output.get("reason")))
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Invalid rerank output for {candidate.id}: {output}")
+        return scored
+
+    def _collect(self, scored, results: List[Dict]) -> None:
+        """Add passing scores to `results`."""
+        for candidate, score, reason in scored:
+            if score >= self.threshold:
+                results.append(
+                    {"candidate": candidate, "score": score, "reason": reason}
+                )
+
+    def _cache_model(self) -> str:
+        return f"{self.model}:{prompt_version(self.listwise)}"
+
+    def _from_cache(self, jd: str, candidates: List[Candidate], results: List[Dict]):
+        """Collect cached scores, return the candidates still to be scored."""
+        if not self.cache or not self.model:
+            return candidates
+        cached = self.cache.get_many(jd, self._cache_model(), candidates)
+        self.stats.cached = len(cached)
+        if cached:
+            logger.info(f"{len(cached)} of {len(candidates)} rerank scores cached")
+        self._collect(
+            [(c, *cached[c.id]) for c in candidates if c.id in cached], results
+        )
+        return [c for c in candidates if c.id not in cached]
+
+    def _to_cache(self, jd: str, scored) -> None:
+        if self.cache and self.model:
+            self.cache.put_many(jd, self._cache_model(), scored)
+
+    def _done(self, results: List[Dict]) -> bool:
+        return bool(self.top_n) and len(results) >= self.top_n
+
+    def _sorted(self, results: List[Dict]) -> List[Dict]:
+        results = sorted(results, key=lambda r: r["score"], reverse=True)
+        return results[: self.top_n] if self.top_n else results
+
+    def _first_stage_stats(self, shortlist: List[Candidate], seconds: float) -> None:
+        self.stats.shortlisted = len(shortlist)
+        self.stats.cross_seconds = seconds
+        self.stats.cross_scores = [
+            c.cross_score for c in shortlist if c.cross_score is not None
+        ]
+
+    def _llm_stats(self, scored) -> None:
+        self.stats.llm_scores += [score for _, score, _ in scored]
+
+    def _finish(self, results: List[Dict], seconds: float) -> List[Dict]:
+        self.stats.llm_seconds = seconds
+        logger.info(self.stats.summary())
+        return self._sorted(results)
+
+    def rerank(
+        self, jd: str, candidates: List[Candidate], callbacks: Callbacks = None
+    ) -> List[Dict]:
+        """Return at most `top_n` ``{"candidate", "score", "reason"}`` dicts,
+        best first."""
+        current_time = get_current_time()
+        results = []
+        candidates = self.select(candidates)
+        self.stats = RerankStats(candidates=len(candidates))
+        if self.first_stage:
+            start = time.perf_counter()
+            candidates = self.first_stage.shortlist(jd, candidates, callbacks)
+            self._first_stage_stats(candidates, time.perf_counter() - start)
+        candidates = self._from_cache(jd, candidates, results)
+        config = self._config(candidates, callbacks)
+        start = time.perf_counter()
+        scored = []
+        if self.listwise and not self._done(results):
+            batches = self._batches(jd, candidates)
+            inputs = self._batch_inputs(jd, batches, current_time)
+            candidates = self._run(
+                self.list_chain,
+                inputs,
+                batches,
+                self._parse_batch,
+                self._call_configs(config, "rerank", [len(batch) for batch in batches]),
+                results,
+                scored,
+            )
+            if candidates:
+                logger.info(f"{len(candidates)} resumes missing from listwise rerank")
+        if candidates and not self._done(results):
+            inputs = self._inputs(jd, candidates, current_time)
+            configs = self._call_configs(
+                config, self._pointwise_run_name(), [1] * len(candidates)
+            )
+            self._run(
+                self.chain,
+                inputs,
+                candidates,
+                self._parse_one,
+                configs,
+                results,
+                scored,
+            )
+        self._to_cache(jd, scored)
+        self._llm_stats(scored)
+        return self._finish(results, time.perf_counter() - start)
+
+    async def arerank(
+        self, jd: str, candidates: List[Candidate], callbacks: Callbacks = None
+    ) -> List[Dict]:
+        current_time = get_current_time()
+        results = []
+        candidates = self.select(candidates)
+        self.stats = RerankStats(candidates=len(candidates))
+        if self.first_stage:
+            start = time.perf_counter()
+            candidates = await self.first_stage.ashortlist(jd, candidates, callbacks)
+            self._first_stage_stats(candidates, time.perf_counter() - start)
+        candidates = self._from_cache(jd, candidates, results)
+        config = self._config(candidates, callbacks)
+        start = time.perf_counter()
+        scored = []
+        if self.listwise and not self._done(results):
+            batches = self._batches(jd, candidates)
+            inputs = self._batch_inputs(jd, batches, current_time)
+            candidates = await self._arun(
+                self.list_chain,
+                inputs,
+                batches,
+                self._parse_batch,
+                self._call_configs(config, "rerank", [len(batch) for batch in batches]),
+                results,
+                scored,
+            )
+            if candidates:
+                logger.info(f"{len(candidates)} resumes missing from listwise rerank")
+        if candidates and not self._done(results):
+            inputs = self._inputs(jd, candidates, current_time)
+            configs = self._call_configs(
+                config, self._pointwise_run_name(), [1] * len(candidates)
+            )
+            await self._arun(
+                self.chain,
+                inputs,
+                candidates,
+                self._parse_one,
+                configs,
+                results,
+                scored,
+            )
+        self._to_cache(jd, scored)
+        self._llm_stats(scored)
+        return self._finish(results, time.perf_counter() - start)
@@ -1,43 +1,489 @@
+import asyncio
+import copy
 import logging
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import boto3
 import boto3.session
 from langchain.retrievers.multi_query import (
     MultiQueryRetriever as BaseMultiQueryRetriever,
 )
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import OpenSearchVectorSearch
 from langchain_core.callbacks import (
     AsyncCallbackManagerForRetrieverRun,
     CallbackManagerForRetrieverRun,
 )
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
 from opensearchpy import AWSV4SignerAuth, RequestsHttpConnection
+from sqlalchemy import Engine
 
+from talentbot.cache import SQLiteCache, TTLCache
+from talentbot.constants import (
+    OPENSEARCH_URL,
+    QUERY_CACHE_PATH,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    RETRIEVAL_BATCH_SEARCH,
+    RETRIEVAL_HYBRID,
+    RETRIEVAL_K,
+    RETRIEVAL_MAX_CONCURRENCY,
+    RETRIEVAL_QUERY_TIMEOUT,
+    VECTOR_BACKEND,
+)
+from talentbot.embeddings import create_embedding_function, embed_queries
+from talentbot.lexical import LexicalRetriever
 from talentbot.prompts import SEARCH_QUERY_PROMPT
+from talentbot.utils import jd_hash
+from talentbot.vectorstores import LocalVectorStore
 
 logger = logging.getLogger(__name__)
 
 service = "aoss"  # must set the service as 'aoss'
 region = "ap-southeast-1"
-credentials = boto3.Session().get_credentials()
-# awsauth = AWS4Auth(refreshable_credentials=credentials, region=region, service=service)
-auth = AWSV4SignerAuth(credentials, region, service)
+
+
+@lru_cache(maxsize=None)
+def get_aws_auth() -> AWSV4SignerAuth:
+    credentials = boto3.Session().get_credentials()
+    # awsauth = AWS4Auth(refreshable_credentials=credentials, region=region, service=service)
+    return AWSV4SignerAuth(credentials, region, service)
+
+
+class ResumeVectorSearch(OpenSearchVectorSearch):
+    """OpenSearch vector store with resume-level helpers.
+
+    Every chunk carries a ``resume_id`` in its metadata, so deletes and counts
+    are done per resume instead of per chunk id.
+    """
+
+    @property
+    def supports_aliases(self) -> bool:
+        # OpenSearch Serverless collections don't support index aliases
+        return not self.is_aoss
+
+    def for_index(self, index_name: str) -> "ResumeVectorSearch":
+        """Return a copy of this store that reads and writes `index_name`."""
+        db = copy.copy(self)
+        db.index_name = index_name
+        return db
+
+    def count(self) -> int:
+        if not self.index_exists():
+            return 0
+        return self.client.count(index=self.index_name).get("count", 0)
+
+    def resume_document_ids(self, resume_ids: Iterable[int]) -> List[str]:
+        resume_ids = list(resume_ids)
+        if not resume_ids or not self.index_exists():
+            return []
+        query = {
+            "size": 10000,
+            "_source": False,
+            "query": {"terms": {"metadata.resume_id": resume_ids}},
+        }
+        response = self.client.search(index=self.index_name, body=query)
+        return [hit["_id"] for hit in response["hits"]["hits"]]
+
+    def delete_resumes(self, resume_ids: Iterable[int]) -> Optional[bool]:
+        """Delete all chunks belonging to the given resumes."""
+        ids = self.resume_document_ids(resume_ids)
+        if not ids:
+            return False
+        return self.delete(ids, refresh_indices=False)
+
+    def swap_alias(self, alias: str) -> List[str]:
+        """Point `alias` at this store's index atomically.
+
+        A concrete index that still uses the alias name (from before aliases
+        were introduced) is removed in the same request. Returns the names of
+        the indices the alias pointed to before, which the caller may drop.
+        """
+        actions = [{"add": {"index": self.index_name, "alias": alias}}]
+        previous = []
+        if self.client.indices.exists_alias(name=alias):
+            previous = [
+                name
+                for name in self.client.indices.get_alias(name=alias)
+                if name != self.index_name
+            ]
+            actions += [
+                {"remove": {"index": name, "alias": alias}} for name in previous
+            ]
+        elif self.client.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+        self.client.indices.update_aliases(body={"actions": actions})
+        return previous
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        resume_ids: Optional[List[int]] = None,
+        **kwargs,
+    ) -> List[Tuple[Document, float]]:
+        """Like the base search, `resume_ids` only returns chunks of those resumes."""
+        if resume_ids is not None:
+            kwargs["filter"] = _resume_filter(resume_ids, kwargs.get("filter"))
+        return super().similarity_search_with_score(query, k, **kwargs)
+
+    def batch_similarity_search_with_score(
+        self,
+        queries: List[str],
+        k: int = 4,
+        resume_ids: Optional[List[int]] = None,
+        **kwargs,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Search several queries with one embedding pass and one request.
+
+        Accepts the same `filter` and `resume_ids` as
+        `similarity_search_with_score`, returns the hits of every query in
+        order. A query that fails on the server gets no hits.
+        """
+        if not queries:
+            return []
+        vector_field = kwargs.get("vector_field", "vector_field")
+        text_field = kwargs.get("text_field", "text")
+        filter = kwargs.get("filter")
+        if resume_ids is not None:
+            filter = _resume_filter(resume_ids, filter)
+        vectors = embed_queries(self.embedding_function, queries)
+        body = []
+        for vector in vectors:
+            knn = {"vector": vector, "k": k}
+            if filter:
+                knn["filter"] = filter
+            body.append({"index": self.index_name})
+            body.append({"size": k, "query": {"knn": {vector_field: knn}}})
+        response = self.client.msearch(body=body)
+
+        results = []
+        for query, result in zip(queries, response["responses"]):
+            if "error" in result:
+                logger.warning(f"Search failed for {query!r}: {result['error']}")
+                results.append([])
+                continue
+            results.append(
+                [
+                    (
+                        Document(
+                            page_content=hit["_source"][text_field],
+                            metadata=hit["_source"].get("metadata", {}),
+                        ),
+                        hit["_score"],
+                    )
+                    for hit in result["hits"]["hits"]
+                ]
+            )
+        return results
+
+
+def _resume_filter(resume_ids: Iterable[int], filter: Optional[Dict] = None) -> Dict:
+    terms = {"terms": {"metadata.resume_id": list(resume_ids)}}
+    if not filter:
+        return terms
+    return {"bool": {"filter": [filter, terms]}}
+
+
+def reciprocal_rank_fusion(
+    results: List[List[Tuple[Document, Optional[float]]]], k: int = 60
+) -> List[Document]:
+    """Fuse ranked hit lists into one document per resume.
+
+    Each resume scores ``sum(1 / (k + rank))`` over the lists it appears in,
+    using its best ranked chunk per list. The fused score replaces
+    ``metadata["score"]``, the best raw score is kept as ``vector_score``.
+    Hits without a raw score never replace a scored one, a resume with none
+    gets a ``vector_score`` of `None`.
+    """
+    fused: Dict[int, float] = {}
+    best: Dict[int, Tuple[Document, float]] = {}
+    for hits in results:
+        seen = set()
+        for rank, (doc, score) in enumerate(hits, start=1):
+            resume_id = doc.metadata["resume_id"]
+            if resume_id in seen:
+                continue
+            seen.add(resume_id)
+            fused[resume_id] = fused.get(resume_id, 0.0) + 1.0 / (k + rank)
+            kept = best[resume_id][1] if resume_id in best else None
+            if resume_id not in best or (
+                score is not None and (kept is None or score > kept)
+            ):
+                best[resume_id] = (doc, score)
+    documents = []
+    for resume_id in sorted(fused, key=fused.get, reverse=True):
+        doc, score = best[resume_id]
+        doc.metadata["vector_score"] = score
+        doc.metadata["score"] = fused[resume_id]
+        documents.append(doc)
+    return documents
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses the resumes found by vector and full-text search.
+
+    Both rankings are combined with reciprocal rank fusion, so resumes that
+    match the meaning and the exact skills of a job description come first.
+    The vector document of a resume is kept when both sides found it, the
+    fused score replaces ``metadata["score"]`` and the vector score is kept as
+    ``vector_score``, `None` for resumes only full-text search found.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_retriever: BaseRetriever
+    k: int = 60
+    """Rank constant of the fusion."""
+
+    def filtered(self, resume_ids: List[int]) -> "HybridRetriever":
+        """A copy of this retriever that only searches `resume_ids`."""
+        return self.copy(
+            update={
+                "vector_retriever": self.vector_retriever.filtered(resume_ids),
+                "lexical_retriever": self.lexical_retriever.filtered(resume_ids),
+            }
+        )
+
+    def fuse(self, vector: List[Document], lexical: List[Document]) -> List[Document]:
+        # a fused vector ranking keeps its raw scores apart already
+        scored = [
+            (doc, doc.metadata.get("vector_score", doc.metadata.get("score")))
+            for doc in vector
+        ]
+        # full-text ranks aren't comparable to vector scores
+        return reciprocal_rank_fusion(
+            [scored, [(doc, None) for doc in lexical]], self.k
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            vector = pool.submit(self.vector_retriever.invoke, query, config=config)
+            lexical = pool.submit(self.lexical_retriever.invoke, query, config=config)
+            return self.fuse(vector.result(), lexical.result())
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        rankings = await asyncio.gather(
+            self.vector_retriever.ainvoke(query, config=config),
+            self.lexical_retriever.ainvoke(query, config=config),
+        )
+        return self.fuse(*rankings)
+
+
+class ScoredVectorStoreRetriever(VectorStoreRetriever):
+    """Similarity retriever that keeps the vector score in ``metadata["score"]``."""
+
+    def filtered(self, resume_ids: List[int]) -> "ScoredVectorStoreRetriever":
+        """A copy of this retriever that only searches `resume_ids`."""
+        search_kwargs = {**self.search_kwargs, "resume_ids": resume_ids}
+        return self.copy(update={"search_kwargs": search_kwargs})
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs_and_scores = self.vectorstore.similarity_search_with_score(
+            query, **self.search_kwargs
+        )
+        return _with_scores(docs_and_scores)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs_and_scores = await self.vectorstore.asimilarity_search_with_score(
+            query, **self.search_kwargs
+        )
+        return _with_scores(docs_and_scores)
+
+
+def _with_scores(docs_and_scores) -> List[Document]:
+    documents = []
+    for doc, score in docs_and_scores:
+        doc.metadata["score"] = score
+        documents.append(doc)
+    return documents
+
+
+class QueryCache:
+    """LLM generated search queries keyed by the normalized question.
+
+    Lookups go to an in-process LRU first and, when `path` is set, to a
+    SQLite file shared across restarts.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = QUERY_CACHE_SIZE,
+        ttl: Optional[float] = QUERY_CACHE_TTL,
+        path: Optional[str] = QUERY_CACHE_PATH,
+    ):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteCache(path, maxsize=maxsize * 20, ttl=ttl) if path else None
+
+    def get(self, question: str) -> Optional[List[str]]:
+        key = jd_hash(question)
+        queries = self.memory.get(key)
+        if queries is None and self.disk is not None:
+            queries = self.disk.get(key)
+            if queries is not None:
+                self.memory.set(key, queries)
+        return queries
+
+    def set(self, question: str, queries: List[str]) -> None:
+        key = jd_hash(question)
+        self.memory.set(key, queries)
+        if self.disk is not None:
+            self.disk.set(key, queries)
+
+
+@lru_cache(maxsize=None)
+def get_query_cache() -> QueryCache:
+    return QueryCache()
+
+
+class _ResumeUnion:
+    """One document per resume, in first-seen order, with its best score."""
+
+    def __init__(self):
+        self.by_resume = {}
+
+    def add(self, documents: Iterable[Document]) -> "_ResumeUnion":
+        for doc in documents:
+            resume_id = doc.metadata["resume_id"]
+            seen = self.by_resume.get(resume_id)
+            if seen is None:
+                self.by_resume[resume_id] = doc
+            elif doc.metadata.get("score", 0) > seen.metadata.get("score", 0):
+                seen.metadata["score"] = doc.metadata["score"]
+        return self
+
+    def documents(self) -> List[Document]:
+        return list(self.by_resume.values())
 
 
 class MultiQueryRetriever(BaseMultiQueryRetriever):
+    query_cache: Optional[QueryCache] = None
+    """Cache of generated queries, `None` to always call the LLM."""
+    max_concurrency: int = RETRIEVAL_MAX_CONCURRENCY
+    """Maximum number of sub-queries searched at the same time."""
+    query_timeout: Optional[float] = RETRIEVAL_QUERY_TIMEOUT
+    """Seconds all sub-query searches may take together, a batch search and its
+    fallback included. Results found by then are returned, the rest dropped."""
+    batch_search: bool = RETRIEVAL_BATCH_SEARCH
+    """Search all sub-queries in one round-trip when the vector store can."""
+
+    def filtered(self, resume_ids: List[int]) -> "MultiQueryRetriever":
+        """A copy of this retriever that only searches `resume_ids`."""
+        return self.copy(update={"retriever": self.retriever.filtered(resume_ids)})
+
     def unique_union(self, documents: List[Document]) -> List[Document]:
-        unique_documents = super().unique_union(documents)
-        # remove same source metadata
-        seen = set()
-        new_documents = []
-        for doc in unique_documents:
-            if doc.metadata["resume_id"] not in seen:
-                seen.add(doc.metadata["resume_id"])
-                new_documents.append(doc)
+        return _ResumeUnion().add(documents).documents()
+
+    def _can_batch_search(self) -> bool:
+        vectorstore = getattr(self.retriever, "vectorstore", None)
+        return self.batch_search and hasattr(
+            vectorstore, "batch_similarity_search_with_score"
+        )
+
+    def batch_retrieve(self, queries: List[str]) -> List[Document]:
+        """Search all queries at once and fuse the rankings."""
+        results = self.retriever.vectorstore.batch_similarity_search_with_score(
+            queries, **self.retriever.search_kwargs
+        )
+        return reciprocal_rank_fusion(results)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        queries = self.generate_queries(query, run_manager)
+        if self.include_original:
+            queries.append(query)
+        deadline = self._deadline(time.monotonic())
+        if self._can_batch_search():
+            try:
+                return self.batch_retrieve(queries)
+            except Exception as e:
+                logger.warning(f"Batch search failed, searching one by one: {e}")
+        pool = ThreadPoolExecutor(max_workers=max(self.max_concurrency, 1))
+        futures = {
+            pool.submit(
+                self.retriever.invoke,
+                q,
+                config={"callbacks": run_manager.get_child()},
+            ): q
+            for q in queries
+        }
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = wait(futures, timeout)
+        finally:
+            # don't wait for hung searches, nor start queued ones
+            pool.shutdown(wait=False, cancel_futures=True)
+        union = _ResumeUnion()
+        for future, q in futures.items():
+            if future not in done:
+                logger.warning(f"Sub-query {q!r} timed out, skipping it")
+                continue
+            try:
+                union.add(future.result())
+            except Exception as e:
+                logger.warning(f"Sub-query {q!r} failed: {e}")
+        return union.documents()
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        queries = await self.agenerate_queries(query, run_manager)
+        if self.include_original:
+            queries.append(query)
+        loop = asyncio.get_running_loop()
+        deadline = self._deadline(loop.time())
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(deadline - loop.time(), 0)
+
+        if self._can_batch_search():
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(None, self.batch_retrieve, queries),
+                    timeout=remaining(),
+                )
+            except Exception as e:
+                logger.warning(f"Batch search failed, searching one by one: {e}")
+        semaphore = asyncio.Semaphore(max(self.max_concurrency, 1))
+
+        async def search(q: str) -> List[Document]:
+            async with semaphore:
+                return await self.retriever.ainvoke(
+                    q, config={"callbacks": run_manager.get_child()}
+                )
+
+        if not queries:
+            return []
+        tasks = [asyncio.ensure_future(search(q)) for q in queries]
+        done, pending = await asyncio.wait(tasks, timeout=remaining())
+        for task in pending:
+            task.cancel()
+        union = _ResumeUnion()
+        for task, q in zip(tasks, queries):
+            if task not in done:
+                logger.warning(f"Sub-query {q!r} timed out, skipping it")
+            elif task.exception() is not None:
+                logger.warning(f"Sub-query {q!r} failed: {task.exception()}")
+            else:
+                union.add(task.result())
+        return union.documents()
 
-        return new_documents
+    def _deadline(self, now: float) -> Optional[float]:
+        return None if self.query_timeout is None else now + self.query_timeout
 
     def generate_queries(
         self, question: str, run_manager: CallbackManagerForRetrieverRun
@@ -50,10 +496,18 @@ class MultiQueryRetriever(BaseMultiQueryRetriever):
         Returns:
             List of LLM generated queries that are similar to the user input
         """
+        cached = self.query_cache.get(question) if self.query_cache else None
+        if cached is not None:
+            run_manager.on_text(
+                f"Using {len(cached)} cached queries\n", verbose=self.verbose
+            )
+            return list(cached)
         lines = super().generate_queries(question, run_manager)
         filtered_lines = [line for line in lines if line.strip()]
         if self.verbose:
             logger.info(f"Filtered generated queries: {filtered_lines}")
+        if self.query_cache and filtered_lines:
+            self.query_cache.set(question, filtered_lines)
         return filtered_lines
 
     async def agenerate_queries(
@@ -67,20 +521,30 @@ class MultiQueryRetriever(BaseMultiQueryRetriever):
         Returns:
             List of LLM generated queries that are similar to the user input
         """
-        lines = await super().generate_queries(question, run_manager)
+        cached = self.query_cache.get(question) if self.query_cache else None
+        if cached is not None:
+            await run_manager.on_text(
+                f"Using {len(cached)} cached queries\n", verbose=self.verbose
+            )
+            return list(cached)
+        lines = await super().agenerate_queries(question, run_manager)
         filtered_lines = [line for line in lines if line.strip()]
         if self.verbose:
             logger.info(f"Filtered generated queries: {filtered_lines}")
+        if self.query_cache and filtered_lines:
+            self.query_cache.set(question, filtered_lines)
         return filtered_lines
 
 
 def create_vector_store(index_name):
-    embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    docsearch = OpenSearchVectorSearch(
+    embedding_function = create_embedding_function()
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore(index_name, embedding_function)
+    docsearch = ResumeVectorSearch(
         index_name=index_name,
         embedding_function=embedding_function,
-        opensearch_url="https://ax2dqkndahwt0w9xe6f2.ap-southeast-1.aoss.amazonaws.com",
-        http_auth=auth,
+        opensearch_url=OPENSEARCH_URL,
+        http_auth=get_aws_auth(),
         use_ssl=True,
         timeout=300,
         verify_certs=True,
@@ -90,11 +554,21 @@ def create_vector_store(index_name):
     return docsearch
 
 
-def create_retriever(llm, vector_store):
+def create_retriever(llm, vector_store, engine: Optional[Engine] = None):
+    """Multi-query vector retriever, fused with full-text search when the
+    resumes database `engine` is given and RETRIEVAL_HYBRID is on."""
     retriever = MultiQueryRetriever.from_llm(
-        retriever=vector_store.as_retriever(search_kwargs={"k": 20}),
+        retriever=ScoredVectorStoreRetriever(
+            vectorstore=vector_store, search_kwargs={"k": RETRIEVAL_K}
+        ),
         llm=llm,
         prompt=SEARCH_QUERY_PROMPT,
         # include_original=True,
     )
+    retriever.query_cache = get_query_cache()
+    if engine is not None and RETRIEVAL_HYBRID:
+        return HybridRetriever(
+            vector_retriever=retriever,
+            lexical_retriever=LexicalRetriever(engine=engine),
+        )
     return retriever
@@ -0,0 +1,181 @@
+"""Process-wide rate limiting and prioritization of LLM calls.
+
+Every page, the upload pipeline and the reranker share the provider rate
+limits, so they share one scheduler. Each model key of MODEL_OPTIONS gets
+token buckets for requests and tokens per minute. Bulk calls leave a
+reserve of each bucket to interactive ones and wait while an interactive
+call is waiting. After a 429 the model pauses and its rates are halved,
+then recover over the following minutes.
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Optional
+
+from talentbot.constants import LLM_INTERACTIVE_RESERVE, LLM_RATE_LIMITS
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# rate limited models run at least at this fraction of their limits
+MIN_SCALE = 0.1
+# fraction of the limits recovered per minute without rate limit errors
+RECOVERY_PER_MINUTE = 0.1
+# pause after a rate limit error without a retry-after header
+DEFAULT_PAUSE = 5.0
+# longest sleep between checks, a waiting interactive call is seen quickly
+MAX_SLEEP = 0.5
+
+
+class TokenBucket:
+    """Holds up to a minute of `rate`, refilled continuously."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.level = rate
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        rate = self.rate * scale
+        self.level = min(self.rate, self.level + (now - self.updated) * rate / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float, scale: float) -> float:
+        """Seconds until `amount` can be taken with `reserve` left over."""
+        # a request larger than the bucket only needs it full
+        needed = min(amount + reserve * self.rate, self.rate)
+        if self.level >= needed:
+            return 0
+        return (needed - self.level) * 60 / (self.rate * scale)
+
+
+@dataclass
+class _ModelState:
+    requests: Optional[TokenBucket]
+    tokens: Optional[TokenBucket]
+    scale: float = 1.0
+    scaled_at: float = 0.0
+    paused_until: float = 0.0
+    waiting: Dict[str, int] = field(default_factory=lambda: {INTERACTIVE: 0, BULK: 0})
+
+
+class LLMScheduler:
+    """Admits LLM calls within the rate limits of each model key.
+
+    Usage:
+        scheduler.acquire("openai_gpt_4o", tokens=1500, priority=BULK)
+        response = call_the_model()
+        scheduler.release("openai_gpt_4o", reserved=1500, used=1200)
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, float]] = LLM_RATE_LIMITS,
+        reserve: float = LLM_INTERACTIVE_RESERVE,
+    ):
+        self.limits = limits
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelState] = {}
+
+    def _state(self, key: str) -> _ModelState:
+        state = self._models.get(key)
+        if state is None:
+            limits = self.limits.get(key, {})
+            state = self._models[key] = _ModelState(
+                requests=TokenBucket(limits["rpm"]) if limits.get("rpm") else None,
+                tokens=TokenBucket(limits["tpm"]) if limits.get("tpm") else None,
+            )
+        return state
+
+    def _try(self, key: str, tokens: int, priority: str) -> float:
+        """Take the budget of a call, or return how long to wait for it."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key)
+            if now < state.paused_until:
+                return state.paused_until - now
+            if state.scale < 1:
+                since = max(state.scaled_at, state.paused_until)
+                state.scale = min(
+                    1.0, state.scale + RECOVERY_PER_MINUTE * (now - since) / 60
+                )
+                state.scaled_at = now
+            buckets = [
+                (bucket, n)
+                for bucket, n in ((state.requests, 1), (state.tokens, tokens))
+                if bucket
+            ]
+            for bucket, _ in buckets:
+                bucket.refill(now, state.scale)
+            reserve = 0.0
+            if priority == BULK:
+                if state.waiting[INTERACTIVE]:
+                    return MAX_SLEEP
+                reserve = self.reserve
+            wait = max(
+                [bucket.wait_time(n, reserve, state.scale) for bucket, n in buckets],
+                default=0,
+            )
+            if wait == 0:
+                for bucket, n in buckets:
+                    bucket.level -= min(n, bucket.rate)
+            return wait
+
+    def _waiting(self, key: str, priority: str, delta: int) -> None:
+        with self._lock:
+            self._state(key).waiting[priority] += delta
+
+    def acquire(self, key: str, tokens: int = 0, priority: str = INTERACTIVE) -> None:
+        """Block until a call of `tokens` prompt and output tokens may start."""
+        wait = self._try(key, tokens, priority)
+        if not wait:
+            return
+        self._waiting(key, priority, 1)
+        try:
+            while wait:
+                time.sleep(min(wait, MAX_SLEEP))
+                wait = self._try(key, tokens, priority)
+        finally:
+            self._waiting(key, priority, -1)
+
+    async def aacquire(
+        self, key: str, tokens: int = 0, priority: str = INTERACTIVE
+    ) -> None:
+        wait = self._try(key, tokens, priority)
+        if not wait:
+            return
+        self._waiting(key, priority, 1)
+        try:
+            while wait:
+                await asyncio.sleep(min(wait, MAX_SLEEP))
+                wait = self._try(key, tokens, priority)
+        finally:
+            self._waiting(key, priority, -1)
+
+    def release(self, key: str, reserved: int, used: int) -> None:
+        """Give back the tokens a call reserved but didn't use."""
+        with self._lock:
+            bucket = self._state(key).tokens
+            if bucket and used < reserved:
+                bucket.level = min(bucket.rate, bucket.level + reserved - used)
+
+    def rate_limited(self, key: str, retry_after: Optional[float] = None) -> None:
+        """Pause `key` and halve its rates after a rate limit error."""
+        with self._lock:
+            state = self._state(key)
+            now = time.monotonic()
+            state.scale = max(MIN_SCALE, state.scale / 2)
+            state.scaled_at = now
+            pause = (
+                retry_after if retry_after is not None else DEFAULT_PAUSE / state.scale
+            )
+            state.paused_until = max(state.paused_until, now + pause)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide LLM scheduler."""
+    return LLMScheduler()
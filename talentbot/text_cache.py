@@ -0,0 +1,120 @@
+"""Compressed cache of parsed document text keyed by file content hash."""
+import gzip
+import json
+import logging
+import os
+import tempfile
+from functools import lru_cache
+from typing import Optional
+
+from langchain_core.documents import Document
+
+from talentbot.constants import (
+    BUCKET_NAME,
+    TEXT_CACHE,
+    TEXT_CACHE_DIR,
+    TEXT_CACHE_PREFIX,
+)
+from talentbot.utils import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(doc: Document) -> bytes:
+    payload = {"page_content": doc.page_content, "metadata": doc.metadata}
+    return gzip.compress(json.dumps(payload).encode("utf-8"))
+
+
+def _loads(data: bytes) -> Document:
+    payload = json.loads(gzip.decompress(data))
+    return Document(page_content=payload["page_content"], metadata=payload["metadata"])
+
+
+class LocalTextCache:
+    """Gzipped JSON files under `path`, sharded by the first key characters."""
+
+    def __init__(self, path: str = TEXT_CACHE_DIR):
+        self.path = path
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json.gz")
+
+    def get(self, key: str) -> Optional[Document]:
+        try:
+            with open(self._file(key), "rb") as f:
+                return _loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, doc: Document) -> None:
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file))
+        with os.fdopen(fd, "wb") as f:
+            f.write(_dumps(doc))
+        os.replace(tmp, file)
+
+
+class S3TextCache:
+    """Gzipped JSON objects under `prefix` in the resumes bucket."""
+
+    def __init__(self, bucket: str = BUCKET_NAME, prefix: str = TEXT_CACHE_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Document]:
+        s3_client = get_s3_client()
+        try:
+            response = s3_client.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}{key}.json.gz"
+            )
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return _loads(response["Body"].read())
+
+    def put(self, key: str, doc: Document) -> None:
+        get_s3_client().put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json.gz",
+            Body=_dumps(doc),
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+
+
+class TextCache:
+    """Parsed documents keyed by file hash and parser settings.
+
+    Errors of the underlying store are logged and treated as misses, the
+    cache never makes parsing fail.
+    """
+
+    def __init__(self, store, version: str):
+        self.store = store
+        self.version = version
+
+    def _key(self, file_hash: str) -> str:
+        return f"{file_hash}-{self.version}"
+
+    def get(self, file_hash: str) -> Optional[Document]:
+        try:
+            return self.store.get(self._key(file_hash))
+        except Exception as e:
+            logger.warning(f"Failed to read parsed text {file_hash}: {e}")
+            return None
+
+    def put(self, file_hash: str, doc: Document) -> None:
+        try:
+            self.store.put(self._key(file_hash), doc)
+        except Exception as e:
+            logger.warning(f"Failed to cache parsed text {file_hash}: {e}")
+
+
+@lru_cache(maxsize=None)
+def get_text_cache(version: str) -> Optional[TextCache]:
+    """Return the configured cache for texts parsed with `version` settings."""
+    if TEXT_CACHE == "local":
+        return TextCache(LocalTextCache(), version)
+    if TEXT_CACHE == "s3":
+        return TextCache(S3TextCache(), version)
+    return None
@@ -0,0 +1,56 @@
+"""Token counting for prompts, with tiktoken."""
+import logging
+from functools import lru_cache
+from typing import Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+# tokens added by the chat format, per message and per reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4o"):
+    """The tiktoken encoding of `model`, or None when it can't be loaded.
+
+    Encodings are downloaded on first use, a machine without network
+    access falls back to an estimate.
+    """
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # newer and non-OpenAI models, close enough for budgeting
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Cannot load the tiktoken encoding, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(
+    messages: Sequence[BaseMessage], model: Optional[str] = None
+) -> int:
+    """Prompt tokens of a chat request, as counted by OpenAI chat models."""
+    model = model or "gpt-4o"
+    total = REPLY_OVERHEAD
+    for message in messages:
+        content = message.content
+        if not isinstance(content, str):
+            content = "".join(
+                part.get("text", "") if isinstance(part, dict) else str(part)
+                for part in content
+            )
+        total += MESSAGE_OVERHEAD + count_tokens(content, model)
+    return total
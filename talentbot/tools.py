@@ -1,14 +1,13 @@
-import time
-from typing import List, Optional, Type
+import logging
+from typing import Dict, List, Optional, Type
 
-import pandas as pd
-from jinja2 import Environment, PackageLoader, select_autoescape
 from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
 from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import BaseTool
-from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import (
     Runnable,
@@ -16,18 +15,26 @@ from langchain_core.runnables import (
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from talentbot.constants import BASE_URL
+from talentbot.constants import BASE_URL, RERANK_CROSS_ENCODER_MODEL, SEARCH_FILTERS
+from talentbot.filters import (
+    MAX_FILTER_IDS,
+    FacetStore,
+    SearchFilterExtractor,
+    SearchFilters,
+)
 from talentbot.models import Resume
-from talentbot.prompts import RERANK_PROMPT
-
-env = Environment(
-    loader=PackageLoader("talentbot", "templates"),
-    autoescape=select_autoescape(["html", "xml"]),
+from talentbot.rendering import RenderStore
+from talentbot.rerank import (
+    Candidate,
+    CrossEncoderRanker,
+    Reranker,
+    RerankResultCache,
 )
-template = env.get_template("resume.txt.jinja")
 
 _THRESHOLD = 70
 
+logger = logging.getLogger(__name__)
+
 
 def generate_resume_url(resume) -> str:
     return f"{BASE_URL}/Resumes?id={resume.id}"
@@ -42,6 +49,12 @@ class ResumeSearchTool(BaseTool):
     llm: Runnable
     retriever: BaseRetriever
     sesssion: Session
+    model: str = "openai_gpt_4o"
+    """Key of MODEL_OPTIONS used for reranking."""
+    cross_encoder: Optional[str] = RERANK_CROSS_ENCODER_MODEL or None
+    """Cross-encoder shortlisting candidates before the LLM, `None` to skip."""
+    search_filters: bool = SEARCH_FILTERS
+    """Restrict the search to resumes matching the requirements of the JD."""
     name = "resume_search"
     description = "useful when looking for resumes that match a job description."
     args_schema: Type[BaseModel] = ResumeSearchInput
@@ -51,52 +64,122 @@ class ResumeSearchTool(BaseTool):
 
         arbitrary_types_allowed = True
 
-    def _run(
-        self, jd: str, run_manager: Optional[CallbackManagerForToolRun] = None
-    ) -> List[dict]:
-        """Use the tool."""
-        documents = self.retriever.invoke(jd)
-        resume_ids = [doc.metadata["resume_id"] for doc in documents]
+    def _first_stage(self) -> Optional[CrossEncoderRanker]:
+        if not self.cross_encoder:
+            return None
+        # the summary is the short English text the vector index holds
+        return CrossEncoderRanker(
+            render=lambda row: row.summary, model_name=self.cross_encoder
+        )
+
+    def _reranker(self, texts: Dict[int, str]) -> Reranker:
+        return Reranker(
+            self.llm.with_config(configurable={"llm": self.model}),
+            render=lambda row: texts.get(row.id, ""),
+            threshold=_THRESHOLD,
+            cache=RerankResultCache(self.sesssion),
+            model=self.model,
+            first_stage=self._first_stage(),
+        )
+
+    def _filter_extractor(self) -> SearchFilterExtractor:
+        return SearchFilterExtractor(
+            self.llm.with_config(configurable={"llm": self.model}), model=self.model
+        )
+
+    def _filtered_retriever(self, filters: SearchFilters) -> BaseRetriever:
+        """The retriever restricted to the resumes matching `filters`.
+
+        Filters matching no resume, or too many to be worth pushing down,
+        leave the search unrestricted.
+        """
+        if filters.empty or not hasattr(self.retriever, "filtered"):
+            return self.retriever
+        resume_ids = FacetStore(self.sesssion).resume_ids(filters)
+        if not resume_ids or len(resume_ids) > MAX_FILTER_IDS:
+            logger.info(
+                f"Search filters {filters.describe()!r} match "
+                f"{len(resume_ids)} resumes, searching all resumes"
+            )
+            return self.retriever
+        logger.info(
+            f"Search filters {filters.describe()!r} match {len(resume_ids)} resumes"
+        )
+        return self.retriever.filtered(resume_ids)
+
+    def _candidates(self, documents: List[Document]) -> List[Candidate]:
+        # fused rankings keep the raw score apart, the cut works on that
+        scores = {
+            doc.metadata["resume_id"]: doc.metadata.get(
+                "vector_score", doc.metadata.get("score")
+            )
+            for doc in documents
+        }
         stmt = select(
-            Resume.id, Resume.name, Resume.data, Resume.summary, Resume.cv_file
-        ).where(Resume.id.in_(resume_ids))
+            Resume.id,
+            Resume.name,
+            Resume.summary,
+            Resume.cv_file,
+            Resume.updated_at,
+        ).where(Resume.id.in_(list(scores)))
         result = self.sesssion.execute(stmt).all()
-        now = time.time()
-        current_time = time.strftime("%A, %B %d, %Y %H:%M", time.localtime(now))
-        chain = RERANK_PROMPT | self.llm | JsonOutputParser()
-        inputs = []
-        for row in result:
-            txt = template.render(**row.data)
-            inputs.append(
-                {"id": row.id, "jd": jd, "resume": txt, "current_time": current_time}
+        return [
+            Candidate(
+                id=row.id,
+                name=row.name,
+                resume=row,
+                vector_score=scores[row.id],
+                updated_at=row.updated_at,
             )
+            for row in result
+        ]
+
+    def _format(self, results: List[dict]) -> List[dict]:
+        return [
+            {
+                "id": result["candidate"].id,
+                "name": result["candidate"].name,
+                "reason": result["reason"],
+                "resume_url": generate_resume_url(result["candidate"]),
+            }
+            for result in results
+        ]
 
-        results = chain.batch(inputs)
-        resumes = []
-        for i, resume in enumerate(result):
-            rank_result = results[i]
-            score = int(rank_result["score"])
-            if score >= _THRESHOLD:
-                reason = rank_result["reason"]
-                resumes.append(
-                    {
-                        "id": resume.id,
-                        "name": resume.name,
-                        "score": score,
-                        "reason": reason,
-                        "resume_url": generate_resume_url(resume),
-                    }
-                )
-
-        if not resumes:
+    def _run(
+        self, jd: str, run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> List[dict]:
+        """Use the tool."""
+        callbacks = run_manager.get_child() if run_manager else None
+        retriever = self.retriever
+        if self.search_filters:
+            filters = self._filter_extractor().extract(jd, callbacks)
+            retriever = self._filtered_retriever(filters)
+        documents = retriever.invoke(jd, config={"callbacks": callbacks})
+        if not documents:
             return []
+        candidates = self._candidates(documents)
+        texts = RenderStore(self.sesssion).texts(c.id for c in candidates)
+        results = self._reranker(texts).rerank(jd, candidates, callbacks=callbacks)
+        return self._format(results)
 
-        df = pd.DataFrame(resumes)
-        # sort by score
-        df = df.sort_values(by="score", ascending=False)
-        # remove score column
-        df = df.drop(columns=["score"])
-        return df.to_dict(orient="records")
+    async def _arun(
+        self, jd: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> List[dict]:
+        """Use the tool asynchronously."""
+        callbacks = run_manager.get_child() if run_manager else None
+        retriever = self.retriever
+        if self.search_filters:
+            filters = await self._filter_extractor().aextract(jd, callbacks)
+            retriever = self._filtered_retriever(filters)
+        documents = await retriever.ainvoke(jd, config={"callbacks": callbacks})
+        if not documents:
+            return []
+        candidates = self._candidates(documents)
+        texts = RenderStore(self.sesssion).texts(c.id for c in candidates)
+        results = await self._reranker(texts).arerank(
+            jd, candidates, callbacks=callbacks
+        )
+        return self._format(results)
 
 
 class ResumeSummarizationInput(BaseModel):
@@ -119,7 +202,9 @@ class ResumeSummarizationTool(BaseTool):
     ) -> List[dict]:
         """Use the tool."""
         resume_id = int(id)
-        resume = self.sesssion.get(Resume, resume_id)
+        resume = self.sesssion.execute(
+            select(Resume.summary).where(Resume.id == resume_id)
+        ).first()
         if not resume:
             return "Resume not found"
         return resume.summary
@@ -145,8 +230,7 @@ class ResumeDetailsTool(BaseTool):
     ) -> List[dict]:
         """Use the tool."""
         resume_id = int(id)
-        resume = self.sesssion.get(Resume, resume_id)
-        if not resume:
+        txt = RenderStore(self.sesssion).texts([resume_id]).get(resume_id)
+        if txt is None:
             return "Resume not found"
-        txt = template.render(**resume.data)
         return txt
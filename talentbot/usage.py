@@ -0,0 +1,127 @@
+"""Token usage accounting for LLM calls."""
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from talentbot.tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def token_usage(response: LLMResult) -> Dict[str, int]:
+    """Token usage of a response, for OpenAI and Anthropic.
+
+    `input_tokens` counts the whole prompt, `cached_tokens` the part read
+    from the provider's prompt cache and `cache_write_tokens` the part
+    written to it (Anthropic only, OpenAI caches for free).
+    """
+    output = response.llm_output or {}
+    usage = output.get("token_usage") or output.get("usage") or {}
+    if not usage:
+        # streamed and batched responses carry it per generation
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                metadata = getattr(message, "response_metadata", None) or {}
+                usage = metadata.get("token_usage") or metadata.get("usage") or {}
+                if usage:
+                    break
+    if "prompt_tokens" in usage:
+        details = usage.get("prompt_tokens_details") or {}
+        return {
+            "input_tokens": usage["prompt_tokens"] or 0,
+            "output_tokens": usage.get("completion_tokens") or 0,
+            "cached_tokens": details.get("cached_tokens") or 0,
+            "cache_write_tokens": 0,
+        }
+    # Anthropic counts cache reads and writes apart from the input tokens
+    cached = usage.get("cache_read_input_tokens") or 0
+    written = usage.get("cache_creation_input_tokens") or 0
+    return {
+        "input_tokens": (usage.get("input_tokens") or 0) + cached + written,
+        "output_tokens": usage.get("output_tokens") or 0,
+        "cached_tokens": cached,
+        "cache_write_tokens": written,
+    }
+
+
+def _model_name(kwargs: Dict[str, Any]) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return params.get("model") or params.get("model_name") or "unknown"
+
+
+class UsageTracker(BaseCallbackHandler):
+    """Sums the token usage of every LLM call it is passed to.
+
+    Each call is also logged with its name, the prompt tokens counted
+    before sending, the input, cached and output tokens billed and its
+    latency.
+
+    Usage:
+        tracker = UsageTracker()
+        chain.invoke(input, config={"callbacks": [tracker]})
+        tracker.totals()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        model = _model_name(kwargs)
+        with self._lock:
+            self._runs[run_id] = {
+                "name": kwargs.get("name") or model,
+                "prompt_tokens": count_message_tokens(messages[0], model),
+                "start": time.perf_counter(),
+            }
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        usage = token_usage(response)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage["input_tokens"]
+            self.output_tokens += usage["output_tokens"]
+            self.cached_tokens += usage["cached_tokens"]
+            self.cache_write_tokens += usage["cache_write_tokens"]
+            run = self._runs.pop(run_id, None)
+        if run:
+            logger.info(
+                f"LLM call {run['name']}: {run['prompt_tokens']} prompt tokens, "
+                f"{usage['input_tokens']} input ({usage['cached_tokens']} cached, "
+                f"{usage['cache_write_tokens']} cache writes), "
+                f"{usage['output_tokens']} output, "
+                f"{time.perf_counter() - run['start']:.1f}s"
+            )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cache_write_tokens": self.cache_write_tokens,
+            }
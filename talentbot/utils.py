@@ -1,16 +1,58 @@
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
 import boto3
 
+from talentbot.cache import TTLCache
 from talentbot.constants import BUCKET_NAME
 
+# signed urls are reused until a quarter of their lifetime is left
+_signed_urls = TTLCache(maxsize=10000)
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """Return the process-wide S3 client, boto3 clients are thread-safe."""
+    return boto3.client("s3")
+
+
+def generate_signed_urls(
+    files: Iterable[str], expiration=3600
+) -> Dict[str, Optional[str]]:
+    """Presign `get_object` URLs for many keys with a single client.
+
+    Signing is done locally, no request is sent to S3.
+    """
+    s3_client = get_s3_client()
+    reuse_for = expiration - max(60, expiration // 4)
+    urls = {}
+    for file in files:
+        if not file or file in urls:
+            continue
+        key = (BUCKET_NAME, file, expiration)
+        url = _signed_urls.get(key)
+        if url is None:
+            try:
+                url = s3_client.generate_presigned_url(
+                    "get_object",
+                    Params={"Bucket": BUCKET_NAME, "Key": file},
+                    ExpiresIn=expiration,
+                )
+            except Exception:
+                urls[file] = None
+                continue
+            if reuse_for > 0:
+                _signed_urls.set(key, url, ttl=reuse_for)
+        urls[file] = url
+    return urls
+
 
 def generate_signed_url(file, expiration=3600):
-    s3_client = boto3.client("s3")
-    try:
-        response = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": BUCKET_NAME, "Key": file},
-            ExpiresIn=expiration,
-        )
-        return response
-    except Exception:
-        return None
+    return generate_signed_urls([file], expiration).get(file)
+
+
+def jd_hash(jd: str) -> str:
+    """Hash of a job description, ignoring case and whitespace changes."""
+    normalized = " ".join(jd.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
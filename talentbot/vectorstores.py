@@ -0,0 +1,560 @@
+"""In-process vector store, an offline alternative to OpenSearch."""
+import atexit
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from talentbot.constants import (
+    INDEX_RESUMES,
+    LOCAL_VECTOR_DIR,
+    LOCAL_VECTOR_SAVE_INTERVAL,
+)
+from talentbot.embeddings import embed_queries
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_CAPACITY = 1024
+_EF_CONSTRUCTION = 200
+_EF_SEARCH = 64
+_M = 16
+# filters matching fewer chunks than this are searched exactly
+_EXACT_SEARCH_LIMIT = 20000
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise ImportError(
+            "Could not import hnswlib, please install it with "
+            "`pip install hnswlib` to use VECTOR_BACKEND=local."
+        ) from e
+    return hnswlib
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class _LocalIndex:
+    """One index directory: vectors, chunk metadata and an HNSW graph.
+
+    ``vectors.f32`` is a memory-mapped file holding the normalized vector of
+    every chunk at the row given by its label. ``chunks.sqlite3`` maps labels
+    to chunk ids, resume ids, texts and metadata. Both are written on every
+    change. ``hnsw.bin`` is a snapshot of the graph, saved at most every
+    `save_interval` seconds; chunks missing from a stale snapshot are
+    re-added from the vector file when it is loaded.
+    """
+
+    def __init__(self, path: str, save_interval: float = LOCAL_VECTOR_SAVE_INTERVAL):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._hnsw = None
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._conn = sqlite3.connect(
+            os.path.join(path, "chunks.sqlite3"), check_same_thread=False
+        )
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS chunks (
+                label INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                resume_id INTEGER,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_chunks_resume_id ON chunks (resume_id);
+            """
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        dim = self._get_meta("dim")
+        if dim:
+            self._open(int(dim))
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        row = row.fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    @property
+    def _graph_file(self) -> str:
+        return os.path.join(self.path, "hnsw.bin")
+
+    def _open(self, dim: int) -> None:
+        hnswlib = _import_hnswlib()
+        self.dim = dim
+        capacity = int(self._get_meta("capacity") or _INITIAL_CAPACITY)
+        self._map_vectors(capacity)
+        self._hnsw = hnswlib.Index(space="ip", dim=dim)
+        if os.path.exists(self._graph_file):
+            self._hnsw.load_index(self._graph_file, max_elements=capacity)
+        else:
+            self._hnsw.init_index(
+                max_elements=capacity, ef_construction=_EF_CONSTRUCTION, M=_M
+            )
+        self._hnsw.set_ef(_EF_SEARCH)
+        self._set_meta("dim", dim)
+        self._set_meta("capacity", capacity)
+        self._conn.commit()
+        self._recover()
+
+    def _map_vectors(self, capacity: int) -> None:
+        file = os.path.join(self.path, "vectors.f32")
+        size = capacity * self.dim * np.dtype(np.float32).itemsize
+        with open(file, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(
+            file, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+
+    def _recover(self) -> None:
+        """Bring the graph snapshot in line with the chunks table."""
+        live = {row[0] for row in self._conn.execute("SELECT label FROM chunks")}
+        in_graph = set(self._hnsw.get_ids_list())
+        for label in in_graph - live:
+            try:
+                self._hnsw.mark_deleted(label)
+            except RuntimeError:
+                pass  # already deleted
+        missing = sorted(live - in_graph)
+        if missing:
+            logger.info(f"Re-adding {len(missing)} chunks to {self.path}")
+            self._hnsw.add_items(np.asarray(self._vectors[missing]), missing)
+            self._dirty = True
+
+    def _reserve(self, max_label: int) -> None:
+        # labels only grow, so the graph never holds more elements than rows
+        capacity = self._vectors.shape[0]
+        if max_label < capacity:
+            return
+        capacity = max(capacity * 2, max_label + 1)
+        self._vectors.flush()
+        self._map_vectors(capacity)
+        self._hnsw.resize_index(capacity)
+        self._set_meta("capacity", capacity)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+        metadatas: Sequence[Dict],
+    ) -> None:
+        if not ids:
+            return
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            if self._hnsw is None:
+                self._open(vectors.shape[1])
+            # re-adding an id replaces the chunk
+            self._delete(self._select_labels("id", ids))
+            labels = []
+            for id, text, metadata in zip(ids, texts, metadatas):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (id, resume_id, text, metadata) "
+                    "VALUES (?, ?, ?, ?)",
+                    (id, metadata.get("resume_id"), text, json.dumps(metadata)),
+                )
+                labels.append(cursor.lastrowid)
+            self._reserve(max(labels))
+            self._vectors[labels] = vectors
+            self._vectors.flush()
+            self._conn.commit()
+            self._hnsw.add_items(vectors, labels)
+            self._count += len(labels)
+            self._dirty = True
+            self._maybe_save()
+
+    def delete(self, labels: List[int]) -> None:
+        with self._lock:
+            self._delete(labels)
+            self._conn.commit()
+            self._maybe_save()
+
+    def _delete(self, labels: List[int]) -> None:
+        if not labels:
+            return
+        self._execute_in("DELETE FROM chunks WHERE label IN ({})", labels)
+        for label in labels:
+            try:
+                self._hnsw.mark_deleted(label)
+            except RuntimeError:
+                pass
+        self._count -= len(labels)
+        self._dirty = True
+
+    def _execute_in(self, sql: str, values: Sequence, *params) -> List[Tuple]:
+        rows = []
+        values = list(values)
+        for i in range(0, len(values), 500):
+            batch = values[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows += self._conn.execute(
+                sql.format(placeholders), [*params, *batch]
+            ).fetchall()
+        return rows
+
+    def _select_labels(self, column: str, values: Iterable) -> List[int]:
+        sql = f"SELECT label FROM chunks WHERE {column} IN ({{}})"
+        return [row[0] for row in self._execute_in(sql, values)]
+
+    def labels(self, resume_ids=None, ids=None, filter=None) -> List[int]:
+        """Labels of the chunks matching all given conditions.
+
+        `filter` maps metadata keys to a value or a list of values.
+        """
+        conditions, params = [], []
+        for column, values in (("resume_id", resume_ids), ("id", ids)):
+            if values is not None:
+                values = list(values)
+                conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+                params += values
+        for key, values in (filter or {}).items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            values = list(values)
+            conditions.append(
+                f"json_extract(metadata, ?) IN ({','.join('?' * len(values))})"
+            )
+            params += [f"$.{key}", *values]
+        sql = "SELECT label FROM chunks"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, params)]
+
+    def chunks(self, labels: Sequence[int]) -> Dict[int, Tuple[str, str, Dict]]:
+        """Return ``{label: (id, text, metadata)}``."""
+        with self._lock:
+            rows = self._execute_in(
+                "SELECT label, id, text, metadata FROM chunks WHERE label IN ({})",
+                labels,
+            )
+        return {label: (id, text, json.loads(meta)) for label, id, text, meta in rows}
+
+    def search(
+        self, vectors: Sequence[Sequence[float]], k: int, labels=None
+    ) -> List[List[Tuple[int, float]]]:
+        """Return the ``(label, cosine similarity)`` of the nearest chunks.
+
+        With `labels`, only those chunks are considered.
+        """
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            if self._hnsw is None or not self._count:
+                return [[] for _ in vectors]
+            if labels is not None and len(labels) <= _EXACT_SEARCH_LIMIT:
+                return [self._exact(vector, labels, k) for vector in vectors]
+            allowed = set(labels).__contains__ if labels is not None else None
+            k = min(k, self._count if labels is None else len(labels))
+            try:
+                found, distances = self._hnsw.knn_query(vectors, k=k, filter=allowed)
+            except RuntimeError:
+                # the graph walk found fewer than k matches
+                labels = labels if labels is not None else self.labels()
+                return [self._exact(vector, labels, k) for vector in vectors]
+        return [
+            [(int(label), 1.0 - float(d)) for label, d in zip(row, dists)]
+            for row, dists in zip(found, distances)
+        ]
+
+    def _exact(self, vector: np.ndarray, labels: Sequence[int], k: int):
+        if not labels:
+            return []
+        labels = np.asarray(labels)
+        scores = self._vectors[labels] @ vector
+        top = np.argsort(-scores)[:k]
+        return [(int(labels[i]), float(scores[i])) for i in top]
+
+    def _maybe_save(self) -> None:
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty or self._hnsw is None:
+                return
+            tmp = self._graph_file + ".tmp"
+            self._hnsw.save_index(tmp)
+            os.replace(tmp, self._graph_file)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self.save()
+            self._conn.close()
+            self._vectors = None
+            self._hnsw = None
+
+
+_indexes: Dict[str, _LocalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_index(path: str, create: bool) -> Optional[_LocalIndex]:
+    """Return the process-wide index stored at `path`."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None and (create or os.path.isdir(path)):
+            index = _indexes[path] = _LocalIndex(path)
+        return index
+
+
+def _drop_index(path: str) -> None:
+    with _indexes_lock:
+        index = _indexes.pop(path, None)
+    if index is not None:
+        index.close()
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@atexit.register
+def _save_indexes() -> None:
+    for index in list(_indexes.values()):
+        try:
+            index.save()
+        except Exception as e:
+            logger.warning(f"Failed to save {index.path}: {e}")
+
+
+class _Aliases:
+    """Alias -> index name mapping kept in ``aliases.json``."""
+
+    def __init__(self, path: str):
+        self.file = os.path.join(path, "aliases.json")
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._aliases: Dict[str, str] = {}
+
+    def get(self) -> Dict[str, str]:
+        with self._lock:
+            try:
+                mtime = os.stat(self.file).st_mtime_ns
+            except FileNotFoundError:
+                return {}
+            if mtime != self._mtime:
+                with open(self.file) as f:
+                    self._aliases = json.load(f)
+                self._mtime = mtime
+            return dict(self._aliases)
+
+    def set(self, alias: str, index_name: str) -> None:
+        aliases = self.get()
+        aliases[alias] = index_name
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        tmp = self.file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(aliases, f)
+        os.replace(tmp, self.file)
+
+
+_aliases: Dict[str, _Aliases] = {}
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store backed by an in-process hnswlib index under `path`.
+
+    Mirrors the resume helpers of `ResumeVectorSearch`, so either can be
+    used by the indexer and the retriever. Every index lives in its own
+    directory, and indices of the same path are shared within the process.
+    Search scores are cosine similarities rescaled to ``[0, 1]``.
+
+    Besides the metadata `filter` (``{key: value or [values]}``), searches
+    accept `resume_ids` to only return chunks of those resumes.
+    """
+
+    supports_aliases = True
+
+    def __init__(
+        self,
+        index_name: str,
+        embedding_function: Embeddings,
+        path: str = LOCAL_VECTOR_DIR,
+    ):
+        self.index_name = index_name
+        self.embedding_function = embedding_function
+        self.path = path
+        self._aliases = _aliases.setdefault(path, _Aliases(path))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def for_index(self, index_name: str) -> "LocalVectorStore":
+        return LocalVectorStore(index_name, self.embedding_function, self.path)
+
+    def _index_path(self) -> str:
+        name = self._aliases.get().get(self.index_name, self.index_name)
+        return os.path.join(self.path, name)
+
+    def _index(self, create: bool = False) -> Optional[_LocalIndex]:
+        return _get_index(self._index_path(), create)
+
+    def index_exists(self) -> bool:
+        return os.path.isdir(self._index_path())
+
+    def delete_index(self) -> None:
+        _drop_index(self._index_path())
+
+    def count(self) -> int:
+        index = self._index()
+        return len(index) if index else 0
+
+    def save(self) -> None:
+        """Write the graph snapshot now instead of on the next interval."""
+        index = self._index()
+        if index:
+            index.save()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self.embedding_function.embed_documents(texts)
+        self._index(create=True).add(ids, texts, vectors, metadatas)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        index = self._index()
+        if index is None or not ids:
+            return False
+        index.delete(index.labels(ids=ids))
+        return True
+
+    def resume_document_ids(self, resume_ids: Iterable[int]) -> List[str]:
+        index = self._index()
+        resume_ids = list(resume_ids)
+        if index is None or not resume_ids:
+            return []
+        labels = index.labels(resume_ids=resume_ids)
+        return [id for id, _, _ in index.chunks(labels).values()]
+
+    def delete_resumes(self, resume_ids: Iterable[int]) -> Optional[bool]:
+        """Delete all chunks belonging to the given resumes."""
+        index = self._index()
+        resume_ids = list(resume_ids)
+        if index is None or not resume_ids:
+            return False
+        labels = index.labels(resume_ids=resume_ids)
+        index.delete(labels)
+        return bool(labels)
+
+    def swap_alias(self, alias: str) -> List[str]:
+        """Point `alias` at this store's index, return the previous index.
+
+        A directory that still uses the alias name is removed.
+        """
+        previous = self._aliases.get().get(alias)
+        if previous is None and os.path.isdir(os.path.join(self.path, alias)):
+            _drop_index(os.path.join(self.path, alias))
+        self._aliases.set(alias, self.index_name)
+        return [previous] if previous and previous != self.index_name else []
+
+    def _search(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        filter: Optional[Dict] = None,
+        resume_ids: Optional[Iterable[int]] = None,
+        **kwargs: Any,
+    ) -> List[List[Tuple[Document, float]]]:
+        index = self._index()
+        if index is None:
+            return [[] for _ in vectors]
+        labels = None
+        if filter or resume_ids is not None:
+            labels = index.labels(resume_ids=resume_ids, filter=filter)
+        hits = index.search(vectors, k, labels)
+        chunks = index.chunks([label for row in hits for label, _ in row])
+        results = []
+        for row in hits:
+            docs = []
+            for label, similarity in row:
+                if label not in chunks:
+                    continue  # deleted meanwhile
+                _, text, metadata = chunks[label]
+                document = Document(page_content=text, metadata=dict(metadata))
+                docs.append((document, (1.0 + similarity) / 2))
+            results.append(docs)
+        return results
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        docs_and_scores = self.similarity_search_with_score(query, k, **kwargs)
+        return [doc for doc, _ in docs_and_scores]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        vector = self.embedding_function.embed_query(query)
+        return self._search([vector], k, **kwargs)[0]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self._search([embedding], k, **kwargs)[0]]
+
+    def batch_similarity_search_with_score(
+        self, queries: List[str], k: int = 4, **kwargs: Any
+    ) -> List[List[Tuple[Document, float]]]:
+        """Search several queries with one embedding pass."""
+        if not queries:
+            return []
+        vectors = embed_queries(self.embedding_function, queries)
+        return self._search(vectors, k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        index_name: str = INDEX_RESUMES,
+        path: str = LOCAL_VECTOR_DIR,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(index_name, embedding, path)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
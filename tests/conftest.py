@@ -0,0 +1,4 @@
+import os
+
+# talentbot.chain creates its LLM clients on import
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,106 @@
+import pytest
+from langchain_core.documents import Document
+
+from talentbot import batch
+from talentbot.batch import BatchItem, BatchJob, FakeBatchProvider
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Steps of `batch.ingest` in call order, without a database."""
+    calls = []
+
+    def upsert_resumes(session, rows):
+        calls.append(("upsert", [cv_file for _, cv_file, _ in rows]))
+        return [len(calls) * 100 + i for i in range(len(rows))]
+
+    def index_resumes(db, text_splitter, summaries):
+        calls.append(("index", list(summaries)))
+
+    class SourceStore:
+        def __init__(self, session):
+            pass
+
+        def add_many(self, rows):
+            calls.append(("record", [row["resume_id"] for row in rows]))
+
+    monkeypatch.setattr(batch, "upsert_resumes", upsert_resumes)
+    monkeypatch.setattr(batch, "index_resumes", index_resumes)
+    monkeypatch.setattr(batch, "SourceStore", SourceStore)
+    return calls
+
+
+def _sources(count):
+    for i in range(count):
+        item = BatchItem(
+            id=f"item{i}",
+            name=f"resume{i}.pdf",
+            cv_file=f"resumes/{i}/resume{i}.pdf",
+            file_hash=f"file{i}",
+            text_hash=f"text{i}",
+        )
+        yield item, Document(page_content=f"Resume {i}", metadata={})
+
+
+def _finished_job(tmp_path, count):
+    job = BatchJob(str(tmp_path / "job"))
+    assert batch.prepare(job, _sources(count), mode="separate", model="test") == count
+    provider = FakeBatchProvider(job.path)
+    batch.submit(job, provider)
+    assert batch.poll(job, provider) == "completed"
+    return job
+
+
+def test_prepare_submit_poll_ingest(tmp_path, calls):
+    job = _finished_job(tmp_path, 3)
+
+    result = batch.ingest(job, None, None, None, batch_size=2)
+
+    assert result["ingested"] == 3
+    assert result["failed"] == 0
+    # sources are recorded only once their chunk is indexed
+    assert [step for step, _ in calls] == [
+        "upsert",
+        "index",
+        "record",
+        "upsert",
+        "index",
+        "record",
+    ]
+    assert calls[2][1] == calls[1][1]
+    state = BatchJob(job.path).state
+    assert state["status"] == "ingested"
+    assert state["ingested_items"] == ["item0", "item1", "item2"]
+
+
+def test_ingest_resumes_after_a_failed_chunk(tmp_path, calls, monkeypatch):
+    job = _finished_job(tmp_path, 2)
+    index_resumes = batch.index_resumes
+
+    def failing_index(db, text_splitter, summaries):
+        index_resumes(db, text_splitter, summaries)
+        if len(calls) > 2:
+            raise RuntimeError("index down")
+
+    monkeypatch.setattr(batch, "index_resumes", failing_index)
+    with pytest.raises(RuntimeError):
+        batch.ingest(job, None, None, None, batch_size=1)
+    # the failed chunk's file isn't recorded, it won't be skipped as a duplicate
+    assert [step for step, _ in calls] == [
+        "upsert",
+        "index",
+        "record",
+        "upsert",
+        "index",
+    ]
+    job = BatchJob(job.path)
+    assert job.state["status"] == "ingesting"
+    assert job.state["ingested_items"] == ["item0"]
+
+    monkeypatch.setattr(batch, "index_resumes", index_resumes)
+    calls.clear()
+    result = batch.ingest(job, None, None, None, batch_size=1)
+
+    assert result["ingested"] == 1
+    assert calls[0] == ("upsert", ["resumes/1/resume1.pdf"])
+    assert BatchJob(job.path).state["status"] == "ingested"